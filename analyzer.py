@@ -0,0 +1,73 @@
+from array import array
+
+import backtrader as bt
+import numpy as np
+
+from metrics import summarize
+
+
+def _num2date(nums):
+    # Backtrader 的日期数值整数部分是公历序数（0001-01-01 为 1）
+    return np.datetime64("0001-01-01", "D") + (np.asarray(nums, dtype=np.float64).astype(np.int64) - 1)
+
+
+class Metrics(bt.Analyzer):
+    """
+    代替 SharpeRatio / DrawDown / TradeAnalyzer / Returns 四个分析器
+
+    运行中只记录每根 K 线的总资金和日期（array，每根 16 字节）以及交易计数，
+    结束时用 NumPy 一次算出全部指标，get_analysis 返回 summarize 的扁平记录。
+    daily 为 True 时（分钟线回测）每个交易日只保留最后一根 K 线的记录，指标仍按日线口径计算，内存随天数而不是分钟数增长。
+    """
+    params = (("riskfreerate", 0.01), ("daily", False))
+
+    def start(self):
+        self._start_cash = self.strategy.broker.getvalue()
+        self._value = self._start_cash
+        self._values = array("d")
+        self._dates = array("d")
+        self._exposed = 0
+        self._opened = 0
+        self._won = 0
+        self._open_trades = 0  # 当前未平仓的交易数，多数据源时按任意股票有持仓计算暴露
+        self._day_exposed = False
+        self.record = None
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        # 与 DrawDown / TimeReturn 一样使用通知时的总资金
+        self._value = value
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self._opened += 1
+            self._open_trades += 1
+        elif trade.status == trade.Closed:
+            self._open_trades -= 1
+            if trade.pnlcomm >= 0.0:
+                self._won += 1
+
+    def next(self):
+        dt = self.strategy.datetime[0]
+        if self.p.daily and self._dates and int(self._dates[-1]) == int(dt):
+            # 同一交易日内覆盖，暴露按当天最后一根 K 线计
+            self._exposed -= self._day_exposed
+            self._values[-1] = self._value
+            self._dates[-1] = dt
+        else:
+            self._values.append(self._value)
+            self._dates.append(dt)
+        self._day_exposed = bool(self._open_trades)
+        self._exposed += self._day_exposed
+
+    def stop(self):
+        # 资金曲线和日期保留在分析器上，供 walkforward 等需要拼接曲线的场合使用
+        self.equity = np.frombuffer(self._values, dtype=np.float64)
+        self.dates = _num2date(self._dates)
+        self.record = summarize(
+            self.equity, self._start_cash, self.strategy.broker.getcash(), dates=self.dates,
+            total_trades=self._opened, won_trades=self._won, exposed_bars=self._exposed,
+            riskfreerate=self.p.riskfreerate,
+        )
+
+    def get_analysis(self):
+        return self.record
@@ -0,0 +1,213 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from utils import normalize
+from strategy import TailBuy
+from buy_with_limit import LimitBuy
+from bt_example import MyStrategy
+from fast_engine import run_tailbuy
+from analyzer import Metrics
+from feeds import ArrayData
+
+ANALYZERS = {
+    "sharpe": bt.analyzers.SharpeRatio,
+    "drawdown": bt.analyzers.DrawDown,
+    "tradeanalyzer": bt.analyzers.TradeAnalyzer,
+    "returns": bt.analyzers.Returns,
+    "metrics": Metrics,
+}
+STRATEGIES = {
+    "tailbuy": TailBuy,
+    "limitbuy": LimitBuy,
+    "sma": MyStrategy,
+}
+
+
+def synthetic_raw(bars, seed=0, start="1800-01-01", base_price=10.0):
+    """
+    生成与 ak.stock_zh_a_hist 列结构相同的随机游走日线，不需要网络
+
+    日期从 start 开始取工作日，bars 较大时会跨越上百年，只用于计时。
+    """
+    rng = np.random.default_rng(seed)
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(start, "D") + int(bars * 1.5) + 10)
+    days = days[np.is_busday(days)][:bars]
+    close = base_price * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+    open_ = close * np.exp(rng.normal(0, 0.01, bars))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, bars)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.015, bars)))
+    volume = rng.integers(10_000, 1_000_000, bars)
+    return pd.DataFrame({
+        "日期": days.astype(object),
+        "股票代码": "000000",
+        "开盘": open_.round(2),
+        "收盘": close.round(2),
+        "最高": high.round(2),
+        "最低": low.round(2),
+        "成交量": volume,
+        "成交额": (volume * close).round(2),
+    })
+
+
+def synthetic_frame(bars, seed=0):
+    """preprocess 格式的随机日线"""
+    return normalize(synthetic_raw(bars, seed))
+
+
+def timeit(func, repeat):
+    """运行 repeat 次，返回每次的耗时（秒）"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def run_cerebro(frames, strategy=None, analyzers=(), feed=bt.feeds.PandasData, **params):
+    """对每个 DataFrame 各跑一次 Cerebro，模拟 tail_buy_filter 逐只回测"""
+    for df in frames:
+        cerebro = bt.Cerebro()
+        cerebro.addstrategy(strategy or bt.Strategy, **params)
+        for name in analyzers:
+            cerebro.addanalyzer(ANALYZERS[name], _name=name)
+        cerebro.broker.setcash(100000)
+        cerebro.broker.setcommission(commission=0.002)
+        cerebro.adddata(feed(dataname=df))
+        cerebro.run()
+
+
+def cases(bar_counts, symbol_counts, scan_bars):
+    """
+    生成 (名称, 参数, 被计时的函数) 列表，数据在计时之外准备好
+    """
+    for bars in bar_counts:
+        raw = synthetic_raw(bars)
+        frames = [normalize(raw)]
+        yield "normalize", {"bars": bars, "symbols": 1}, lambda raw=raw: normalize(raw)
+        # 只加载数据不执行任何逻辑，作为其他 Cerebro 用例的基准
+        yield "feed_load", {"bars": bars, "symbols": 1}, lambda frames=frames: run_cerebro(frames)
+        yield "feed_load_array", {"bars": bars, "symbols": 1}, lambda frames=frames: run_cerebro(frames, feed=ArrayData)
+        for name, strategy in STRATEGIES.items():
+            yield f"run_{name}", {"bars": bars, "symbols": 1}, \
+                lambda frames=frames, strategy=strategy: run_cerebro(frames, strategy)
+            yield f"run_{name}_array", {"bars": bars, "symbols": 1}, \
+                lambda frames=frames, strategy=strategy: run_cerebro(frames, strategy, feed=ArrayData)
+        for name in ANALYZERS:
+            yield f"analyzer_{name}", {"bars": bars, "symbols": 1}, \
+                lambda frames=frames, name=name: run_cerebro(frames, analyzers=[name])
+        yield "fast_tailbuy", {"bars": bars, "symbols": 1}, lambda frames=frames: run_tailbuy(frames[0])
+    for symbols in symbol_counts:
+        frames = [synthetic_frame(scan_bars, seed) for seed in range(symbols)]
+        yield "scan_tailbuy", {"bars": scan_bars, "symbols": symbols}, \
+            lambda frames=frames: run_cerebro(frames, TailBuy, analyzers=["sharpe", "drawdown", "tradeanalyzer", "returns"])
+        yield "scan_tailbuy_metrics", {"bars": scan_bars, "symbols": symbols}, \
+            lambda frames=frames: run_cerebro(frames, TailBuy, analyzers=["metrics"])
+        # 各脚本当前的默认组合：ArrayData + Metrics
+        yield "scan_tailbuy_array", {"bars": scan_bars, "symbols": symbols}, \
+            lambda frames=frames: run_cerebro(frames, TailBuy, analyzers=["metrics"], feed=ArrayData)
+        yield "scan_fast_tailbuy", {"bars": scan_bars, "symbols": symbols}, \
+            lambda frames=frames: [run_tailbuy(df) for df in frames]
+
+
+def run(bar_counts, symbol_counts, scan_bars=2500, repeat=3, only=None):
+    results = []
+    for name, params, func in cases(bar_counts, symbol_counts, scan_bars):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        # 大数据量的用例只跑一次，避免整套基准耗时过长
+        n = 1 if params["bars"] * params["symbols"] >= 50_000 else repeat
+        try:
+            times = timeit(func, n)
+            error = None
+        except Exception as e:
+            times, error = [], repr(e)
+        record = {"case": name, **params, "repeat": n, "error": error}
+        if times:
+            record.update({"min": min(times), "median": statistics.median(times)})
+            record["bars_per_sec"] = params["bars"] * params["symbols"] / record["median"]
+            # 单独计时的 analyzer 扣除相同数据量下空策略的耗时，得到 analyzer 自身的开销
+            base = next((r for r in results if r["case"] == "feed_load" and r["bars"] == params["bars"] and r.get("median")), None)
+            if name.startswith("analyzer_") and base:
+                record["net"] = record["median"] - base["median"]
+        results.append(record)
+        status = f"{record['median'] * 1000:10.2f} ms" if times else f"失败 {error}"
+        print(f"{name:<24} bars={params['bars']:<7} symbols={params['symbols']:<4} {status}", flush=True)
+    return results
+
+
+def environment():
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "backtrader": bt.__version__,
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    与基准结果按 (case, bars, symbols) 对比中位数耗时，返回变慢超过 threshold 倍的用例
+    """
+    base = {(r["case"], r["bars"], r["symbols"]): r for r in baseline["results"] if r.get("median")}
+    regressions = []
+    print(f"\n与基准 ({baseline['environment']['timestamp']}) 对比:")
+    for r in results:
+        key = (r["case"], r["bars"], r["symbols"])
+        if not r.get("median") or key not in base:
+            continue
+        ratio = r["median"] / base[key]["median"]
+        r["baseline_median"] = base[key]["median"]
+        r["ratio"] = ratio
+        flag = "  <-- 变慢" if ratio > threshold else ""
+        print(f"{r['case']:<24} bars={r['bars']:<7} symbols={r['symbols']:<4} x{ratio:.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(r)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据加载与回测热点路径的基准测试（使用随机数据，不需要网络）")
+    parser.add_argument("--bars", default="1000,10000,100000", help="comma separated bar counts")
+    parser.add_argument("--symbols", default="1,10,50", help="comma separated symbol counts for the scan cases")
+    parser.add_argument("--scan_bars", default=2500, type=int, help="bars per symbol in the scan cases")
+    parser.add_argument("--repeat", default=3, type=int, help="repetitions per case")
+    parser.add_argument("--only", default=None, help="comma separated case name prefixes to run")
+    parser.add_argument("--quick", action="store_true", help="small sizes for a fast smoke run")
+    parser.add_argument("--output", default="bench_results.json", help="machine readable results")
+    parser.add_argument("--baseline", default=None, help="baseline results file to compare against")
+    parser.add_argument("--save_baseline", default=None, help="also write the results to this baseline file")
+    parser.add_argument("--threshold", default=1.2, type=float, help="slowdown ratio reported as a regression")
+    parser.add_argument("--fail_on_regression", action="store_true", help="exit with status 1 when a case regressed")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.bars, args.symbols, args.scan_bars, args.repeat = "1000,10000", "1,10", 1000, 1
+    results = run(
+        [int(b) for b in args.bars.split(",")],
+        [int(s) for s in args.symbols.split(",")],
+        scan_bars=args.scan_bars,
+        repeat=args.repeat,
+        only=args.only.split(",") if args.only else None,
+    )
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    report = {"environment": environment(), "results": results}
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"\n结果已写入 {args.output}" + (f", 发现 {len(regressions)} 个变慢的用例" if args.baseline else ""))
+    sys.exit(1 if args.fail_on_regression and regressions else 0)
@@ -1,13 +1,9 @@
 from datetime import datetime
 
 import backtrader as bt  # 升级到最新版
-import matplotlib.pyplot as plt  # 由于 Backtrader 的问题，此处要求 pip install matplotlib==3.2.2
 
 from utils import preprocess
-
-start_date = datetime(2020, 1, 1)  # 回测开始时间
-end_date = datetime(2020, 6, 16)  # 回测结束时间
-stock_df = preprocess(symbol="600036", adjust="hfq", start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
+from feeds import ArrayData
 
 class MyStrategy(bt.Strategy):
     """
@@ -44,24 +40,30 @@ class MyStrategy(bt.Strategy):
                 self.order = self.sell(size=100)  # 执行卖出
 
 
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt  # 由于 Backtrader 的问题，此处要求 pip install matplotlib==3.2.2
+
+    start_date = datetime(2020, 1, 1)  # 回测开始时间
+    end_date = datetime(2020, 6, 16)  # 回测结束时间
+    stock_df = preprocess(symbol="600036", adjust="hfq", start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
 
-cerebro = bt.Cerebro()  # 初始化回测系统
-data = bt.feeds.PandasData(dataname=stock_df, fromdate=start_date, todate=end_date)  # 加载数据
-cerebro.adddata(data)  # 将数据传入回测系统
-cerebro.addstrategy(MyStrategy)  # 将交易策略加载到回测系统中
-start_cash = 1000000
-cerebro.broker.setcash(start_cash)  # 设置初始资本为 100000
-cerebro.broker.setcommission(commission=0.002)  # 设置交易手续费为 0.2%
-cerebro.run()  # 运行回测系统
+    cerebro = bt.Cerebro()  # 初始化回测系统
+    data = ArrayData(dataname=stock_df, fromdate=start_date, todate=end_date)  # 加载数据
+    cerebro.adddata(data)  # 将数据传入回测系统
+    cerebro.addstrategy(MyStrategy)  # 将交易策略加载到回测系统中
+    start_cash = 1000000
+    cerebro.broker.setcash(start_cash)  # 设置初始资本为 100000
+    cerebro.broker.setcommission(commission=0.002)  # 设置交易手续费为 0.2%
+    cerebro.run()  # 运行回测系统
 
-port_value = cerebro.broker.getvalue()  # 获取回测结束后的总资金
-pnl = port_value - start_cash  # 盈亏统计
+    port_value = cerebro.broker.getvalue()  # 获取回测结束后的总资金
+    pnl = port_value - start_cash  # 盈亏统计
 
-print(f"初始资金: {start_cash}\n回测期间:{start_date.strftime('%Y%m%d')}:{end_date.strftime('%Y%m%d')}")
-print(f"总资金: {round(port_value, 2)}")
-print(f"净收益: {round(pnl, 2)}")
+    print(f"初始资金: {start_cash}\n回测期间:{start_date.strftime('%Y%m%d')}:{end_date.strftime('%Y%m%d')}")
+    print(f"总资金: {round(port_value, 2)}")
+    print(f"净收益: {round(pnl, 2)}")
 
-# plt.rcParams["font.sans-serif"] = ["SimHei"]
-# plt.rcParams["axes.unicode_minus"] = False
-# cerebro.plot(style='candlestick')
-# plt.show()
\ No newline at end of file
+    # plt.rcParams["font.sans-serif"] = ["SimHei"]
+    # plt.rcParams["axes.unicode_minus"] = False
+    # cerebro.plot(style='candlestick')
+    # plt.show()
\ No newline at end of file
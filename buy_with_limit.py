@@ -5,6 +5,10 @@ from datetime import datetime, timedelta
 import backtrader as bt
 
 from utils import preprocess
+from feeds import ArrayData
+from instrument import Recorder, instrument_strategy, run_cerebro, summarize
+from analyzer import Metrics
+from metrics import print_report
 
 
 class LimitBuy(bt.Strategy):
@@ -19,6 +23,7 @@ class LimitBuy(bt.Strategy):
         ("stop_profit_ratio", 0.05),
         ("order_size", 100),  # 新增参数：订单大小
         ("valid_days", 1),  # 订单有效天数
+        ("journal", None),  # journal.Journal，设置后订单、成交和平仓事件写入交易日志
     )
 
     def __init__(self):
@@ -96,6 +101,8 @@ class LimitBuy(bt.Strategy):
             # 订单提交/接受状态，无需处理
             return
 
+        if self.params.journal:
+            self.params.journal.order(order)
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
@@ -130,10 +137,14 @@ class LimitBuy(bt.Strategy):
     def notify_trade(self, trade):
         if not trade.isclosed:
             return
+        if self.params.journal:
+            self.params.journal.trade(trade)
         self.log(f"盈利 {trade.pnl:.2f}, 现金 {self.broker.cash:.2f}")
 
     def log(self, txt, dt=None):
         """日志记录函数"""
+        if self.params.journal:
+            self.params.journal.log(self.datas[0], txt)
         if self.params.printlog:
             dt = dt or self.datas[0].datetime.date(0)
             print(f"{dt.isoformat()} {txt}")
@@ -147,15 +158,14 @@ if __name__ == "__main__":
     parser.add_argument(
         "--end_date", default="today", type=str, help="choose end date of back test"
     )
+    parser.add_argument("--profile", default=None, type=str, help="write per-phase timings to this JSON lines file")
+    parser.add_argument("--trace_memory", action="store_true", help="record per-phase peak Python allocations with tracemalloc (slow)")
     args = parser.parse_args()
+    recorder = Recorder(args.profile, trace_memory=args.trace_memory)
 
     cerebro = bt.Cerebro()  # 初始化回测系统
-    cerebro.addstrategy(LimitBuy, printlog=True)  # 将交易策略加载到回测系统中
-    # 添加分析器
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe")
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="drawdown")
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="tradeanalyzer")
-    cerebro.addanalyzer(bt.analyzers.Returns, _name="returns")
+    cerebro.addstrategy(instrument_strategy(LimitBuy) if recorder else LimitBuy, printlog=True)  # 将交易策略加载到回测系统中
+    cerebro.addanalyzer(Metrics, _name="metrics")  # 添加分析器
 
     start_cash = 100000
     cerebro.broker.setcash(start_cash)  # 设置初始资本为 100000
@@ -167,51 +177,22 @@ if __name__ == "__main__":
         end_date = datetime.today()
     else:
         end_date = datetime.strptime(args.end_date, date_format)
-    stock_df = preprocess(
-        symbol=args.symbol,
-        adjust="hfq",
-        start_date=start_date.strftime("%Y%m%d"),
-        end_date=end_date.strftime("%Y%m%d"),
-    )
-    if stock_df is None:
-        exit()
-    data = bt.feeds.PandasData(
-        dataname=stock_df, fromdate=start_date, todate=end_date
-    )  # 加载数据
-    cerebro.adddata(data)  # 将数据传入回测系统
-
-    results = cerebro.run()  # 运行回测系统
-    strategy_stats = results[0]
-
-    # 获取分析结果
-    port_value = cerebro.broker.getvalue()  # 获取回测结束后的总资金
-    cash = cerebro.broker.getcash()
-    pnl = port_value - start_cash  # 盈亏统计
-    sharpe = strategy_stats.analyzers.sharpe.get_analysis()
-    drawdown = strategy_stats.analyzers.drawdown.get_analysis()
-    trade_stats = strategy_stats.analyzers.tradeanalyzer.get_analysis()
-    returns = strategy_stats.analyzers.returns.get_analysis()
-
-    print(
-        f"回测期间: {start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')}"
-    )
-    print(f"初始资金: {start_cash}")
-    print(f"总资金: {port_value:.2f}, 含现金 {cash:.2f}")
-    print(f"净收益: {pnl:.2f}")
-    print(
-        f"夏普比率: {sharpe['sharperatio']:.4f}"
-        if sharpe["sharperatio"] is not None
-        else "夏普比率: 无法计算 (None)"
-    )
-    print(f"最大回撤: {drawdown.max.drawdown:.2f}%")
-    print(f"总交易数: {trade_stats.total.total}")
-    # 获取赢利交易总数，若不存在则为0
-    won_total = trade_stats.get("won", {}).get("total", 0)
-    # 获取总交易数，若不存在则为0
-    total_total = trade_stats.get("total", {}).get("total", 0)
-    if total_total > 0:
-        win_rate = (won_total / total_total) * 100
-        print(f"胜率: {win_rate:.2f}%")
-    else:
-        print("胜率: 无法计算 (None)")
-    print(f"年化收益率: {returns['rnorm100']:.2f}%")
+    with recorder.symbol(args.symbol, "backtest") as profile:
+        stock_df = preprocess(
+            symbol=args.symbol,
+            adjust="hfq",
+            start_date=start_date.strftime("%Y%m%d"),
+            end_date=end_date.strftime("%Y%m%d"),
+        )
+        if stock_df is None:
+            exit()
+        data = ArrayData(
+            dataname=stock_df, fromdate=start_date, todate=end_date
+        )  # 加载数据
+        cerebro.adddata(data)  # 将数据传入回测系统
+
+        results = run_cerebro(cerebro)  # 运行回测系统
+    recorder.write(profile)
+    print_report(results[0].analyzers.metrics.get_analysis(), start_cash, start_date, end_date)
+    if recorder:
+        print(summarize([profile.record()]))
@@ -0,0 +1,467 @@
+import json
+import os
+import random
+import time
+import zlib
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from cache_arrays import multiplier
+
+DATE_FORMAT = "%Y%m%d"
+COLUMNS = ["date", "open", "close", "high", "low", "volume"]
+PRICE_COLUMNS = ["open", "close", "high", "low"]
+# 可以由不复权价格和后复权因子推导的复权方式
+DERIVED_ADJUSTS = ("qfq", "hfq")
+# 收盘后再拉取的日线视为完整，盘中拉取的当日 K 线下次需要重新获取
+MARKET_CLOSE = (15, 30)
+
+
+def _has_parquet():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@dataclass
+class CacheStats:
+    """缓存命中统计"""
+    hits: int = 0  # 完全由本地数据满足
+    partial: int = 0  # 仅补齐缺失区间
+    misses: int = 0  # 本地无数据，整段下载
+    refreshes: int = 0  # 复权价格变化或过期导致整段重新下载
+    fetch_calls: int = 0
+    factor_calls: int = 0  # 复权因子表的下载次数
+    rows_fetched: int = 0
+    rows_served: int = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        total = self.hits + self.partial + self.misses + self.refreshes
+        rate = self.hits / total * 100 if total else 0.0
+        return (
+            f"缓存请求 {total} 次, 命中 {self.hits} ({rate:.1f}%), 补齐 {self.partial}, "
+            f"未命中 {self.misses}, 刷新 {self.refreshes}, 下载 {self.fetch_calls} 次/{self.rows_fetched} 行, "
+            f"复权因子 {self.factor_calls} 次"
+        )
+
+
+class BarCache:
+    """
+    按 symbol + adjust 存储日线的本地列式缓存
+
+    每个标的一个数据文件（有 pyarrow 时为 Parquet，否则为 pickle）加一个 json 元数据文件，
+    元数据记录已覆盖的日期区间。读取时只下载缺失的区间并追加写回。
+
+    load 传入 fetch_factors 时 qfq / hfq 不再单独缓存：只存一份不复权日线和一张后复权因子表
+    （factor/{symbol}.json，每次除权除息一行），读取时按因子向量化计算复权价格。不复权价格不会因分红而改变，
+    除权除息只需要重新下载很小的因子表，而不必整段重新下载日线。
+    """
+
+    def __init__(self, root="data_cache", fmt=None, max_age_days=None, tolerance=1e-6):
+        self.root = root
+        self.fmt = fmt or ("parquet" if _has_parquet() else "pickle")
+        self.max_age_days = max_age_days  # 超过该天数的缓存整段重新下载，None 表示不过期
+        self.tolerance = tolerance  # 衔接处收盘价相对误差超过该值时认为复权因子已变化
+        self.stats = CacheStats()
+
+    def _path(self, symbol, adjust):
+        ext = "parquet" if self.fmt == "parquet" else "pkl"
+        return os.path.join(self.root, adjust or "raw", f"{symbol}.{ext}")
+
+    def _meta_path(self, symbol, adjust):
+        return os.path.join(self.root, adjust or "raw", f"{symbol}.json")
+
+    def read(self, symbol, adjust):
+        """读取缓存的全部数据和元数据，不存在时返回 (None, None)"""
+        path, meta_path = self._path(symbol, adjust), self._meta_path(symbol, adjust)
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            return None, None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if self.fmt == "parquet":
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_pickle(path)
+        return df, meta
+
+    def write(self, symbol, adjust, df, start, end):
+        """写入数据并记录覆盖区间 [start, end]，先写临时文件再替换以免中断时损坏"""
+        path, meta_path = self._path(symbol, adjust), self._meta_path(symbol, adjust)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df = df.reset_index(drop=True)[COLUMNS]
+        tmp = path + ".tmp"
+        if self.fmt == "parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, path)
+        meta = {
+            "start": start.strftime(DATE_FORMAT),
+            "end": end.strftime(DATE_FORMAT),
+            "rows": int(len(df)),
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def invalidate(self, symbol=None, adjust=None):
+        """删除指定标的（或全部）缓存，adjust 为 None 时同时删除复权因子表"""
+        for sym, adj, path in list(self._entries()):
+            if (symbol is None or sym == symbol) and (adjust is None or adj == (adjust or "raw")):
+                os.remove(path)
+                meta_path = os.path.splitext(path)[0] + ".json"
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+        folder = os.path.join(self.root, "factor")
+        if adjust is None and os.path.isdir(folder):
+            for name in os.listdir(folder):
+                if symbol is None or name == f"{symbol}.json":
+                    os.remove(os.path.join(folder, name))
+
+    def _entries(self):
+        if not os.path.isdir(self.root):
+            return
+        for adj in sorted(os.listdir(self.root)):
+            folder = os.path.join(self.root, adj)
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                sym, ext = os.path.splitext(name)
+                if ext in (".parquet", ".pkl"):
+                    yield sym, adj, os.path.join(folder, name)
+
+    def info(self):
+        """返回每个缓存文件的覆盖区间、行数和占用字节数"""
+        records = []
+        for sym, adj, path in self._entries():
+            meta_path = os.path.splitext(path)[0] + ".json"
+            meta = {}
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+            records.append({
+                "symbol": sym,
+                "adjust": adj,
+                "start": meta.get("start"),
+                "end": meta.get("end"),
+                "rows": meta.get("rows"),
+                "fetched_at": meta.get("fetched_at"),
+                "bytes": os.path.getsize(path) + (os.path.getsize(meta_path) if meta else 0),
+            })
+        return pd.DataFrame(records, columns=["symbol", "adjust", "start", "end", "rows", "fetched_at", "bytes"])
+
+    def _covered_until(self, end, now):
+        # 盘中下载时当天的 K 线还没走完，只把覆盖区间记到前一天
+        today = now.date()
+        if end.date() < today:
+            return end
+        if (now.hour, now.minute) >= MARKET_CLOSE:
+            return datetime.combine(today, datetime.min.time())
+        return datetime.combine(today - timedelta(days=1), datetime.min.time())
+
+    def _is_stale(self, meta, now):
+        if self.max_age_days is None:
+            return False
+        fetched_at = datetime.fromisoformat(meta["fetched_at"])
+        return now - fetched_at > timedelta(days=self.max_age_days)
+
+    def _consistent(self, cached, fresh, on):
+        """比较衔接日的收盘价，判断复权价格是否发生了整体变化"""
+        a = cached.loc[cached.index == on, "close"]
+        b = fresh.loc[fresh.index == on, "close"]
+        if a.empty or b.empty:
+            return True
+        return bool(np.isclose(a.iloc[0], b.iloc[0], rtol=self.tolerance, atol=0))
+
+    def _factor_path(self, symbol):
+        return os.path.join(self.root, "factor", f"{symbol}.json")
+
+    def factors(self, symbol, fetch_factors, cover_end, now=None):
+        """
+        返回后复权因子表（以除权除息日为索引、按日期升序的 Series）
+
+        本地的因子表早于日线的覆盖区间（日线追加了新数据，期间可能发生了除权除息）或已过期时重新下载。
+        """
+        now = now or datetime.now()
+        path = self._factor_path(symbol)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["end"] >= cover_end.strftime(DATE_FORMAT) and not self._is_stale(meta, now):
+                return pd.Series(meta["factors"], index=pd.to_datetime(meta["dates"], format=DATE_FORMAT), name="hfq_factor")
+        factors = fetch_factors(symbol)
+        self.stats.factor_calls += 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = {
+            "dates": factors.index.strftime(DATE_FORMAT).tolist(),
+            "factors": factors.tolist(),
+            "end": cover_end.strftime(DATE_FORMAT),
+            "fetched_at": now.isoformat(timespec="seconds"),
+        }
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+        return factors
+
+    def load(self, symbol, adjust, start_date, end_date, fetch, now=None, fetch_factors=None):
+        """
+        返回 [start_date, end_date] 区间的日线，缺失部分通过 fetch(symbol, adjust, start_date, end_date) 补齐
+
+        fetch 返回与 preprocess 相同格式的 DataFrame，日期参数均为 YYYYMMDD 字符串。
+        fetch_factors(symbol) 返回后复权因子表时，qfq / hfq 由不复权日线（fetch 的 adjust 为 ""）和因子表计算得到。
+        """
+        now = now or datetime.now()
+        if adjust in DERIVED_ADJUSTS and fetch_factors is not None:
+            raw = self.load(symbol, "", start_date, end_date, fetch, now=now)
+            with open(self._meta_path(symbol, ""), encoding="utf-8") as f:
+                cover_end = datetime.strptime(json.load(f)["end"], DATE_FORMAT)
+            return adjust_prices(raw, self.factors(symbol, fetch_factors, cover_end, now), adjust)
+        req_start = start = datetime.strptime(start_date, DATE_FORMAT)
+        req_end = end = datetime.strptime(end_date, DATE_FORMAT)
+        cached, meta = self.read(symbol, adjust)
+
+        def _fetch(lo, hi):
+            df = fetch(symbol, adjust, lo.strftime(DATE_FORMAT), hi.strftime(DATE_FORMAT))
+            self.stats.fetch_calls += 1
+            if df is None:
+                df = pd.DataFrame(columns=COLUMNS)
+            self.stats.rows_fetched += len(df)
+            return _indexed(df)
+
+        if cached is not None and self._is_stale(meta, now):
+            # 过期的缓存按原覆盖区间和本次请求区间的并集整段刷新
+            start = min(start, datetime.strptime(meta["start"], DATE_FORMAT))
+            end = max(end, datetime.strptime(meta["end"], DATE_FORMAT))
+            cached, meta = None, None
+            self.stats.refreshes += 1
+        elif cached is None:
+            self.stats.misses += 1
+
+        if cached is None:
+            merged = _fetch(start, end)
+            cover_start, cover_end = start, self._covered_until(end, now)
+        else:
+            cached = _indexed(cached)
+            cover_start = datetime.strptime(meta["start"], DATE_FORMAT)
+            cover_end = datetime.strptime(meta["end"], DATE_FORMAT)
+            pieces = [cached]
+            refetch = False
+            if start < cover_start:
+                # 向前补齐，多取一天与已有数据衔接，用于检测复权价格是否变化
+                head = _fetch(start, cover_start if cached.empty else cached.index[0].to_pydatetime())
+                if not cached.empty and not self._consistent(cached, head, cached.index[0]):
+                    refetch = True
+                pieces.insert(0, head)
+                cover_start = start
+            if end > cover_end and not refetch:
+                # 从最后一根完整的 K 线开始取，重叠的这一天用于衔接检查
+                complete = cached.index[cached.index <= cover_end]
+                lo = complete[-1].to_pydatetime() if len(complete) else cover_end + timedelta(days=1)
+                tail = _fetch(lo, end)
+                if len(complete) and not self._consistent(cached, tail, complete[-1]):
+                    refetch = True
+                pieces.append(tail)
+                cover_end = max(cover_end, self._covered_until(end, now))
+            if refetch:
+                # 除权除息后前复权价格整体变化，旧数据作废
+                self.stats.refreshes += 1
+                start = min(start, cover_start)
+                end = max(end, cover_end)
+                merged = _fetch(start, end)
+                cover_start, cover_end = start, self._covered_until(end, now)
+            elif len(pieces) == 1:
+                self.stats.hits += 1
+                merged = cached
+            else:
+                self.stats.partial += 1
+                merged = pd.concat([p for p in pieces if not p.empty] or [cached])
+                # 新下载的数据覆盖重叠日期的旧数据（例如盘中不完整的当日 K 线）
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+        if merged is not cached:
+            self.write(symbol, adjust, merged, cover_start, max(cover_start, cover_end))
+
+        result = merged.loc[(merged.index >= req_start) & (merged.index <= req_end)]
+        self.stats.rows_served += len(result)
+        return result.copy()
+
+
+def factor_series(raw_df):
+    """
+    把因子表整理成以日期为索引、按日期升序的 float Series
+
+    raw_df 为 ak.stock_zh_a_daily(adjust="hfq-factor") 的格式：date 和 hfq_factor 两列（可能是字符串、按日期降序）。
+    """
+    dates = pd.to_datetime(raw_df["date"])
+    factors = pd.Series(pd.to_numeric(raw_df["hfq_factor"]).to_numpy(np.float64), index=pd.DatetimeIndex(dates), name="hfq_factor")
+    factors = factors.sort_index()
+    return factors[~factors.index.duplicated(keep="last")]
+
+
+def factor_multiplier(factors, dates, adjust):
+    """每个时间点的复权乘数：取不晚于该时间的最近一个因子（早于因子表时为 1），qfq 再除以最新因子"""
+    return multiplier(factors.index.values.astype("datetime64[ns]"), factors.to_numpy(np.float64),
+                      np.asarray(dates).astype("datetime64[ns]"), adjust)
+
+
+def adjust_prices(df, factors, adjust):
+    """
+    按后复权因子把不复权日线转换为复权价格
+
+    每根 K 线取不晚于当天的最近一个因子（早于因子表的 K 线因子为 1）：hfq = 不复权 × 因子，
+    qfq = 不复权 × 因子 / 最新因子。成交量不复权，与数据源一致。
+    """
+    if df.empty or factors.empty:
+        return df
+    k = factor_multiplier(factors, df.index.values, adjust)
+    df = df.copy()
+    for column in PRICE_COLUMNS:
+        df[column] = df[column].to_numpy(np.float64) * k
+    return df
+
+
+def _indexed(df):
+    """把 date 列转成日期索引，与 preprocess 的输出保持一致"""
+    df = df[COLUMNS].copy()
+    df.index = pd.to_datetime(df["date"])
+    df.index.name = "date"
+    return df.sort_index()
+
+
+class FakeFetcher:
+    """
+    离线用的假数据源，接口与 ak.stock_zh_a_hist 一致
+
+    按 symbol 生成确定性的随机游走日线（工作日），并记录每次调用的参数，便于检查只下载了缺失区间。
+    生成的序列视为后复权价格；dividend 添加除权除息事件，之后不复权价格按比例下跳，qfq / hfq 和 factors
+    返回的因子表与之一致。bump_adjust 用于模拟前复权价格整体变化；latency 和 fail_rate 用于模拟网络延迟和偶发错误。
+    """
+
+    HORIZON = "2030-12-31"
+
+    def __init__(self, base_price=10.0, seed=0, latency=0.0, fail_rate=0.0):
+        self.base_price = base_price
+        self.seed = seed
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.calls = []
+        self.adjust_factor = 1.0
+        self.dividends = {}  # symbol -> [(除权除息日, 比例)]
+        self._rng = random.Random(seed)
+        self._series = {}
+
+    def bump_adjust(self, factor):
+        self.adjust_factor *= factor
+
+    def dividend(self, symbol, date, ratio):
+        """在 date 除权除息，当天起不复权价格除以 ratio（例如 1.02 表示 2% 的分红）"""
+        self.dividends.setdefault(symbol, []).append((pd.Timestamp(date), ratio))
+
+    def _factors(self, symbol, days):
+        events = sorted(self.dividends.get(symbol, []))
+        k = np.ones(len(days))
+        for date, ratio in events:
+            k[days >= date] *= ratio
+        return k
+
+    def factors(self, symbol):
+        """与 ak.stock_zh_a_daily(adjust="hfq-factor") 格式相同的后复权因子表"""
+        self.calls.append((symbol, "hfq-factor", None, None))
+        if self.latency:
+            time.sleep(self.latency)
+        rows, k = [("1900-01-01", 1.0)], 1.0
+        for date, ratio in sorted(self.dividends.get(symbol, [])):
+            k *= ratio
+            rows.append((date.strftime("%Y-%m-%d"), k))
+        return pd.DataFrame(rows[::-1], columns=["date", "hfq_factor"])
+
+    def bars(self, symbol, start_date, end_date):
+        if symbol not in self._series:
+            # 固定生成到 HORIZON，保证同一日期在不同请求区间下的数值一致
+            days = np.arange("2000-01-03", self.HORIZON, dtype="datetime64[D]")
+            days = pd.DatetimeIndex(days[np.is_busday(days)])
+            rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())])
+            ret = rng.normal(0, 0.02, len(days))
+            close = self.base_price * np.exp(np.cumsum(ret))
+            open_ = close * np.exp(rng.normal(0, 0.01, len(days)))
+            high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, len(days))))
+            low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.015, len(days))))
+            volume = rng.integers(10_000, 1_000_000, len(days))
+            self._series[symbol] = (days, open_, close, high, low, volume)
+        days, open_, close, high, low, volume = self._series[symbol]
+        mask = (days >= pd.Timestamp(start_date)) & (days <= pd.Timestamp(end_date))
+        k = self.adjust_factor
+        return days[mask], open_[mask] * k, close[mask] * k, high[mask] * k, low[mask] * k, volume[mask]
+
+    def minutes(self, symbol, start_date, end_date, period="1", adjust=""):
+        """
+        与 ak.stock_zh_a_hist_min_em 格式相同的 1 分钟线，由日线按布朗桥插值生成（每天 240 根），
+        当天第一根的开盘价和最后一根的收盘价与日线相同。start_date / end_date 为 "YYYY-MM-DD HH:MM:SS"
+        """
+        self.calls.append((symbol, f"min{period}", start_date, end_date))
+        daily = self(symbol, start_date=pd.Timestamp(start_date).strftime(DATE_FORMAT),
+                     end_date=pd.Timestamp(end_date).strftime(DATE_FORMAT), adjust=adjust)
+        self.calls.pop()
+        if daily.empty:
+            return pd.DataFrame(columns=["时间", "开盘", "收盘", "最高", "最低", "成交量", "成交额", "均价"])
+        n = 240
+        stamps = np.concatenate([np.arange(571, 691), np.arange(781, 901)])  # 09:31-11:30、13:01-15:00 的分钟数
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), len(daily)])
+        steps = rng.normal(0, 0.0015, (len(daily), n)).cumsum(axis=1)
+        t = np.arange(1, n + 1) / n
+        bridge = steps - t * steps[:, -1:]
+        day_open, day_close = daily["开盘"].to_numpy()[:, None], daily["收盘"].to_numpy()[:, None]
+        close = (day_open + (day_close - day_open) * t) * np.exp(bridge)
+        open_ = np.concatenate([day_open, close[:, :-1]], axis=1)
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.0005, close.shape)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.0005, close.shape)))
+        volume = np.maximum(1, rng.poisson(daily["成交量"].to_numpy()[:, None] / n, close.shape))
+        days = pd.to_datetime(daily["日期"]).to_numpy().astype("datetime64[m]")
+        times = (days[:, None] + stamps.astype("timedelta64[m]")).ravel()
+        frame = pd.DataFrame({
+            "时间": pd.DatetimeIndex(times).strftime("%Y-%m-%d %H:%M:%S"),
+            "开盘": open_.ravel().round(2),
+            "收盘": close.ravel().round(2),
+            "最高": high.ravel().round(2),
+            "最低": low.ravel().round(2),
+            "成交量": volume.ravel(),
+        })
+        frame["成交额"] = (frame["成交量"] * frame["收盘"]).round(2)
+        frame["均价"] = frame["收盘"]
+        mask = (times >= np.datetime64(pd.Timestamp(start_date), "m")) & (times <= np.datetime64(pd.Timestamp(end_date), "m"))
+        return frame[mask].reset_index(drop=True)
+
+    def __call__(self, symbol, period="daily", start_date="19700101", end_date="20500101", adjust=""):
+        self.calls.append((symbol, adjust, start_date, end_date))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            raise ConnectionError(f"模拟的网络错误: {symbol}")
+        days, open_, close, high, low, volume = self.bars(symbol, start_date, end_date)
+        if self.dividends.get(symbol) and adjust != "hfq":
+            # 不复权价格在除权除息日下跳；前复权以最新因子为基准
+            if adjust == "qfq":
+                k = self._factors(symbol, pd.DatetimeIndex([pd.Timestamp(self.HORIZON)]))[0]
+            else:
+                k = self._factors(symbol, days)
+            open_, close, high, low = open_ / k, close / k, high / k, low / k
+        # 列顺序与 akshare 一致：日期 股票代码 开盘 收盘 最高 最低 成交量 ...
+        return pd.DataFrame({
+            "日期": [d.date() for d in days],
+            "股票代码": symbol,
+            "开盘": open_.round(2),
+            "收盘": close.round(2),
+            "最高": high.round(2),
+            "最低": low.round(2),
+            "成交量": volume,
+            "成交额": (volume * close).round(2),
+        })
@@ -0,0 +1,266 @@
+import argparse
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# 启动时只导入标准库：akshare / backtrader / pandas 等在子命令真正用到时才导入，--help 不需要导入任何一个
+START_CASH = 100000
+DATE_FORMAT = "%Y%m%d"
+# 名称 -> (模块:类名, 复权方式, 快速引擎 模块:函数)，注册表本身不导入任何策略模块
+STRATEGIES = {
+    "tailbuy": ("strategy:TailBuy", "qfq", "fast_engine:run_tailbuy"),
+    "limitbuy": ("buy_with_limit:LimitBuy", "hfq", "fast_engine:run_limitbuy"),
+    "sma": ("bt_example:MyStrategy", "hfq", None),
+}
+HEAVY_MODULES = ["akshare", "backtrader", "pandas", "numpy", "matplotlib", "numba", "pyarrow"]
+# 启动预算（秒）：help 为 `cli.py --help`，run 为只读本地缓存、用快速引擎回测一只股票的完整运行（实测约 0.25 s）
+STARTUP_BUDGET = {"help": 0.3, "run": 0.4}
+
+
+def register_strategy(name, target, adjust="hfq", fast=None):
+    """注册策略，target 为 "模块:类名"，在 run 子命令用到时才导入"""
+    STRATEGIES[name] = (target, adjust, fast)
+
+
+def load(target):
+    """按 "模块:属性" 导入并返回对象"""
+    module, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _date(value):
+    return datetime.today() if value == "today" else datetime.strptime(value, DATE_FORMAT)
+
+
+def _value(text):
+    """--param 的取值：能转换为 int / float 的按数字处理"""
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+class Offline:
+    """--offline 时的数据源：缓存未覆盖的区间或因子表直接报错，而不是下载"""
+
+    def __call__(self, symbol, **kwargs):
+        raise RuntimeError(f"{symbol} 的本地缓存没有覆盖所需区间（--offline 时不下载）")
+
+    def factors(self, symbol):
+        raise RuntimeError(f"{symbol} 的本地复权因子表不是最新的（--offline 时不下载）")
+
+
+def backtest(name, stock_df, fromdate, todate, engine="bt", cash=START_CASH, commission=0.002, symbol=None,
+             printlog=False, **params):
+    """用注册表中的策略回测一只股票的日线，返回 Metrics 的结果记录；run 子命令和 server.py 共用"""
+    target, _, fast = STRATEGIES[name]
+    if engine == "fast":
+        if fast is None:
+            raise ValueError(f"{name} 没有快速引擎实现，请使用 engine=bt")
+        return load(fast)(stock_df, fromdate, todate, cash=cash, commission=commission, **params).metrics
+
+    import backtrader as bt
+    from feeds import ArrayData
+    from analyzer import Metrics
+
+    strategy = load(target)
+    if printlog and "printlog" in strategy.params._getkeys():
+        params.setdefault("printlog", True)
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(strategy, **params)
+    cerebro.addanalyzer(Metrics, _name="metrics")
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.adddata(ArrayData(dataname=stock_df, fromdate=fromdate, todate=todate), name=symbol)
+    return cerebro.run()[0].analyzers.metrics.get_analysis()
+
+
+def _cached_arrays(symbol, adjust, start_date, end_date):
+    """按 utils.get_cache / factor_fetcher 的设置从默认缓存读取数组（cache_arrays.read_arrays），未完整覆盖时返回 None"""
+    if os.environ.get("QT_CACHE", "on").lower() in ("off", "0", "false"):
+        return None
+    from cache_arrays import read_arrays
+
+    derive = os.environ.get("QT_DERIVE_ADJUST", "on").lower() not in ("off", "0", "false")
+    return read_arrays(os.environ.get("QT_CACHE_DIR", "data_cache"), symbol, adjust, start_date, end_date, derive=derive)
+
+
+def cmd_run(args):
+    """回测单只股票"""
+    if args.engine == "fast" and STRATEGIES[args.strategy][2] is None:
+        sys.exit(f"{args.strategy} 没有快速引擎实现，请使用 --engine bt")
+    params = dict(item.split("=", 1) for item in args.param)
+    params = {key: _value(value) for key, value in params.items()}
+    start_date, end_date = _date(args.start_date), _date(args.end_date)
+
+    from metrics import print_report
+
+    adjust = args.adjust if args.adjust is not None else STRATEGIES[args.strategy][1]
+    stock_df = None
+    if args.engine == "fast":
+        # 快速引擎直接读缓存中的数组，缓存完整覆盖区间时不需要导入 pandas
+        stock_df = _cached_arrays(args.symbol, adjust, start_date.strftime(DATE_FORMAT), end_date.strftime(DATE_FORMAT))
+    if stock_df is None:
+        from utils import preprocess
+
+        stock_df = preprocess(symbol=args.symbol, adjust=adjust,
+                              start_date=start_date.strftime(DATE_FORMAT), end_date=end_date.strftime(DATE_FORMAT),
+                              fetcher=Offline() if args.offline else None)
+    if stock_df is None:
+        return 1
+    record = backtest(args.strategy, stock_df, start_date, end_date, engine=args.engine, cash=args.cash,
+                      commission=args.commission, symbol=args.symbol, printlog=args.printlog, **params)
+    print_report({"symbol": args.symbol, **record}, args.cash, start_date, end_date)
+    return 0
+
+
+def cmd_scan(args):
+    """批量扫描，参数与 tail_buy_filter.py 相同"""
+    return load("tail_buy_filter:main")(args.rest)
+
+
+def cmd_sweep(args):
+    """参数扫描，参数与 sweep.py 相同"""
+    return load("sweep:main")(args.rest)
+
+
+def cmd_serve(args):
+    """常驻内存的回测服务，参数与 server.py 相同"""
+    return load("server:main")(args.rest)
+
+
+def cmd_fetch(args):
+    """把日线批量下载到本地缓存，之后的 run --offline / scan / sweep 直接读缓存"""
+    from fetcher import bulk_fetch
+
+    symbols = args.symbols.split(",")
+    if args.fake:
+        from cache import FakeFetcher
+
+        fetcher = FakeFetcher()
+    else:
+        fetcher = None
+    frames, report = bulk_fetch(symbols, args.adjust, _date(args.start_date).strftime(DATE_FORMAT),
+                                _date(args.end_date).strftime(DATE_FORMAT), fetcher=fetcher,
+                                workers=args.workers, rate=args.rate)
+    print(report)
+    return 0 if len(frames) == len(symbols) else 1
+
+
+def _time_command(argv, repeat, env=None):
+    """在新进程中运行 cli.py argv 共 repeat 次，返回 (各次耗时, 导入的重量级模块)"""
+    env = dict(os.environ, **(env or {}), QT_REPORT_MODULES="1")
+    command = [sys.executable, os.path.abspath(__file__)] + argv
+    times, modules = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run(command, env=env, capture_output=True, text=True)
+        times.append(time.perf_counter() - t0)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{' '.join(argv)} 退出码 {proc.returncode}: {proc.stderr.strip()[-500:]}")
+        modules = [line.split(":", 1)[1].split(",") for line in proc.stderr.splitlines() if line.startswith("heavy modules:")]
+        modules = [m for m in (modules[-1] if modules else []) if m]
+    return times, modules
+
+
+def cmd_startup(args):
+    """
+    测量启动开销：--help 和只读本地缓存的快速引擎回测各在新进程中运行 repeat 次，按中位数与预算比较，超出预算时返回 1
+
+    回测用 cache.FakeFetcher 生成的随机日线预先写入临时缓存目录，不需要网络。
+    """
+    budget = dict(STARTUP_BUDGET)
+    for item in args.budget:
+        name, _, seconds = item.partition("=")
+        budget[name] = float(seconds)
+    with tempfile.TemporaryDirectory() as root:
+        from cache import BarCache, FakeFetcher
+        from utils import preprocess
+
+        cache = BarCache(root=root)
+        if preprocess("000001", "qfq", "20140101", "20231231", cache=cache, fetcher=FakeFetcher()) is None:
+            return 1
+        cases = [
+            ("help", ["--help"], None),
+            ("run", ["run", "--strategy", "tailbuy", "--engine", "fast", "--symbol", "000001", "--offline",
+                     "--adjust", "qfq", "--start_date", "20140101", "--end_date", "20231231"], {"QT_CACHE_DIR": root}),
+        ]
+        over = False
+        for name, argv, env in cases:
+            times, modules = _time_command(argv, args.repeat, env)
+            median = statistics.median(times)
+            ok = median <= budget[name]
+            over |= not ok
+            print(f"{name:<6} 中位数 {median * 1000:7.1f} ms, 最短 {min(times) * 1000:7.1f} ms, 预算 {budget[name] * 1000:.0f} ms "
+                  f"{'OK' if ok else '超出预算'}  导入: {', '.join(modules) or '无'}")
+    return 1 if over else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="回测工具的统一入口")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="back test one stock with a registered strategy")
+    run.add_argument("--strategy", default="tailbuy", choices=sorted(STRATEGIES))
+    run.add_argument("--symbol", default="600036", type=str, help="stock code")
+    run.add_argument("--start_date", default="20140101", help="start date of back test")
+    run.add_argument("--end_date", default="today", type=str, help="choose end date of back test")
+    run.add_argument("--adjust", default=None, choices=["", "qfq", "hfq"], help="price adjustment, defaults to the strategy's own")
+    run.add_argument("--engine", default="bt", choices=["bt", "fast"], help="backtrader or the array engine (tailbuy / limitbuy)")
+    run.add_argument("--param", action="append", default=[], help="strategy parameter, e.g. open_ratio=0.02")
+    run.add_argument("--cash", default=START_CASH, type=float, help="starting cash")
+    run.add_argument("--commission", default=0.002, type=float, help="commission rate")
+    run.add_argument("--offline", action="store_true", help="only read the local cache, never download")
+    run.add_argument("--printlog", action="store_true", help="print orders and trades")
+    run.set_defaults(func=cmd_run)
+
+    # scan / sweep / serve 的参数原样交给对应脚本的 main 解析（包括 --help）
+    scan = commands.add_parser("scan", help="batch back test, same options as tail_buy_filter.py", add_help=False)
+    scan.set_defaults(func=cmd_scan, passthrough=True)
+    sweep = commands.add_parser("sweep", help="parameter sweep, same options as sweep.py", add_help=False)
+    sweep.set_defaults(func=cmd_sweep, passthrough=True)
+
+    serve = commands.add_parser("serve", help="long-lived backtest server, same options as server.py", add_help=False)
+    serve.set_defaults(func=cmd_serve, passthrough=True)
+
+    fetch = commands.add_parser("fetch", help="download daily bars into the local cache")
+    fetch.add_argument("--symbols", default="600036", type=str, help="comma separated stock codes")
+    fetch.add_argument("--adjust", default="qfq", choices=["", "qfq", "hfq"], help="price adjustment")
+    fetch.add_argument("--start_date", default="20140101", help="first date to download")
+    fetch.add_argument("--end_date", default="today", type=str, help="last date to download")
+    fetch.add_argument("--workers", default=8, type=int, help="number of download threads")
+    fetch.add_argument("--rate", default=5.0, type=float, help="max download requests per second")
+    fetch.add_argument("--fake", action="store_true", help="use the offline random-walk source instead of akshare")
+    fetch.set_defaults(func=cmd_fetch)
+
+    startup = commands.add_parser("startup", help="measure start-up time against the budget")
+    startup.add_argument("--repeat", default=5, type=int, help="runs per case")
+    startup.add_argument("--budget", action="append", default=[], help="override a budget in seconds, e.g. run=1.5")
+    startup.set_defaults(func=cmd_startup)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if rest and not getattr(args, "passthrough", False):
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    args.rest = rest
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    try:
+        status = main()
+    finally:
+        if os.environ.get("QT_REPORT_MODULES"):
+            # 供 startup 子命令统计实际导入了哪些重量级模块
+            print(f"heavy modules:{','.join(m for m in HEAVY_MODULES if m in sys.modules)}", file=sys.stderr)
+    sys.exit(status)
@@ -0,0 +1,585 @@
+import argparse
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from metrics import summarize
+
+try:
+    from numba import njit
+except ImportError:  # numba 为可选依赖，没有时用纯 Python 运行同一个状态机
+    njit = None
+
+FILL_DTYPE = np.dtype([
+    ("bar", np.int64),  # 成交所在的 K 线序号
+    ("size", np.int64),  # 正数买入，负数卖出
+    ("price", np.float64),
+    ("commission", np.float64),
+    ("cash", np.float64),  # 成交后的现金
+    ("position_price", np.float64),  # 成交后的持仓成本
+])
+
+
+@dataclass
+class FastResult:
+    """快速引擎的回测结果"""
+    fills: np.ndarray  # FILL_DTYPE 结构化数组
+    equity: np.ndarray  # 每根 K 线收盘后的总资金
+    metrics: dict
+
+
+def _first_true(cond, start, n, scalar=None, window=32, probe=16):
+    """
+    返回 [start, n) 中第一个满足条件的下标，没有则返回 n
+
+    成交密集时信号往往就在附近，先用 scalar(k) 逐根检查 probe 根 K 线；
+    之后用 cond(lo, hi) 对切片做向量化判断，窗口逐次翻倍，避免每次都扫描剩余的全部数据。
+    """
+    lo = start
+    if scalar is not None:
+        for k in range(start, min(n, start + probe)):
+            if scalar(k):
+                return k
+        lo = min(n, start + probe)
+    while lo < n:
+        hi = min(n, lo + window)
+        hit = np.flatnonzero(cond(lo, hi))
+        if hit.size:
+            return lo + int(hit[0])
+        lo = hi
+        window *= 2
+    return n
+
+
+def _position_value(size, price, close):
+    # 与 BackBroker._get_value 的浮点运算顺序保持一致，保证结果逐位相同
+    dvalue = size * close
+    unrealized = size * (close - price) * 1.0
+    return (0.0 + (dvalue - unrealized) / 1.0) + unrealized
+
+
+def simulate_tailbuy(open_, high, low, close, dates=None, cash=100000.0, commission=0.002, size=100):
+    """
+    用 NumPy 数组模拟 strategy.TailBuy 在 Backtrader 默认撮合下的结果
+
+    与 Cerebro 的规则一致：第 i 根 K 线 next 中发出的市价单在第 i+1 根 K 线开盘成交，
+    提交时按第 i 根收盘价、成交时按开盘价检查现金是否足够（含手续费），不足则订单作废。
+    持仓期间状态不变，信号用向量化的方式在数组上查找，只在成交时逐笔处理。
+    dates 为 datetime64 数组，提供时按自然年计算夏普比率。
+    """
+    open_, high, low, close = (np.asarray(a, dtype=np.float64) for a in (open_, high, low, close))
+    n = close.size
+    start_cash = float(cash)
+    cash = float(cash)
+    pos_size, pos_price = 0, 0.0
+    equity = np.empty(n)
+    fills = []
+    trade_pnl, trade_comm = 0.0, 0.0
+    total_trades, won_trades = 0, 0
+
+    # 开仓条件与持仓无关，预先计算
+    open_trigger = low <= open_ * 0.97
+    # 逐根检查时用 Python 列表取值比 NumPy 标量快得多
+    trigger_l, high_l, low_l, close_l = (a.tolist() for a in (open_trigger, high, low, close))
+
+    i = 0
+    while i < n:
+        if pos_size == 0:
+            c, p = cash, pos_price
+
+            def signal(lo, hi):
+                buy = (low[lo:hi] <= p * 0.95) & (c >= close[lo:hi] * 100)
+                return open_trigger[lo:hi] | buy
+
+            def hit(k):
+                return trigger_l[k] or (low_l[k] <= p * 0.95 and c >= close_l[k] * 100)
+
+            j = _first_true(signal, i, n, scalar=hit)
+            equity[i:j + 1] = cash + 0.0
+            is_buy = True
+        else:
+            c, p, s = cash, pos_price, pos_size
+
+            def signal(lo, hi):
+                buy = (low[lo:hi] <= p * 0.95) & (c >= close[lo:hi] * 100)
+                stop_profit = high[lo:hi] >= p * 1.05
+                stop_loss = close[lo:hi] < p * 0.8
+                return buy | stop_profit | stop_loss
+
+            def hit(k):
+                return (low_l[k] <= p * 0.95 and c >= close_l[k] * 100) or high_l[k] >= p * 1.05 or close_l[k] < p * 0.8
+
+            j = _first_true(signal, i, n, scalar=hit)
+            equity[i:j + 1] = cash + _position_value(s, p, close[i:j + 1])
+            is_buy = j < n and low_l[j] <= p * 0.95 and c >= close_l[j] * 100
+        if j >= n - 1:
+            break  # 最后一根 K 线发出的订单不会成交
+        f = j + 1
+        price = open_[f]
+        if is_buy:
+            # 提交时按当前收盘价预检现金，成交时再按开盘价检查
+            check = cash - abs(size) * close[j] - abs(size) * commission * close[j]
+            after = cash - abs(size) * price - abs(size) * commission * price
+            if check < 0.0 or after < 0.0:
+                i = f  # 保证金不足，订单被拒绝，状态不变
+                continue
+            comm = abs(size) * commission * price
+            cash = after
+            if pos_size == 0:
+                pos_price = price
+                total_trades += 1
+                trade_pnl, trade_comm = 0.0, 0.0
+            else:
+                pos_price = (pos_price * pos_size + size * price) / (pos_size + size)
+            pos_size += size
+            trade_comm += comm
+            fills.append((f, size, price, comm, cash, pos_price))
+        else:
+            closed = pos_size
+            pnl = closed * (price - pos_price) * 1.0
+            comm = abs(closed) * commission * price
+            cash += abs(closed) * pos_price / 1.0 + pnl
+            cash -= comm
+            trade_pnl += pnl
+            trade_comm += comm
+            if (trade_pnl - trade_comm) >= 0.0:
+                won_trades += 1
+            pos_size, pos_price = 0, 0.0
+            fills.append((f, -closed, price, comm, cash, pos_price))
+        equity[f] = cash + (_position_value(pos_size, pos_price, close[f]) if pos_size else 0.0)
+        i = f
+
+    fills = np.array(fills, dtype=FILL_DTYPE)
+    # 每根 K 线收盘时的持仓（成交发生在开盘），用于计算持仓时间占比
+    position = np.zeros(n, dtype=np.int64)
+    np.add.at(position, fills["bar"], fills["size"])
+    exposed = int(np.count_nonzero(np.cumsum(position)))
+    metrics = summarize(equity, start_cash, cash, dates=dates, total_trades=total_trades,
+                        won_trades=won_trades, exposed_bars=exposed)
+    return FastResult(fills=fills, equity=equity, metrics=metrics)
+
+
+def _limitbuy_kernel(open_, high, low, close, dt, valid_until, cash, commission, order_size,
+                     open_ratio, grid_ratio, stop_profit_ratio, equity, fill_bar, fill_size, fill_price,
+                     fill_comm, fill_cash, fill_pos_price, last_buy, last_pos):
+    """
+    buy_with_limit.LimitBuy 在 BackBroker 下的逐根状态机，只使用标量和预分配数组，可以直接交给 numba 编译
+
+    每根 K 线先按 broker.next 的顺序处理挂单：首次处理时按限价预检现金（不足为 Margin），
+    日期超过 valid 则过期，否则买单在开盘价不高于限价时按开盘价、最低价触及限价时按限价成交，卖单对称；
+    成交时再按成交价检查现金。然后记录当根总资金，再应用 notify_order 中对网格记录和持仓成本的修改，
+    最后执行 next 的开仓、止盈、网格减仓和网格加仓判断。last_buy / last_pos 为定长栈，满时丢弃最早的记录，
+    与 deque(maxlen) 相同。
+    返回 (成交笔数, 期末现金, 交易数, 盈利交易数, 出错的 K 线序号)，网格记录为空时 LimitBuy 会抛出
+    IndexError，此时出错序号为该 K 线，否则为 -1。
+    """
+    n = len(close)
+    maxlen = last_buy.shape[0]
+    count = 0  # 网格记录条数
+    pos_size = 0
+    pos_price = 0.0
+    has_order = False
+    accepted = False
+    o_side = 0
+    o_price = 0.0
+    o_size = 0
+    o_valid = 0.0
+    nfills = 0
+    trade_price = 0.0  # Trade 自己按成交价维护的均价，不受 LimitBuy 修改持仓成本的影响
+    trade_pnl = 0.0
+    trade_comm = 0.0
+    total_trades = 0
+    won_trades = 0
+    for k in range(n):
+        # broker.next：处理挂单
+        override = False
+        if has_order:
+            if not accepted:
+                if o_side > 0 and cash - o_size * o_price - o_size * commission * o_price < 0.0:
+                    has_order = False  # 提交时现金不足
+                accepted = True
+            if has_order and dt[k] > o_valid:
+                has_order = False  # 过期
+            if has_order:
+                p = -1.0
+                if o_side > 0:
+                    if o_price >= open_[k]:
+                        p = open_[k]
+                    elif o_price >= low[k]:
+                        p = o_price
+                else:
+                    if o_price <= open_[k]:
+                        p = open_[k]
+                    elif o_price <= high[k]:
+                        p = o_price
+                if p >= 0.0:
+                    has_order = False
+                    if o_side > 0:
+                        after = cash - o_size * p - o_size * commission * p
+                        if after >= 0.0:
+                            comm = o_size * commission * p
+                            cash = after
+                            if pos_size == 0:
+                                pos_price = p
+                                total_trades += 1
+                                trade_price = (0 * 0.0 + o_size * p) / o_size
+                                trade_pnl = 0.0
+                                trade_comm = 0.0
+                            else:
+                                pos_price = (pos_price * pos_size + o_size * p) / (pos_size + o_size)
+                                trade_price = (pos_size * trade_price + o_size * p) / (pos_size + o_size)
+                            pos_size += o_size
+                            trade_comm += comm
+                            # order.executed.price 按 (0 + size * price) / size 重新计算，可能与成交价差最后一位
+                            executed = (o_size * p) / o_size
+                            fill_bar[nfills] = k
+                            fill_size[nfills] = o_size
+                            fill_price[nfills] = executed
+                            fill_comm[nfills] = comm
+                            fill_cash[nfills] = cash
+                            fill_pos_price[nfills] = pos_price
+                            nfills += 1
+                            # notify_order：记录买入价和持仓成本
+                            if count == maxlen:
+                                for j in range(maxlen - 1):
+                                    last_buy[j] = last_buy[j + 1]
+                                    last_pos[j] = last_pos[j + 1]
+                                count -= 1
+                            last_buy[count] = executed
+                            last_pos[count] = pos_price
+                            count += 1
+                    else:
+                        pnl = o_size * (p - pos_price) * 1.0
+                        comm = o_size * commission * p
+                        cash += o_size * pos_price / 1.0 + pnl
+                        cash -= comm
+                        pos_size -= o_size
+                        if pos_size == 0:
+                            pos_price = 0.0
+                        trade_pnl += o_size * (p - trade_price) * 1.0
+                        trade_comm += comm
+                        if pos_size == 0 and (trade_pnl - trade_comm) >= 0.0:
+                            won_trades += 1
+                        fill_bar[nfills] = k
+                        fill_size[nfills] = -o_size
+                        fill_price[nfills] = (-o_size * p) / -o_size
+                        fill_comm[nfills] = comm
+                        fill_cash[nfills] = cash
+                        fill_pos_price[nfills] = pos_price
+                        nfills += 1
+                        # notify_order：卖出一格弹出最近的网格记录，否则清空
+                        if o_size == order_size:
+                            if count > 0:
+                                count -= 1
+                        else:
+                            count = 0
+                        override = True
+        # broker 在通知策略之前算出当根的总资金
+        if pos_size:
+            dvalue = pos_size * close[k]
+            unrealized = pos_size * (close[k] - pos_price) * 1.0
+            equity[k] = cash + ((0.0 + (dvalue - unrealized) / 1.0) + unrealized)
+        else:
+            equity[k] = cash + 0.0
+        if override:
+            pos_price = last_pos[count - 1] if count > 0 else 0.0
+
+        # next
+        if has_order:
+            continue
+        if pos_size == 0:
+            open_price = open_[k] * (1 - open_ratio)
+            if low[k] <= open_price:
+                has_order, accepted, o_side, o_price, o_size, o_valid = True, False, 1, open_price, order_size, valid_until[k]
+                continue
+        if pos_size > 0:
+            target_profit_price = pos_price * (1 + stop_profit_ratio)
+            if high[k] >= target_profit_price:
+                has_order, accepted, o_side, o_price, o_size, o_valid = True, False, -1, target_profit_price, pos_size, valid_until[k]
+                if o_price == 0.0:
+                    # 网格记录清空后持仓成本被设为 0，价格为 0 的限价单在 Backtrader 中以当根收盘价作为限价
+                    o_price = close[k]
+                continue
+            if count > 0 and high[k] >= last_buy[count - 1] * (1 + grid_ratio):
+                has_order, accepted, o_side, o_size, o_valid = True, False, -1, order_size, valid_until[k]
+                o_price = last_buy[count - 1] * (1 + grid_ratio)
+                continue
+            if count == 0:
+                return nfills, cash, total_trades, won_trades, k
+            target_add_price = last_buy[count - 1] * (1 - grid_ratio)
+            if low[k] <= last_buy[count - 1] * (1 - grid_ratio) and cash >= target_add_price * order_size:
+                has_order, accepted, o_side, o_price, o_size, o_valid = True, False, 1, target_add_price, order_size, valid_until[k]
+    return nfills, cash, total_trades, won_trades, -1
+
+
+_limitbuy_jit = njit(cache=True)(_limitbuy_kernel) if njit is not None else None
+
+
+def simulate_limitbuy(open_, high, low, close, dates, cash=100000.0, commission=0.002, order_size=100,
+                      open_ratio=0.03, grid_ratio=0.05, stop_profit_ratio=0.05, valid_days=1, max_drawdown=None,
+                      jit=True):
+    """
+    用 OHLC 数组模拟 buy_with_limit.LimitBuy 在 Backtrader 默认撮合下的结果，成交、资金曲线和指标与 Cerebro 逐位相同
+
+    安装了 numba 且 jit 为 True 时使用编译后的状态机，否则用纯 Python 运行同一段代码。
+    dates 为 datetime64 数组，用于计算订单有效期和按年的夏普比率。max_drawdown 与 sweep.DrawdownStop 相同：
+    回撤首次超过该百分比时在那根 K 线结束回测，结果的 metrics 中 pruned 为 True。
+    LimitBuy 在网格记录为空时会抛出 IndexError，这里同样抛出。
+    """
+    from feeds import date2num
+
+    open_, high, low, close = (np.ascontiguousarray(a, dtype=np.float64) for a in (open_, high, low, close))
+    dates = np.asarray(dates).astype("datetime64[us]")
+    # 与 LimitBuy 一样以 K 线时间加 valid_days 天作为有效期，晚于它的 K 线上订单过期
+    dt = date2num(dates)
+    valid_until = date2num(dates + np.timedelta64(valid_days, "D"))
+    params = (float(cash), commission, order_size, open_ratio, grid_ratio, stop_profit_ratio)
+
+    def run(n):
+        out = [np.empty(n), np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64)] + [np.empty(n) for _ in range(4)]
+        stacks = [np.empty(10), np.empty(10)]  # LimitBuy 的 deque(maxlen=10)
+        arrays = (open_[:n], high[:n], low[:n], close[:n], dt[:n], valid_until[:n])
+        if jit and _limitbuy_jit is not None:
+            result = _limitbuy_jit(*arrays, *params, *out, *stacks)
+        else:
+            # 纯 Python 运行时从列表取值比 NumPy 标量快得多
+            result = _limitbuy_kernel(*(a.tolist() for a in arrays), *params, *out, *stacks)
+        return result, out
+
+    n = close.size
+    (nfills, end_cash, total_trades, won_trades, error), out = run(n)
+    pruned = False
+    if max_drawdown is not None:
+        # DrawdownStop 在 next 之后检查，出错的那根 K 线不参与
+        equity = out[0][:n if error < 0 else error]
+        peak = np.maximum.accumulate(equity)
+        hit = np.flatnonzero(100.0 * (peak - equity) / peak > max_drawdown)
+        if hit.size:
+            pruned = True
+            n = int(hit[0]) + 1
+            (nfills, end_cash, total_trades, won_trades, error), out = run(n)
+            error = -1  # 第 n - 1 根 K 线的 next 在截断后的数据上已完成
+    if error >= 0:
+        raise IndexError("deque index out of range")
+
+    equity, bars, sizes, prices, comms, cashes, pos_prices = out
+    fills = np.empty(nfills, dtype=FILL_DTYPE)
+    for name, values in zip(FILL_DTYPE.names, (bars, sizes, prices, comms, cashes, pos_prices)):
+        fills[name] = values[:nfills]
+    position = np.zeros(n, dtype=np.int64)
+    np.add.at(position, fills["bar"], fills["size"])
+    exposed = int(np.count_nonzero(np.cumsum(position)))
+    metrics = summarize(equity, float(cash), end_cash, dates=dates[:n], total_trades=total_trades,
+                        won_trades=won_trades, exposed_bars=exposed)
+    if max_drawdown is not None:
+        metrics["pruned"] = pruned
+    return FastResult(fills=fills, equity=equity, metrics=metrics)
+
+
+def frame_arrays(stock_df, fromdate=None, todate=None):
+    """
+    从 preprocess 返回的 DataFrame 中取出指定区间的 OHLC 数组
+
+    stock_df 也可以是 cache_arrays.read_arrays 返回的数组字典（date 为 datetime64[ns]），此时不需要 pandas。
+    """
+    if isinstance(stock_df, dict):
+        dates = stock_df["date"].astype("datetime64[ns]")
+        mask = np.ones(dates.size, dtype=bool)
+        if fromdate is not None:
+            mask &= dates >= np.datetime64(fromdate, "ns")
+        if todate is not None:
+            mask &= dates <= np.datetime64(todate, "ns")
+        return {
+            "open_": np.asarray(stock_df["open"][mask], dtype=np.float64),
+            "high": np.asarray(stock_df["high"][mask], dtype=np.float64),
+            "low": np.asarray(stock_df["low"][mask], dtype=np.float64),
+            "close": np.asarray(stock_df["close"][mask], dtype=np.float64),
+            "dates": dates[mask],
+        }
+    index = stock_df.index
+    mask = np.ones(len(stock_df), dtype=bool)
+    if fromdate is not None:
+        mask &= index >= fromdate
+    if todate is not None:
+        mask &= index <= todate
+    df = stock_df[mask]
+    return {
+        "open_": df["open"].to_numpy(np.float64),
+        "high": df["high"].to_numpy(np.float64),
+        "low": df["low"].to_numpy(np.float64),
+        "close": df["close"].to_numpy(np.float64),
+        "dates": df.index.to_numpy(dtype="datetime64[ns]"),
+    }
+
+
+def run_tailbuy(stock_df, fromdate=None, todate=None, cash=100000.0, commission=0.002):
+    """对 preprocess 返回的 DataFrame（或 cache_arrays.read_arrays 返回的数组）运行快速引擎"""
+    return simulate_tailbuy(**frame_arrays(stock_df, fromdate, todate), cash=cash, commission=commission)
+
+
+def run_limitbuy(stock_df, fromdate=None, todate=None, cash=100000.0, commission=0.002, **params):
+    """对 preprocess 返回的 DataFrame（或 cache_arrays.read_arrays 返回的数组）运行 LimitBuy 状态机，params 与 LimitBuy 的参数同名"""
+    return simulate_limitbuy(**frame_arrays(stock_df, fromdate, todate), cash=cash, commission=commission, **params)
+
+
+def verify_limitbuy(stock_df, fromdate=None, todate=None, cash=100000.0, commission=0.002, max_drawdown=None, **params):
+    """
+    分别用状态机和 Cerebro 回测 LimitBuy，逐笔比较成交（K 线序号、数量、价格、手续费）、逐根比较资金曲线，
+    再比较全部指标，返回 (是否完全一致, 状态机结果, Cerebro 结果)；两边都抛出 IndexError 也算一致，结果为异常的 repr
+    """
+    import backtrader as bt
+    from buy_with_limit import LimitBuy
+    from feeds import ArrayData
+    from analyzer import Metrics
+    from sweep import DrawdownStop
+
+    class Recorded(LimitBuy):
+        def __init__(self):
+            super().__init__()
+            self.fills = []
+
+        def notify_order(self, order):
+            if order.status == order.Completed:
+                self.fills.append((len(order.data) - 1, order.executed.size, order.executed.price, order.executed.comm))
+            super().notify_order(order)
+
+    order_size = params.pop("order_size", 100)
+    try:
+        fast = run_limitbuy(stock_df, fromdate, todate, cash, commission, order_size=order_size, max_drawdown=max_drawdown, **params)
+    except IndexError as e:
+        fast = repr(e)
+
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(Recorded, order_size=order_size, **params)
+    cerebro.addanalyzer(Metrics, _name="metrics")
+    if max_drawdown is not None:
+        cerebro.addanalyzer(DrawdownStop, _name="guard", max_drawdown=max_drawdown)
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.adddata(ArrayData(dataname=stock_df, fromdate=fromdate, todate=todate))
+    try:
+        strat = cerebro.run()[0]
+    except IndexError as e:
+        return isinstance(fast, str) and fast == repr(e), fast, repr(e)
+    record = dict(strat.analyzers.metrics.get_analysis())
+    if max_drawdown is not None:
+        record["pruned"] = strat.analyzers.guard.get_analysis()["pruned"]
+    reference = {"fills": strat.fills, "equity": strat.analyzers.metrics.equity, "metrics": record}
+    if isinstance(fast, str):
+        return False, fast, reference
+    fills = [(int(f["bar"]), int(f["size"]), float(f["price"]), float(f["commission"])) for f in fast.fills]
+    same = (fills == reference["fills"] and np.array_equal(fast.equity, reference["equity"])
+            and fast.metrics == reference["metrics"])
+    return same, fast, reference
+
+
+def parity_suite(frames, combos, fromdate=None, todate=None, max_drawdown=None):
+    """对每只股票的每组参数运行 verify_limitbuy，返回每组一行的 DataFrame（same 列为是否一致）"""
+    import pandas as pd
+
+    rows = []
+    for symbol, stock_df in frames.items():
+        for params in combos:
+            same, fast, reference = verify_limitbuy(stock_df, fromdate, todate, max_drawdown=max_drawdown, **params)
+            error = reference if isinstance(reference, str) else None
+            rows.append({"symbol": symbol, **params, "same": same, "error": error,
+                         "fills": None if error else len(reference["fills"])})
+    return pd.DataFrame(rows)
+
+
+def verify(stock_df, fromdate=None, todate=None, cash=100000.0, commission=0.002):
+    """
+    分别用快速引擎和 Cerebro 回测同一份数据，返回 (是否完全一致, 快速引擎指标, Cerebro 指标)
+    """
+    import backtrader as bt
+    from strategy import TailBuy
+
+    fast = run_tailbuy(stock_df, fromdate, todate, cash, commission).metrics
+
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(TailBuy)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe")
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="drawdown")
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="tradeanalyzer")
+    cerebro.addanalyzer(bt.analyzers.Returns, _name="returns")
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.adddata(bt.feeds.PandasData(dataname=stock_df, fromdate=fromdate, todate=todate))
+    strat = cerebro.run()[0]
+    trade_stats = strat.analyzers.tradeanalyzer.get_analysis()
+    won_total = trade_stats.get("won", {}).get("total", 0)
+    total_total = trade_stats.get("total", {}).get("total", 0)
+    value = cerebro.broker.getvalue()
+    reference = {
+        "value": value,
+        "pnl": value - cash,
+        "sharpe": strat.analyzers.sharpe.get_analysis()["sharperatio"],
+        "max_drawdown": strat.analyzers.drawdown.get_analysis().max.drawdown,
+        "rnorm100": strat.analyzers.returns.get_analysis()["rnorm100"],
+        "cash": cerebro.broker.getcash(),
+        "total_trades": total_total,
+        "won_trades": won_total,
+        "win_rate": won_total / total_total * 100 if total_total > 0 else None,
+    }
+    # reference 只包含四个分析器提供的指标，Sortino 等新增指标不参与比较
+    return all(fast[key] == reference[key] for key in reference), fast, reference
+
+
+if __name__ == "__main__":
+    from utils import preprocess
+
+    parser = argparse.ArgumentParser(description="对比快速引擎与 Cerebro 的回测结果")
+    parser.add_argument("--strategy", default="tailbuy", choices=["tailbuy", "limitbuy"])
+    parser.add_argument("--symbol", default="600036", type=str, help="stock code")
+    parser.add_argument("--start_date", default="20140101", help="start date of back test")
+    parser.add_argument("--end_date", default="20240101", type=str, help="choose end date of back test")
+    parser.add_argument("--synthetic", default=0, type=int, help="run the LimitBuy parity suite on N random-walk series instead of --symbol")
+    parser.add_argument("--combos", default=8, type=int, help="parameter combinations per series sampled from the sweep space")
+    parser.add_argument("--max_drawdown", default=None, type=float, help="also check DrawdownStop pruning at this percentage")
+    args = parser.parse_args()
+
+    print(f"LimitBuy 状态机: {'numba' if _limitbuy_jit is not None else '纯 Python（未安装 numba）'}")
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    end_date = datetime.today() if args.end_date == "today" else datetime.strptime(args.end_date, date_format)
+    if args.synthetic:
+        from bench import synthetic_frame
+        from sweep import DEFAULT_SPACE, random_search
+
+        frames = {f"synthetic{i}": synthetic_frame(2500, seed=i) for i in range(args.synthetic)}
+        combos = list(random_search(DEFAULT_SPACE, args.combos, seed=0))
+        table = parity_suite(frames, combos, max_drawdown=args.max_drawdown)
+        print(table.to_string(index=False))
+        print(f"一致 {int(table['same'].sum())}/{len(table)}")
+        exit(0 if table["same"].all() else 1)
+
+    adjust = "hfq" if args.strategy == "limitbuy" else "qfq"
+    stock_df = preprocess(symbol=args.symbol, adjust=adjust, start_date=start_date.strftime(date_format), end_date=end_date.strftime(date_format))
+    if stock_df is None:
+        exit()
+
+    if args.strategy == "limitbuy":
+        t0 = time.perf_counter()
+        same, fast, reference = verify_limitbuy(stock_df, start_date, end_date, max_drawdown=args.max_drawdown)
+        t1 = time.perf_counter()
+        run_limitbuy(stock_df, start_date, end_date, max_drawdown=args.max_drawdown)
+        t2 = time.perf_counter()
+        print(f"结果一致: {same}")
+        if not isinstance(reference, str):
+            print(f"成交: fast={len(fast.fills)} cerebro={len(reference['fills'])}")
+            for key in reference["metrics"]:
+                print(f"{key}: fast={fast.metrics[key]} cerebro={reference['metrics'][key]}")
+        print(f"快速引擎耗时 {(t2 - t1) * 1000:.2f} ms, Cerebro+快速引擎耗时 {(t1 - t0) * 1000:.2f} ms")
+        exit()
+
+    t0 = time.perf_counter()
+    same, fast, reference = verify(stock_df, start_date, end_date)
+    t1 = time.perf_counter()
+    run_tailbuy(stock_df, start_date, end_date)
+    t2 = time.perf_counter()
+    print(f"结果一致: {same}")
+    for key in reference:
+        print(f"{key}: fast={fast[key]} cerebro={reference[key]}")
+    print(f"快速引擎耗时 {(t2 - t1) * 1000:.2f} ms, Cerebro+快速引擎耗时 {(t1 - t0) * 1000:.2f} ms")
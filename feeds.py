@@ -0,0 +1,92 @@
+from array import array
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+LINES = ["open", "high", "low", "close", "volume"]
+
+
+def date2num(values):
+    """
+    向量化的 bt.date2num：公历序数加上当天已过去的比例，浮点运算顺序与 Backtrader 一致，结果逐位相同
+    """
+    values = np.asarray(values).astype("datetime64[us]")
+    days = values.astype("datetime64[D]")
+    base = (days - np.datetime64("0001-01-01", "D")).astype(np.int64) + 1
+    us = (values - days).astype(np.int64)
+    hour, rest = np.divmod(us, 3_600_000_000)
+    minute, rest = np.divmod(rest, 60_000_000)
+    second, micro = np.divmod(rest, 1_000_000)
+    return base.astype(np.float64) + (hour / 24.0 + minute / 1440.0 + second / 86400.0 + micro / 8.64e10)
+
+
+def _columns(dataname):
+    """把 DataFrame 或 {列名: 数组} 转换为 (datetime 数值, {line: float64 数组})"""
+    if isinstance(dataname, pd.DataFrame):
+        index = dataname.index
+        if getattr(index, "tz", None) is not None:
+            # 与 bt.date2num 一样按 UTC 存储
+            index = index.tz_convert(None)
+        dates = index.values
+        columns = {name: dataname[name].to_numpy(np.float64) for name in LINES if name in dataname}
+    else:
+        # Panel.arrays 的格式：date 为 datetime64，其余为各列数组
+        dates = dataname["date"]
+        columns = {name: np.asarray(dataname[name], dtype=np.float64) for name in LINES if name in dataname}
+    return date2num(dates), columns
+
+
+class ArrayData(bt.feed.DataBase):
+    """
+    直接由 NumPy 数组构建 lines 的数据源，用来代替 bt.feeds.PandasData
+
+    dataname 可以是 preprocess 返回的 DataFrame（只使用日期索引和 open/high/low/close/volume，
+    忽略 date 列），也可以是 panel.Panel.arrays 返回的数组字典。日期在 start 时一次性转换；
+    preload 时按 fromdate / todate 截取后整段写入各条 line 的缓冲区，不再逐根 K 线调用 load。
+    设置了时区、过滤器或 exactbars 等需要逐根处理的选项时退回 Backtrader 的逐根加载。
+    """
+
+    def start(self):
+        super().start()
+        self._dt, self._values = _columns(self.p.dataname)
+        self._row = -1
+        self._bulk = False
+
+    def _bulk_ok(self):
+        if self._tzinput or self._filters or self._ffilters or self._barstack or self._barstash:
+            return False
+        # exactbars 模式下 line 使用定长 deque，只有 array 缓冲区可以整段写入
+        return all(isinstance(line.array, array) and not len(line.array) for line in self.lines)
+
+    def preload(self):
+        if not self._bulk_ok():
+            return super().preload()
+        dt = self._dt
+        # 数据按日期升序，与逐根加载时跳过 fromdate 之前、遇到 todate 之后即停止的结果相同
+        lo = int(np.searchsorted(dt, self.fromdate, side="left"))
+        hi = int(np.searchsorted(dt, self.todate, side="right"))
+        nan = np.full(dt.size, np.nan)
+        for name in self.lines.getlinealiases():
+            values = dt if name == "datetime" else self._values.get(name, nan)
+            getattr(self.lines, name).array.frombytes(np.ascontiguousarray(values[lo:hi], dtype=np.float64).tobytes())
+        # 所有 K 线都已进入缓冲区，之后不再通过 _load 逐根读取
+        self._row = dt.size
+        self._bulk = True
+        self._last()
+        self.home()
+
+    def advance(self, size=1, datamaster=None, ticks=True):
+        # 不经过 replay / resample 时 tick_* 总是等于当根 K 线的值，broker 在 tick_open 等为 None 时
+        # 直接读取 open[0]，跳过每根 K 线对每个数据源的 tick 清空和填充，多数据源组合回测时开销明显
+        super().advance(size, datamaster, ticks=ticks and not self._bulk)
+
+    def _load(self):
+        self._row += 1
+        if self._row >= self._dt.size:
+            return False
+        i = self._row
+        self.lines.datetime[0] = float(self._dt[i])
+        for name, values in self._values.items():
+            getattr(self.lines, name)[0] = float(values[i])
+        return True
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from instrument import Recorder, phase
+from utils import factor_fetcher, fetch_hist, get_cache
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限速器，每秒补充 rate 个令牌，最多积累 burst 个
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                delay = (1.0 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+@dataclass
+class FetchStatus:
+    """单只股票的下载结果"""
+    symbol: str
+    status: str = "pending"  # ok / empty / failed
+    attempts: int = 0  # 实际发出的网络请求次数（命中缓存时为 0）
+    retries: int = 0  # 其中失败后重试的次数
+    rows: int = 0
+    elapsed: float = 0.0
+    error: str = None
+
+
+@dataclass
+class FetchReport:
+    """批量下载的汇总"""
+    statuses: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def by_status(self, status):
+        return [s for s in self.statuses if s.status == status]
+
+    @property
+    def failed(self):
+        return self.by_status("failed")
+
+    @property
+    def retries(self):
+        return sum(s.retries for s in self.statuses)
+
+    def __str__(self):
+        total = len(self.statuses)
+        rows = sum(s.rows for s in self.statuses)
+        rate = total / self.elapsed if self.elapsed else float("inf")
+        text = (
+            f"下载 {total} 只股票, 成功 {len(self.by_status('ok'))}, 无数据 {len(self.by_status('empty'))}, "
+            f"失败 {len(self.failed)}, 重试 {self.retries} 次, 共 {rows} 行, "
+            f"耗时 {self.elapsed:.1f}s ({rate:.1f} 只/s)"
+        )
+        for s in self.failed:
+            text += f"\n  {s.symbol}: {s.error}"
+        return text
+
+
+def bulk_fetch(symbols, adjust, start_date, end_date, fetcher=None, cache=None, workers=8,
+               rate=5.0, burst=None, retries=3, backoff=0.5, max_backoff=8.0, recorder=None):
+    """
+    并发下载多只股票的日线，返回 ({symbol: DataFrame}, FetchReport)
+
+    使用有界线程池；每次实际的网络请求先从令牌桶取令牌（命中本地缓存不消耗），
+    失败后按指数退避（带随机抖动）最多重试 retries 次。fetcher 与 preprocess 的同名参数一致，
+    可传入 cache.FakeFetcher 离线测试。cache 为 None 时使用默认缓存，为 False 时不使用缓存。
+    recorder 为 instrument.Recorder 时每只股票记录一条 stage 为 fetch 的分阶段耗时。
+    """
+    bucket = TokenBucket(rate, burst)
+    recorder = recorder or Recorder()
+    if cache is None:
+        cache = get_cache()
+    factors = factor_fetcher(fetcher)
+
+    def fetch_one(symbol):
+        status = FetchStatus(symbol)
+        t0 = time.perf_counter()
+
+        def retried(func, *args):
+            # 重试只针对网络请求本身，已经成功的区间不会重复下载
+            for attempt in range(retries + 1):
+                with phase("rate_limit"):
+                    bucket.acquire()
+                status.attempts += 1
+                status.retries += attempt > 0
+                try:
+                    return func(*args)
+                except Exception:
+                    if attempt == retries:
+                        raise
+                    delay = min(max_backoff, backoff * 2 ** attempt)
+                    time.sleep(delay * (0.5 + random.random() / 2))
+
+        def limited(s, a, lo, hi):
+            return retried(lambda: fetch_hist(s, a, lo, hi, fetcher=fetcher))
+
+        try:
+            if cache:
+                with phase("cache"):
+                    df = cache.load(symbol, adjust, start_date, end_date, fetch=limited,
+                                    fetch_factors=factors and (lambda s: retried(factors, s)))
+            else:
+                df = limited(symbol, adjust, start_date, end_date)
+            status.rows = len(df)
+            status.status = "ok" if len(df) else "empty"
+        except Exception as e:
+            df = None
+            status.status = "failed"
+            status.error = repr(e)
+        status.elapsed = time.perf_counter() - t0
+        return df, status
+
+    report = FetchReport()
+    frames = {}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for symbol, (df, status) in zip(symbols, pool.map(lambda s: recorder.run("fetch", s, fetch_one, s), symbols)):
+            report.statuses.append(status)
+            if status.status == "ok":
+                frames[symbol] = df
+    report.elapsed = time.perf_counter() - t0
+    return frames, report
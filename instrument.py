@@ -0,0 +1,303 @@
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+_NULL = nullcontext()
+_local = threading.local()
+
+
+class SymbolProfile:
+    """
+    一只股票（或一次运行）的分阶段记录：每个阶段的墙钟时间、CPU 时间、调用次数和内存峰值
+
+    阶段可以嵌套，记录的是扣除子阶段之后的独占时间，各阶段相加等于总耗时。
+    trace_memory 为 True 时用 tracemalloc 统计每个阶段的 Python 内存分配峰值（会明显拖慢运行）。
+    """
+
+    def __init__(self, symbol, stage=None, trace_memory=False):
+        self.symbol = symbol
+        self.stage = stage
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.counts = {}
+        self._stack = []
+        self._started = None
+
+    def __enter__(self):
+        self._started = (time.perf_counter(), time.process_time())
+        self._started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._previous = getattr(_local, "current", None)
+        _local.current = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.current = self._previous
+        self.wall = time.perf_counter() - self._started[0]
+        self.cpu = time.process_time() - self._started[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+        return False
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def add(self, name, wall, cpu=0.0, calls=1):
+        """直接累加一段已经测好的时间（用于逐根 K 线计时这类不适合用上下文管理器的地方）"""
+        stat = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        stat["wall"] += wall
+        stat["cpu"] += cpu
+        stat["calls"] += calls
+        if self._stack:
+            self._stack[-1].child_wall += wall
+            self._stack[-1].child_cpu += cpu
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record(self):
+        """返回可 json 序列化的 dict"""
+        return {
+            "symbol": self.symbol,
+            "stage": self.stage,
+            "pid": os.getpid(),
+            "wall": self.wall,
+            "cpu": self.cpu,
+            # 进程级的常驻内存峰值（KiB），多只股票在同一进程中运行时只增不减
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "phases": self.phases,
+            **self.counts,
+        }
+
+
+class _Phase:
+    __slots__ = ("profile", "name", "wall", "cpu", "child_wall", "child_cpu", "peak")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.child_wall = self.child_cpu = 0.0
+        self.peak = 0
+        if self.profile.trace_memory:
+            # 父阶段到目前为止的峰值先记下来，再为本阶段重新计数
+            if self.profile._stack:
+                parent = self.profile._stack[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.profile._stack.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stack = self.profile._stack
+        stack.pop()
+        # 子阶段的时间已经在 add 时计入 child_*，本阶段只记独占部分，同时把整段时间计入父阶段的子阶段
+        self.profile.add(self.name, wall - self.child_wall, cpu - self.child_cpu)
+        if stack:
+            stack[-1].child_wall += self.child_wall
+            stack[-1].child_cpu += self.child_cpu
+        if self.profile.trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            stat = self.profile.phases[self.name]
+            stat["peak_bytes"] = max(stat.get("peak_bytes", 0), self.peak)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        return False
+
+
+def current():
+    """当前线程正在记录的 SymbolProfile，没有开启记录时为 None"""
+    return getattr(_local, "current", None)
+
+
+def phase(name):
+    """
+    在当前记录中计时一个阶段；没有开启记录时返回共享的空上下文，开销只有一次属性查找
+    """
+    profile = getattr(_local, "current", None)
+    return _NULL if profile is None else _Phase(profile, name)
+
+
+def count(name, n=1):
+    profile = getattr(_local, "current", None)
+    if profile is not None:
+        profile.count(name, n)
+
+
+class Recorder:
+    """
+    把每只股票的 SymbolProfile 以 JSON lines 追加写入 path
+
+    每条记录用一次 write 追加，多个进程写同一个文件时行不会交错。path 为 None 时不记录。
+    """
+
+    def __init__(self, path=None, trace_memory=False):
+        self.path = path
+        self.trace_memory = trace_memory
+
+    def __bool__(self):
+        return self.path is not None
+
+    def symbol(self, symbol, stage=None):
+        """返回 symbol 的 SymbolProfile 上下文；没有开启记录时返回空上下文（as 得到 None）"""
+        if self.path is None:
+            return _NULL
+        return SymbolProfile(symbol, stage=stage, trace_memory=self.trace_memory)
+
+    def run(self, stage, symbol, func, *args, **kwargs):
+        """在 symbol 的记录中运行 func 并写入一条记录；没有开启记录时直接调用 func"""
+        if self.path is None:
+            return func(*args, **kwargs)
+        with self.symbol(symbol, stage) as profile:
+            result = func(*args, **kwargs)
+        self.write(profile)
+        return result
+
+    def truncate(self):
+        if self.path is not None:
+            open(self.path, "w").close()
+
+    def write(self, profile):
+        if self.path is None or profile is None:
+            return
+        line = json.dumps(profile.record(), ensure_ascii=False) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _timed(profile, name, func, *args):
+    t0, c0 = time.perf_counter(), time.process_time()
+    result = func(*args)
+    profile.add(name, time.perf_counter() - t0, time.process_time() - c0)
+    return result
+
+
+def instrument_strategy(strategy_cls):
+    """
+    返回计时版的策略子类：分别累计 next、analyzer、订单通知的耗时，并统计 K 线数和下单次数
+
+    只有开启记录时才使用这个子类，关闭时策略本身没有任何额外开销。
+    """
+
+    class Instrumented(strategy_cls):
+
+        def __init__(self):
+            self._profile = current()
+            run = self._profile._stack[-1] if self._profile and self._profile._stack else None
+            if run is not None and run.name == "engine":
+                # 数据在策略实例化之前完成 preload，从 run_cerebro 开始到这里都记为 preload
+                self._profile.add("preload", time.perf_counter() - run.wall - run.child_wall,
+                                  time.process_time() - run.cpu - run.child_cpu)
+            if self._profile is not None:
+                self._profile.count("bars", self.data.buflen())
+            super().__init__()
+
+        def next(self):
+            _timed(self._profile, "next", super().next)
+
+        def _next_analyzers(self, minperstatus, once=False):
+            _timed(self._profile, "analyzers", super()._next_analyzers, minperstatus, once)
+
+        def notify_order(self, order):
+            _timed(self._profile, "notify", super().notify_order, order)
+
+        def buy(self, *args, **kwargs):
+            self._profile.count("orders")
+            return super().buy(*args, **kwargs)
+
+        def sell(self, *args, **kwargs):
+            self._profile.count("orders")
+            return super().sell(*args, **kwargs)
+
+    Instrumented.__name__ = strategy_cls.__name__
+    Instrumented.__qualname__ = strategy_cls.__qualname__
+    return Instrumented
+
+
+def run_cerebro(cerebro):
+    """
+    计时运行 cerebro.run()，没有开启记录时等同于 cerebro.run()
+
+    配合 instrument_strategy 使用时，preload、next、analyzers、notify 分别计时，
+    剩余的撮合、observer 等开销记为 engine。
+    """
+    with phase("engine"):
+        return cerebro.run()
+
+
+def summarize(records, top=10):
+    """汇总各阶段总耗时并列出最慢的 top 只股票，返回文本"""
+    totals = {}
+    for r in records:
+        for name, stat in r["phases"].items():
+            totals[name] = totals.get(name, 0.0) + stat["wall"]
+    wall = sum(r["wall"] for r in records) or float("nan")
+    lines = [f"共 {len(records)} 条记录, 合计 {wall:.2f}s"]
+    width = max(map(len, totals), default=0)
+    for name, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {name:<{width}} {seconds:10.3f}s {100 * seconds / wall:6.1f}%")
+    lines.append(f"最慢的 {min(top, len(records))} 只:")
+    for r in slowest(records, top):
+        phases = ", ".join(f"{k} {v['wall']:.3f}s" for k, v in sorted(r["phases"].items(), key=lambda kv: -kv[1]["wall"]))
+        lines.append(f"  {r['symbol']}: {r['wall']:.3f}s ({phases})")
+    return "\n".join(lines)
+
+
+def slowest(records, n):
+    return sorted(records, key=lambda r: r["wall"], reverse=True)[:n]
+
+
+def profile_call(func, path, tool="cprofile"):
+    """
+    在 cProfile（或已安装的 pyinstrument）下运行 func()，返回写入的文件路径
+
+    cProfile 输出可用 `python -m pstats` 或 snakeviz 查看；pyinstrument 输出为 html。
+    """
+    if tool == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("未安装 pyinstrument，改用 cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                func()
+            finally:
+                profiler.stop()
+                with open(path + ".html", "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            return path + ".html"
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(func)
+    finally:
+        profiler.dump_stats(path + ".prof")
+    return path + ".prof"
+
+
+def profile_slowest(records, n, func, out_dir="profiles", tool="cprofile"):
+    """
+    对 records 中最慢的 n 只股票重新运行一次 func(symbol) 并采集调用剖析，文件写入 out_dir
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for r in slowest(records, n):
+        path = profile_call(lambda: func(r["symbol"]), os.path.join(out_dir, str(r["symbol"])), tool=tool)
+        print(f"{r['symbol']}: {r['wall']:.3f}s, 调用剖析已写入 {path}")
@@ -0,0 +1,314 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import struct
+import threading
+import uuid
+from collections import deque
+from multiprocessing import util
+
+import numpy as np
+import pandas as pd
+
+DEBUG, INFO, WARNING = logging.DEBUG, logging.INFO, logging.WARNING
+KINDS = ["log", "order", "fill", "trade"]
+MAGIC = b"TJRNL001"
+# 每个数据块内按列连续存储；symbol 和 message 存为块内字符串表的序号，message 为 -1 表示没有文本
+COLUMNS = [
+    ("dt", "<f8"),
+    ("symbol", "<u4"),
+    ("level", "u1"),
+    ("kind", "u1"),
+    ("side", "i1"),
+    ("price", "<f8"),
+    ("size", "<f8"),
+    ("value", "<f8"),
+    ("commission", "<f8"),
+    ("pnl", "<f8"),
+    ("message", "<i4"),
+]
+_BLOCK = struct.Struct("<II")  # 块头：字符串表长度、列数据长度
+_KIND = {kind: i for i, kind in enumerate(KINDS)}
+
+
+def _encode(batch):
+    """把事件元组列表编码为一个列式数据块"""
+    columns = list(zip(*batch))
+    symbols, messages = {}, []
+    columns[1] = [symbols.setdefault(symbol, len(symbols)) for symbol in columns[1]]
+    ids = []
+    for message in columns[-1]:
+        if message is None:
+            ids.append(-1)
+        else:
+            ids.append(len(messages))
+            messages.append(message)
+    columns[-1] = ids
+    header = json.dumps({"n": len(batch), "symbols": list(symbols), "messages": messages}, ensure_ascii=False).encode()
+    body = b"".join(np.asarray(values, dtype=dtype).tobytes() for values, (_, dtype) in zip(columns, COLUMNS))
+    return _BLOCK.pack(len(header), len(body)) + header + body
+
+
+def _decode(buf):
+    """逐块解码一个日志文件，返回各块的 DataFrame"""
+    if buf[:len(MAGIC)] != MAGIC:
+        raise ValueError("不是交易日志文件")
+    pos = len(MAGIC)
+    while pos + _BLOCK.size <= len(buf):
+        header_len, body_len = _BLOCK.unpack_from(buf, pos)
+        pos += _BLOCK.size
+        if pos + header_len + body_len > len(buf):
+            break  # 写入中途中断的最后一块
+        header = json.loads(buf[pos:pos + header_len])
+        pos += header_len
+        n, frame, offset = header["n"], {}, pos
+        for name, dtype in COLUMNS:
+            values = np.frombuffer(buf, dtype=dtype, count=n, offset=offset)
+            offset += values.nbytes
+            frame[name] = values
+        pos += body_len
+        symbols = np.asarray(header["symbols"], dtype=object)
+        messages = np.asarray(header["messages"] + [None], dtype=object)
+        frame["symbol"] = symbols[frame["symbol"]]
+        frame["message"] = messages[frame["message"]]
+        yield pd.DataFrame(frame)
+
+
+def _num2datetime(nums):
+    # Backtrader 的日期数值：整数部分是公历序数（0001-01-01 为 1），小数部分是当天已过去的比例
+    nums = np.asarray(nums, dtype=np.float64)
+    days = np.floor(nums)
+    us = np.round((nums - days) * 8.64e10).astype(np.int64)
+    return (np.datetime64("0001-01-01", "D") + (days.astype(np.int64) - 1)).astype("datetime64[us]") + us.astype("timedelta64[us]")
+
+
+def format_event(row):
+    """单条事件的可读文本，格式与策略的 log 输出一致"""
+    if row.kind == "fill":
+        text = f"{'买单' if row.side > 0 else '卖单'}执行 @ {row.price:.2f}, 数量 {abs(row.size):.0f}, 手续费 {row.commission:.2f}"
+    elif row.kind == "trade":
+        text = f"盈利 {row.pnl:.2f}"
+    else:
+        text = row.message or ""
+    return f"{row.datetime.date().isoformat()} [{row.symbol}] {text}"
+
+
+def print_sink(frame):
+    """按策略 log 的格式打印一批事件，作为可选的输出端"""
+    print("\n".join(format_event(row) for row in frame.itertuples()))
+
+
+def log_sink(frame):
+    """只打印策略的文本日志，每行与不写交易日志时 printlog 打印的相同（日期 + 文本，没有 [symbol]；成交和平仓已在文本日志中）"""
+    lines = [f"{row.datetime.date().isoformat()} {row.message or ''}" for row in frame.itertuples() if row.kind == "log"]
+    if lines:
+        print("\n".join(lines))
+
+
+class Journal:
+    """
+    交易日志：订单、成交、平仓和策略文本日志先追加到内存缓冲区，由后台线程成批写入列式二进制文件
+
+    path 为目录，每个 Journal 写入其中一个独立的 part 文件，多进程扫描时各进程互不干扰，
+    用 read_journal 读取整个目录。低于 level 的事件在记录时直接丢弃。
+    缓冲区达到 batch_size 条或距上次写入超过 interval 秒时写入一块；缓冲区超过 capacity 条时
+    记录事件的线程阻塞到后台线程写到 capacity 以下再继续，内存占用有上限。sinks 为在写入后对每批事件（DataFrame）
+    调用的函数，例如 print_sink。
+    """
+
+    def __init__(self, path="trade_journal", level=INFO, batch_size=4096, interval=1.0, capacity=65536, sinks=()):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.level = level
+        self.batch_size = batch_size
+        self.interval = interval
+        self.capacity = capacity
+        self.sinks = list(sinks)
+        self.file = os.path.join(path, f"part-{os.getpid()}-{uuid.uuid4().hex[:8]}.tjr")
+        self.events = 0
+        self._buf = deque()  # append / popleft 线程安全，记录事件时不需要加锁
+        self._wake = threading.Event()
+        self._written = threading.Condition()
+        self._closed = False
+        self._fh = open(self.file, "wb")
+        self._fh.write(MAGIC)
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def _append(self, event):
+        self._buf.append(event)
+        self.events += 1
+        if len(self._buf) >= self.batch_size:
+            self._wake.set()
+            if len(self._buf) >= self.capacity:
+                # 一直等到后台线程把缓冲区写到 capacity 以下；每隔 interval 秒重新唤醒一次，后台线程异常退出时不再等待
+                with self._written:
+                    while len(self._buf) >= self.capacity and not self._closed and self._thread.is_alive():
+                        self._wake.set()
+                        self._written.wait(self.interval)
+
+    def _drain(self):
+        buf = self._buf
+        while buf:
+            batch = [buf.popleft() for _ in range(min(len(buf), self.batch_size))]
+            self._fh.write(_encode(batch))
+            with self._written:
+                self._written.notify_all()
+            if self.sinks:
+                frame = self._frame(batch)
+                for sink in self.sinks:
+                    sink(frame)
+        self._fh.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._drain()
+        self._drain()
+
+    @staticmethod
+    def _frame(batch):
+        frame = pd.DataFrame(batch, columns=[name for name, _ in COLUMNS])
+        frame.insert(0, "datetime", _num2datetime(frame.pop("dt")))
+        frame["level"] = frame["level"].map(logging.getLevelName)
+        frame["kind"] = frame["kind"].map(KINDS.__getitem__)
+        return frame
+
+    def log(self, data, txt, level=INFO, dt=None):
+        """策略的文本日志，data 为产生日志的数据源"""
+        if level < self.level:
+            return
+        self._append((dt if dt is not None else data.datetime[0], data._name or "", level, 0, 0,
+                      np.nan, np.nan, np.nan, np.nan, np.nan, txt))
+
+    def order(self, order):
+        """订单的最终状态：成交记为 fill，取消 / 保证金不足 / 拒绝 / 过期记为 order"""
+        side = 1 if order.isbuy() else -1
+        if order.status == order.Completed:
+            if INFO < self.level:
+                return
+            ex = order.executed
+            self._append((ex.dt, order.data._name or "", INFO, 2, side, ex.price, ex.size, ex.value, ex.comm, np.nan, None))
+        else:
+            if WARNING < self.level:
+                return
+            self._append((order.data.datetime[0], order.data._name or "", WARNING, 1, side, order.created.price or np.nan,
+                          order.created.size, np.nan, np.nan, np.nan, order.getstatusname()))
+
+    def trade(self, trade):
+        """平仓的交易"""
+        if INFO < self.level or not trade.isclosed:
+            return
+        self._append((trade.dtclose, trade.data._name or "", INFO, 3, 0, trade.price, np.nan, np.nan,
+                      trade.commission, trade.pnlcomm, None))
+
+    def flush(self):
+        """通知后台线程尽快写入，不等待"""
+        self._wake.set()
+
+    def close(self):
+        """写入剩余事件并关闭文件，可重复调用"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_journals = {}  # (pid, path) -> 本进程的 Journal
+
+
+def open_journal(path, **kwargs):
+    """
+    返回本进程写入 path 的 Journal，不存在时创建
+
+    工作进程中的 Journal 在进程退出时自动关闭（进程池的工作进程不执行 atexit，用 multiprocessing 的 Finalize）。
+    """
+    key = (os.getpid(), path)
+    if key not in _journals:
+        journal = _journals[key] = Journal(path, **kwargs)
+        atexit.register(journal.close)
+        util.Finalize(journal, journal.close, exitpriority=10)
+    return _journals[key]
+
+
+def close_journals():
+    """关闭本进程打开的所有 Journal"""
+    for (pid, _), journal in list(_journals.items()):
+        if pid == os.getpid():
+            journal.close()
+
+
+def read_journal(path, symbol=None, kind=None, level=None, start=None, end=None):
+    """
+    读取目录（包括子目录，例如 tail_buy_filter.py 每次运行的 run-*）或单个 part 文件中的全部事件，按时间排序返回 DataFrame
+
+    symbol / kind 可以是单个值或列表；level 为最低日志级别；start / end 按事件时间过滤（闭区间）。
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith(".tjr"))
+    else:
+        files = [path]
+    frames = []
+    for file in files:
+        with open(file, "rb") as fh:
+            frames.extend(_decode(fh.read()))
+    if not frames:
+        return pd.DataFrame(columns=["datetime"] + [name for name, _ in COLUMNS if name != "dt"])
+    df = pd.concat(frames, ignore_index=True)
+    mask = np.ones(len(df), dtype=bool)
+    if symbol is not None:
+        mask &= df["symbol"].isin([symbol] if isinstance(symbol, str) else symbol).to_numpy()
+    if kind is not None:
+        mask &= df["kind"].isin([_KIND[k] for k in ([kind] if isinstance(kind, str) else kind)]).to_numpy()
+    if level is not None:
+        mask &= df["level"].to_numpy() >= level
+    df = df[mask]
+    df.insert(0, "datetime", _num2datetime(df.pop("dt")))
+    if start is not None:
+        df = df[df["datetime"] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df["datetime"] <= pd.Timestamp(end)]
+    df["level"] = df["level"].map(logging.getLevelName)
+    df["kind"] = df["kind"].map(KINDS.__getitem__)
+    return df.sort_values(["datetime", "symbol"], kind="stable").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询交易日志")
+    parser.add_argument("path", nargs="?", default="trade_journal", help="journal directory or part file")
+    parser.add_argument("--symbol", default=None, type=str, help="comma separated stock codes")
+    parser.add_argument("--kind", default=None, type=str, help="comma separated event kinds: log, order, fill, trade")
+    parser.add_argument("--level", default=None, choices=["DEBUG", "INFO", "WARNING"], help="minimum log level")
+    parser.add_argument("--start_date", default=None, help="only events on or after this date, e.g. 20200101")
+    parser.add_argument("--end_date", default=None, help="only events on or before this date")
+    parser.add_argument("--text", action="store_true", help="print events in the strategy log format instead of a table")
+    parser.add_argument("--output", default=None, help="also write the selected events to this CSV file")
+    args = parser.parse_args()
+
+    events = read_journal(
+        args.path,
+        symbol=args.symbol.split(",") if args.symbol else None,
+        kind=args.kind.split(",") if args.kind else None,
+        level=logging.getLevelName(args.level) if args.level else None,
+        start=args.start_date,
+        end=args.end_date,
+    )
+    if args.text:
+        if not events.empty:
+            print_sink(events)
+    else:
+        print(events.to_string(index=False))
+    if args.output:
+        events.to_csv(args.output, index=False)
+    print(f"共 {len(events)} 条事件")
@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+import backtrader as bt
+
+from utils import preprocess
+from feeds import ArrayData
+from strategy import TailBuy
+from buy_with_limit import LimitBuy
+
+STATE_VERSION = 2
+# 需要随快照保存的策略属性，LimitBuy 的网格记录决定后续的加减仓价格
+STATE_ATTRS = ("last_buy_price", "last_position_price")
+# 策略中引用挂单的属性名
+ORDER_ATTRS = ("order", "stop_order")
+STRATEGIES = {
+    "tailbuy": (TailBuy, "qfq"),
+    "limitbuy": (LimitBuy, "hfq"),
+}
+
+
+def make_resumable(strategy_cls):
+    """
+    返回可以从快照恢复、结束时生成快照的策略子类
+
+    恢复时数据从快照的最后一根 K 线开始：这根 K 线只用于恢复持仓和重新提交挂单（与原挂单一样
+    从下一根 K 线开始撮合），不执行策略逻辑；之后的新 K 线正常运行。未平仓的 Trade（均价、已付手续费、
+    部分平仓的盈亏、开仓时间）也一并恢复，之后平仓时 notify_trade 的结果与完整回放相同。
+    """
+
+    class Resumable(strategy_cls):
+        params = (("snapshot", None),)
+
+        def __init__(self):
+            super().__init__()
+            self._live_orders = []
+            self._replay_until = None
+            self.snapshot_out = None
+
+        def buy(self, *args, **kwargs):
+            order = super().buy(*args, **kwargs)
+            if order is not None:
+                self._live_orders.append(order)
+            return order
+
+        def sell(self, *args, **kwargs):
+            order = super().sell(*args, **kwargs)
+            if order is not None:
+                self._live_orders.append(order)
+            return order
+
+        def start(self):
+            super().start()
+            snap = self.p.snapshot
+            if not snap:
+                return
+            position = self.broker.getposition(self.data)
+            position.size = snap["position"]["size"]
+            position.price = snap["position"]["price"]
+            position.adjbase = snap["position"]["price"]
+            if snap["trade"]:
+                self._restore_trade(snap["trade"])
+            for name, values in snap["attrs"].items():
+                current = getattr(self, name, None)
+                if isinstance(current, deque):
+                    current.clear()
+                    current.extend(values)
+                else:
+                    setattr(self, name, values)
+            self._replay_until = datetime.strptime(snap["last_date"], "%Y-%m-%d").date()
+
+        def next(self):
+            if self._replay_until is not None and self.data.datetime.date(0) <= self._replay_until:
+                if self.data.datetime.date(0) == self._replay_until:
+                    self._resubmit()
+                return
+            self._live_orders = [o for o in self._live_orders if o.alive()]
+            super().next()
+
+        def _restore_trade(self, spec):
+            # Backtrader 按 strategy._trades[data][tradeid] 的最后一个未平仓 Trade 累计成交，这里放回快照中的那一个
+            trade = bt.Trade(data=self.data, tradeid=0, size=spec["size"], price=spec["price"],
+                             value=spec["value"], commission=spec["commission"])
+            trade.pnl = spec["pnl"]
+            trade.pnlcomm = spec["pnl"] - spec["commission"]
+            trade.isopen = True
+            trade.status = trade.Open
+            trade.long = spec["size"] > 0
+            trade.dtopen = spec["dtopen"]
+            # 快照的最后一根 K 线是本次运行的第 1 根，barlen 从那里接着计算
+            trade.baropen = 1 - spec["barlen"]
+            self._trades[self.data][0].append(trade)
+
+        def _resubmit(self):
+            for spec in self.p.snapshot["orders"]:
+                kwargs = {"size": spec["size"], "exectype": getattr(bt.Order, spec["exectype"])}
+                if spec["price"] is not None:
+                    kwargs["price"] = spec["price"]
+                if spec["valid"] is not None:
+                    kwargs["valid"] = datetime.fromisoformat(spec["valid"])
+                order = self.buy(**kwargs) if spec["side"] == "buy" else self.sell(**kwargs)
+                if spec["attr"]:
+                    setattr(self, spec["attr"], order)
+            self._replay_until = None
+
+        def stop(self):
+            super().stop()
+            self.snapshot_out = take_snapshot(self)
+
+    Resumable.__name__ = strategy_cls.__name__
+    Resumable.__qualname__ = strategy_cls.__qualname__
+    return Resumable
+
+
+def _round_seconds(dt):
+    # bt 的日期数值是浮点数，转换回 datetime 会出现 23:59:59.99999 这样的误差
+    return (dt + timedelta(microseconds=500000)).replace(microsecond=0)
+
+
+def take_snapshot(strat):
+    """记录持仓、现金、挂单和策略状态，返回可 json 序列化的 dict"""
+    position = strat.broker.getposition(strat.data)
+    orders = []
+    for order in strat._live_orders:
+        if not order.alive():
+            continue
+        attr = next((name for name in ORDER_ATTRS if getattr(strat, name, None) is order), None)
+        remaining = abs(order.executed.remsize) or abs(order.created.size)
+        orders.append({
+            "side": "buy" if order.isbuy() else "sell",
+            "size": remaining,
+            "exectype": bt.Order.ExecTypes[order.exectype],
+            "price": order.price if order.exectype != bt.Order.Market else None,
+            "valid": _round_seconds(bt.num2date(order.valid)).isoformat() if order.valid else None,
+            "attr": attr,
+        })
+    trades = strat._trades[strat.data][0]
+    trade = trades[-1] if trades and trades[-1].isopen else None
+    attrs = {}
+    for name in STATE_ATTRS:
+        if hasattr(strat, name):
+            value = getattr(strat, name)
+            attrs[name] = list(value) if isinstance(value, deque) else value
+    return {
+        "version": STATE_VERSION,
+        "strategy": type(strat).__name__,
+        "params": {k: v for k, v in strat.p._getkwargs().items() if k != "snapshot"},
+        "last_date": strat.data.datetime.date(0).isoformat(),
+        "last_close": strat.data.close[0],
+        "cash": strat.broker.getcash(),
+        "value": strat.broker.getvalue(),
+        "position": {"size": position.size, "price": position.price},
+        "trade": {
+            "size": trade.size, "price": trade.price, "value": trade.value, "commission": trade.commission,
+            "pnl": trade.pnl, "dtopen": trade.dtopen, "barlen": len(strat.data) - trade.baropen,
+        } if trade else None,
+        "orders": orders,
+        "attrs": attrs,
+    }
+
+
+def run_incremental(strategy_cls, stock_df, snapshot=None, cash=100000, commission=0.002, **params):
+    """
+    运行策略并返回 (结束时的快照, 策略实例)
+
+    提供 snapshot 时从快照恢复，stock_df 只需包含快照最后一根 K 线及之后的新数据。
+    """
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(make_resumable(strategy_cls), snapshot=snapshot, **params)
+    cerebro.broker.setcash(snapshot["cash"] if snapshot else cash)
+    cerebro.broker.setcommission(commission=commission)
+    if snapshot:
+        stock_df = stock_df[stock_df.index >= snapshot["last_date"]]
+    cerebro.adddata(ArrayData(dataname=stock_df))
+    strat = cerebro.run()[0]
+    return strat.snapshot_out, strat
+
+
+def _state_path(state_dir, name, symbol):
+    return os.path.join(state_dir, f"{name}_{symbol}.json")
+
+
+def load_snapshot(state_dir, name, symbol):
+    path = _state_path(state_dir, name, symbol)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        snap = json.load(f)
+    return snap if snap.get("version") == STATE_VERSION else None
+
+
+def save_snapshot(state_dir, name, symbol, snap):
+    os.makedirs(state_dir, exist_ok=True)
+    path = _state_path(state_dir, name, symbol)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snap, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def update_symbol(name, symbol, state_dir, start_date, end_date, printlog=False):
+    """
+    对一只股票做增量更新：有快照时只处理快照之后的新 K 线，否则从 start_date 完整回放一次
+    返回新的快照
+    """
+    strategy_cls, adjust = STRATEGIES[name]
+    snap = load_snapshot(state_dir, name, symbol)
+    if snap is not None and snap["last_date"] >= end_date.strftime("%Y-%m-%d"):
+        return snap  # 没有新数据
+    lo = datetime.strptime(snap["last_date"], "%Y-%m-%d") if snap else start_date
+    stock_df = preprocess(symbol=symbol, adjust=adjust, start_date=lo.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
+    if stock_df is None:
+        return snap
+    if snap is not None:
+        anchor = stock_df[stock_df.index == snap["last_date"]]
+        if anchor.empty or abs(anchor["close"].iloc[0] - snap["last_close"]) > 1e-6:
+            # 复权价格发生变化（除权除息）或缺少衔接的 K 线，快照中的持仓成本已不可比，完整回放一次
+            print(f"{symbol}: 快照与最新数据不一致，从 {start_date.strftime('%Y-%m-%d')} 重新回放")
+            snap = None
+            stock_df = preprocess(symbol=symbol, adjust=adjust, start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
+            if stock_df is None:
+                return None
+    new_snap, _ = run_incremental(strategy_cls, stock_df, snapshot=snap, printlog=printlog)
+    save_snapshot(state_dir, name, symbol, new_snap)
+    return new_snap
+
+
+def print_signals(symbol, snap):
+    position = snap["position"]
+    print(f"[{symbol}] {snap['last_date']} 收盘 {snap['last_close']:.2f}, 持股 {position['size']} 成本 {position['price']:.2f}, "
+          f"现金 {snap['cash']:.2f}, 总资金 {snap['value']:.2f}")
+    for order in snap["orders"]:
+        side = "买入" if order["side"] == "buy" else "卖出"
+        price = "市价" if order["price"] is None else f"限价 {order['price']:.2f}"
+        valid = f", 有效期至 {order['valid'][:10]}" if order["valid"] else ""
+        print(f"    下一交易日{side} {order['size']} 股, {price}{valid}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="每日增量更新：从快照恢复策略状态，只处理新的 K 线并输出交易信号")
+    parser.add_argument("--strategy", default="tailbuy", choices=sorted(STRATEGIES))
+    parser.add_argument("--symbols", default="600036", type=str, help="comma separated watchlist")
+    parser.add_argument("--start_date", default="20140101", help="start date when no snapshot exists")
+    parser.add_argument("--end_date", default="today", type=str, help="last date to process")
+    parser.add_argument("--state_dir", default="live_state", help="snapshot directory")
+    parser.add_argument("--reset", action="store_true", help="ignore existing snapshots and replay from start_date")
+    parser.add_argument("--printlog", action="store_true", help="print order and trade logs")
+    args = parser.parse_args()
+
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    end_date = datetime.today() if args.end_date == "today" else datetime.strptime(args.end_date, date_format)
+    for symbol in args.symbols.split(","):
+        if args.reset and os.path.exists(_state_path(args.state_dir, args.strategy, symbol)):
+            os.remove(_state_path(args.state_dir, args.strategy, symbol))
+        snap = update_symbol(args.strategy, symbol, args.state_dir, start_date, end_date, printlog=args.printlog)
+        if snap is not None:
+            print_signals(symbol, snap)
@@ -1,26 +1,42 @@
+import argparse
+
 import akshare as ak
 
-# 当日上交所汇总信息
-stock_sse_summary_df = ak.stock_sse_summary()
-print(stock_sse_summary_df)
+from instrument import Recorder, phase, summarize
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--profile", default=None, type=str, help="write per-call timings to this JSON lines file")
+args = parser.parse_args()
+recorder = Recorder(args.profile)
 
-# 当日个股信息
-# 参考信息
-# 招商银行：600036
-# 宇通客车：600066
-# 中国核电：601985
-# 浙江鼎力：603338
-# 海信家电：000921
-stock_individual_info_em_df = ak.stock_individual_info_em(symbol="600036")
-print(stock_individual_info_em_df)
+with recorder.symbol("main") as profile:
+    # 当日上交所汇总信息
+    with phase("stock_sse_summary"):
+        stock_sse_summary_df = ak.stock_sse_summary()
+    print(stock_sse_summary_df)
 
-# 历史数据查询
-# adjust：‘’ 不复权，‘qfq’ 前复权（保持现在价格不变，调整历史股价），‘hfq’ 后复权（保持历史价格不变，调整现价，一般用于量化策略研究）
-# period='daily'; choice of {'daily', 'weekly', 'monthly'}
-stock_zh_a_hist_df = ak.stock_zh_a_hist(symbol="600036", period="daily", start_date="20170101", end_date='20241122', adjust="qfq")
-print(stock_zh_a_hist_df)
+    # 当日个股信息
+    # 参考信息
+    # 招商银行：600036
+    # 宇通客车：600066
+    # 中国核电：601985
+    # 浙江鼎力：603338
+    # 海信家电：000921
+    with phase("stock_individual_info_em"):
+        stock_individual_info_em_df = ak.stock_individual_info_em(symbol="600036")
+    print(stock_individual_info_em_df)
 
-# 股票代码获取
-stocks = ak.stock_info_sh_name_code()
-print(stocks.head())
+    # 历史数据查询
+    # adjust：‘’ 不复权，‘qfq’ 前复权（保持现在价格不变，调整历史股价），‘hfq’ 后复权（保持历史价格不变，调整现价，一般用于量化策略研究）
+    # period='daily'; choice of {'daily', 'weekly', 'monthly'}
+    with phase("stock_zh_a_hist"):
+        stock_zh_a_hist_df = ak.stock_zh_a_hist(symbol="600036", period="daily", start_date="20170101", end_date='20241122', adjust="qfq")
+    print(stock_zh_a_hist_df)
 
+    # 股票代码获取
+    with phase("stock_info_sh_name_code"):
+        stocks = ak.stock_info_sh_name_code()
+    print(stocks.head())
+recorder.write(profile)
+if recorder:
+    print(summarize([profile.record()]))
@@ -0,0 +1,104 @@
+import math
+
+import numpy as np
+
+# 只依赖 NumPy：快速引擎和只读缓存的 cli.py run 不需要导入 backtrader，Backtrader 分析器见 analyzer.Metrics
+TRADING_DAYS = 252
+
+
+def compute_metrics(equity, start_cash, dates=None, riskfreerate=0.01):
+    """
+    按 Backtrader 的 Returns / DrawDown / SharpeRatio 分析器的默认口径计算指标，另外计算 Sortino 和 Calmar
+    """
+    n = equity.size
+    value = float(equity[-1]) if n else start_cash
+    # Returns: 按 K 线数量折算成 252 个交易日的年化收益
+    ratio = value / start_cash
+    rtot = math.log(ratio) if ratio > 0 else float("-inf")
+    ravg = rtot / n if n else 0.0
+    rnorm = math.expm1(ravg * TRADING_DAYS) if ravg > float("-inf") else ravg
+    # DrawDown: 相对历史最高总资金的最大回撤百分比
+    if n:
+        peak = np.maximum.accumulate(equity)
+        max_drawdown = float(np.max(100.0 * (peak - equity) / peak))
+    else:
+        max_drawdown = 0.0
+    return {
+        "value": value,
+        "pnl": value - start_cash,
+        "sharpe": sharpe_ratio(equity, start_cash, dates, riskfreerate) if dates is not None else None,
+        "max_drawdown": max_drawdown,
+        "rnorm100": rnorm * 100.0,
+        "sortino": sortino_ratio(equity, start_cash, riskfreerate),
+        "calmar": rnorm * 100.0 / max_drawdown if max_drawdown > 0 else None,
+    }
+
+
+def sharpe_ratio(equity, start_cash, dates, riskfreerate=0.01):
+    """按自然年收益率计算的夏普比率（与 bt.analyzers.SharpeRatio 默认参数一致）"""
+    years = np.asarray(dates, dtype="datetime64[Y]")
+    if not years.size:
+        return None
+    # 每年最后一根 K 线的总资金
+    last = np.flatnonzero(np.append(years[1:] != years[:-1], True))
+    year_end = equity[last]
+    prev = np.concatenate(([start_cash], year_end[:-1]))
+    returns = [float(r) for r in year_end / prev - 1.0]
+    rate = pow(1.0 + riskfreerate, 1.0 / 1) - 1.0
+    ret_free = [r - rate for r in returns]
+    avg = math.fsum(ret_free) / len(ret_free)
+    dev = math.sqrt(math.fsum([pow(r - avg, 2.0) for r in ret_free]) / len(ret_free))
+    try:
+        return avg / dev
+    except ZeroDivisionError:
+        return None
+
+
+def sortino_ratio(equity, start_cash, riskfreerate=0.01):
+    """按逐根 K 线收益率计算、折算到 252 个交易日的 Sortino 比率，没有下行波动时为 None"""
+    if equity.size < 2:
+        return None
+    returns = equity / np.concatenate(([start_cash], equity[:-1])) - 1.0
+    excess = returns - (pow(1.0 + riskfreerate, 1.0 / TRADING_DAYS) - 1.0)
+    downside = math.sqrt(float(np.mean(np.minimum(excess, 0.0) ** 2)))
+    if downside == 0.0:
+        return None
+    return float(np.mean(excess)) / downside * math.sqrt(TRADING_DAYS)
+
+
+def summarize(equity, start_cash, cash, dates=None, total_trades=0, won_trades=0, exposed_bars=0, riskfreerate=0.01):
+    """
+    由资金曲线和交易统计生成一条扁平的结果记录，tail_buy_filter / buy_with_limit / sweep 和 fast_engine 共用
+
+    total_trades 与 bt.analyzers.TradeAnalyzer 的 total.total 一致，包含期末仍未平仓的交易；
+    won_trades 为扣除手续费后盈亏 >= 0 的已平仓交易；exposure 为持仓 K 线占比（百分比）。
+    """
+    record = compute_metrics(equity, start_cash, dates=dates, riskfreerate=riskfreerate)
+    record.update({
+        "cash": float(cash),
+        "total_trades": total_trades,
+        "won_trades": won_trades,
+        "win_rate": won_trades / total_trades * 100 if total_trades > 0 else None,
+        "exposure": exposed_bars / equity.size * 100 if equity.size else 0.0,
+    })
+    return record
+
+
+def print_report(record, start_cash, start_date, end_date):
+    """打印单只股票的回测结果，record 含 symbol 时在首行标出"""
+    prefix = f"[{record['symbol']}] " if "symbol" in record else ""
+    print(f"{prefix}回测期间: {start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')}")
+    print(f"初始资金: {start_cash}")
+    print(f"总资金: {record['value']:.2f}, 含现金 {record['cash']:.2f}")
+    print(f"净收益: {record['pnl']:.2f}")
+    print(f"夏普比率: {record['sharpe']:.4f}" if record['sharpe'] is not None else "夏普比率: 无法计算 (None)")
+    print(f"最大回撤: {record['max_drawdown']:.2f}%")
+    print(f"总交易数: {record['total_trades']}")
+    if record['win_rate'] is not None:
+        print(f"胜率: {record['win_rate']:.2f}%")
+    else:
+        print("胜率: 无法计算 (None)")
+    print(f"年化收益率: {record['rnorm100']:.2f}%")
+    print(f"Sortino 比率: {record['sortino']:.4f}" if record.get('sortino') is not None else "Sortino 比率: 无法计算 (None)")
+    print(f"Calmar 比率: {record['calmar']:.4f}" if record.get('calmar') is not None else "Calmar 比率: 无法计算 (None)")
+    print(f"持仓时间占比: {record['exposure']:.2f}%")
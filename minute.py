@@ -0,0 +1,322 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from cache import COLUMNS, factor_multiplier
+from feeds import ArrayData, date2num
+from analyzer import Metrics
+from metrics import print_report
+from strategy import TailBuy
+from utils import factor_fetcher, get_cache
+
+LINES = ["open", "high", "low", "close", "volume"]
+START_CASH = 100000
+
+
+def normalize_minutes(raw_df):
+    """把 ak.stock_zh_a_hist_min_em 返回的分钟线整理成以时间为索引的 open/high/low/close/volume"""
+    if raw_df is None or raw_df.empty:
+        return pd.DataFrame(columns=LINES, index=pd.DatetimeIndex([], name="datetime"))
+    df = pd.DataFrame({
+        "open": pd.to_numeric(raw_df["开盘"]).to_numpy(np.float64),
+        "high": pd.to_numeric(raw_df["最高"]).to_numpy(np.float64),
+        "low": pd.to_numeric(raw_df["最低"]).to_numpy(np.float64),
+        "close": pd.to_numeric(raw_df["收盘"]).to_numpy(np.float64),
+        "volume": pd.to_numeric(raw_df["成交量"]).to_numpy(np.float64),
+    }, index=pd.DatetimeIndex(pd.to_datetime(raw_df["时间"]), name="datetime"))
+    return df.sort_index()
+
+
+class MinuteStore:
+    """
+    按月分块存储的分钟线：{root}/{symbol}/{YYYYMM}.npz，每块内按时间排序存放各列
+
+    chunks 按时间顺序逐月读取，任何时刻只有一个月的数据在内存中，读取全部历史的内存占用与历史长度无关。
+    价格为不复权价格（即实际成交价），需要复权时读取时按 BarCache 的后复权因子表计算。
+    """
+
+    def __init__(self, root="minute_store"):
+        self.root = root
+
+    def _dir(self, symbol):
+        return os.path.join(self.root, symbol)
+
+    def months(self, symbol):
+        """已存储的月份（YYYYMM），按时间升序"""
+        folder = self._dir(symbol)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-4] for name in os.listdir(folder) if name.endswith(".npz"))
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if self.months(name))
+
+    def _read(self, symbol, month):
+        with np.load(os.path.join(self._dir(symbol), f"{month}.npz")) as f:
+            return {name: f[name] for name in f.files}
+
+    def write(self, symbol, df):
+        """把 normalize_minutes 格式的分钟线按月合并写入，重叠的时间以新数据为准"""
+        if df.empty:
+            return 0
+        os.makedirs(self._dir(symbol), exist_ok=True)
+        stamps = df.index.values.astype("datetime64[m]")
+        months = stamps.astype("datetime64[M]")
+        for month in np.unique(months):
+            mask = months == month
+            key = str(month).replace("-", "")
+            new = {"datetime": stamps[mask], **{name: df[name].to_numpy(np.float64)[mask] for name in LINES}}
+            if key in self.months(symbol):
+                old = self._read(symbol, key)
+                # 新数据在后，按时间去重时保留新数据
+                merged = {name: np.concatenate([old[name], new[name]]) for name in new}
+                order = np.argsort(merged["datetime"], kind="stable")
+                dt = merged["datetime"][order]
+                keep = np.append(dt[1:] != dt[:-1], True)
+                new = {name: values[order][keep] for name, values in merged.items()}
+            path = os.path.join(self._dir(symbol), f"{key}.npz")
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, **new)
+            os.replace(path + ".tmp", path)
+        return int(len(df))
+
+    def chunks(self, symbol, start=None, end=None, factors=None, adjust=""):
+        """
+        按时间顺序逐月产出 {datetime, open, high, low, close, volume} 数组，只包含 [start, end] 内的分钟
+
+        factors 为后复权因子表（BarCache.factors 的返回值）时价格按 adjust（qfq / hfq）复权。
+        """
+        lo = np.datetime64(pd.Timestamp(start), "m") if start is not None else None
+        hi = np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1), "m") if end is not None else None
+        for month in self.months(symbol):
+            first = np.datetime64(f"{month[:4]}-{month[4:]}", "M")
+            if lo is not None and first + 1 <= lo.astype("datetime64[M]"):
+                continue
+            if hi is not None and first > hi.astype("datetime64[M]"):
+                break
+            chunk = self._read(symbol, month)
+            mask = np.ones(chunk["datetime"].size, dtype=bool)
+            if lo is not None:
+                mask &= chunk["datetime"] >= lo
+            if hi is not None:
+                mask &= chunk["datetime"] < hi
+            if not mask.any():
+                continue
+            chunk = {name: values[mask] for name, values in chunk.items()}
+            if factors is not None and adjust and not factors.empty:
+                k = factor_multiplier(factors, chunk["datetime"], adjust)
+                for name in ("open", "high", "low", "close"):
+                    chunk[name] = chunk[name] * k
+            yield chunk
+
+    def info(self):
+        """每只股票的月份数、分钟数和占用字节数"""
+        records = []
+        for symbol in self.symbols():
+            months = self.months(symbol)
+            paths = [os.path.join(self._dir(symbol), f"{m}.npz") for m in months]
+            rows = 0
+            for month in months:
+                rows += self._read(symbol, month)["datetime"].size
+            records.append({"symbol": symbol, "start": months[0], "end": months[-1], "months": len(months),
+                            "rows": rows, "bytes": sum(os.path.getsize(p) for p in paths)})
+        return pd.DataFrame(records, columns=["symbol", "start", "end", "months", "rows", "bytes"])
+
+
+def fetch_minutes(store, symbol, start_date, end_date, fetcher=None):
+    """
+    下载 [start_date, end_date]（YYYYMMDD）的 1 分钟线并写入 store，返回写入的行数
+
+    fetcher 默认为 ak.stock_zh_a_hist_min_em（东方财富只提供最近一段时间的 1 分钟线，需要定期运行积累历史），
+    也可以是带 minutes 方法的 cache.FakeFetcher。
+    """
+    lo = datetime.strptime(start_date, "%Y%m%d").strftime("%Y-%m-%d 09:30:00")
+    hi = datetime.strptime(end_date, "%Y%m%d").strftime("%Y-%m-%d 15:00:00")
+    if fetcher is None:
+        import akshare as ak
+
+        raw_df = ak.stock_zh_a_hist_min_em(symbol=symbol, start_date=lo, end_date=hi, period="1", adjust="")
+    else:
+        raw_df = fetcher.minutes(symbol, start_date=lo, end_date=hi, period="1")
+    return store.write(symbol, normalize_minutes(raw_df))
+
+
+def load_factors(symbol, adjust, end_date, fetcher=None):
+    """从本地缓存读取后复权因子表，早于 end_date 时重新下载；不复权或无法获取因子时返回 None"""
+    cache = get_cache()
+    fetch = factor_fetcher(fetcher)
+    if not adjust or cache is None or fetch is None:
+        return None
+    return cache.factors(symbol, fetch, min(end_date, datetime.today() - timedelta(days=1)))
+
+
+def resample_daily(store, symbol, start=None, end=None, factors=None, adjust=""):
+    """
+    把分钟线逐块聚合成 preprocess 格式的日线：开盘取当天第一根、收盘取最后一根、最高最低取极值、成交量求和
+
+    块按月划分，一天不会跨块，每块用 reduceat 向量化聚合，内存只与输出的天数有关。
+    """
+    pieces = []
+    for chunk in store.chunks(symbol, start, end, factors=factors, adjust=adjust):
+        day = chunk["datetime"].astype("datetime64[D]")
+        starts = np.flatnonzero(np.concatenate(([True], day[1:] != day[:-1])))
+        ends = np.append(starts[1:], day.size) - 1
+        pieces.append(pd.DataFrame({
+            "open": chunk["open"][starts],
+            "close": chunk["close"][ends],
+            "high": np.maximum.reduceat(chunk["high"], starts),
+            "low": np.minimum.reduceat(chunk["low"], starts),
+            "volume": np.add.reduceat(chunk["volume"], starts),
+        }, index=pd.DatetimeIndex(day[starts].astype("datetime64[ns]"), name="date")))
+    if not pieces:
+        return pd.DataFrame(columns=COLUMNS)
+    df = pd.concat(pieces)
+    df.insert(0, "date", df.index.date)
+    return df[COLUMNS]
+
+
+class MinuteData(bt.feed.DataBase):
+    """
+    从 MinuteStore 逐月流式读取分钟线的数据源
+
+    不预加载：每次 _load 从当前块取一根，块读完后再读下一个月，配合 Cerebro(preload=False, exactbars=1)
+    内存占用不随历史长度增长。也可以交给 cerebro.resampledata 得到日线。
+    """
+
+    params = (
+        ("store", None),
+        ("symbol", None),
+        ("factors", None),
+        ("adjust", ""),
+        ("timeframe", bt.TimeFrame.Minutes),
+        ("compression", 1),
+    )
+
+    def start(self):
+        super().start()
+        self._chunks = self.p.store.chunks(self.p.symbol, self.p.fromdate, self.p.todate, factors=self.p.factors,
+                                           adjust=self.p.adjust)
+        self._dt, self._values, self._row = [], {}, 0
+
+    def _load(self):
+        if self._row >= len(self._dt):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            # 逐根读取时从列表取值比 NumPy 标量快
+            self._dt = date2num(chunk["datetime"]).tolist()
+            self._values = {name: chunk[name].tolist() for name in LINES}
+            self._row = 0
+        i = self._row
+        self._row += 1
+        self.lines.datetime[0] = self._dt[i]
+        for name, values in self._values.items():
+            getattr(self.lines, name)[0] = values[i]
+        return True
+
+
+class MinuteTailBuy(TailBuy):
+    """
+    在分钟线上运行的 TailBuy：按当天到收盘前 tail_minutes 分钟为止的开盘价、最高价、最低价和当时的价格
+    做一次 TailBuy 的判断，订单在下一分钟按实际价格成交，而不是假设以日线收盘价成交
+    """
+
+    params = (
+        ("tail_minutes", 5),
+        ("close_time", "15:00"),
+    )
+
+    def __init__(self):
+        super().__init__()
+        close = datetime.strptime(self.p.close_time, "%H:%M")
+        self._tail = (close - timedelta(minutes=self.p.tail_minutes)).time()
+        self._day = None
+
+    def next(self):
+        dt = self.data.datetime.datetime(0)
+        if dt.date() != self._day:
+            self._day = dt.date()
+            self._open, self._high, self._low = self.data.open[0], self.data.high[0], self.data.low[0]
+            self._decided = False
+        else:
+            self._high = max(self._high, self.data.high[0])
+            self._low = min(self._low, self.data.low[0])
+        if not self._decided and dt.time() >= self._tail:
+            self._decided = True
+            self.decide(self._open, self._high, self._low, self.data.close[0])
+
+
+def run_minute(store, symbol, mode="tail", fromdate=None, todate=None, cash=START_CASH, commission=0.002,
+               adjust="qfq", factors=None, printlog=False, **params):
+    """
+    用分钟线回测 TailBuy，返回 Metrics 的结果记录
+
+    mode 为 tail 时在分钟线上运行 MinuteTailBuy（流式加载，exactbars 模式），为 daily 时先把分钟线聚合成日线再运行 TailBuy。
+    """
+    if mode == "daily":
+        stock_df = resample_daily(store, symbol, fromdate, todate, factors=factors, adjust=adjust)
+        cerebro = bt.Cerebro()
+        cerebro.addstrategy(TailBuy, printlog=printlog, **params)
+        cerebro.addanalyzer(Metrics, _name="metrics")
+        cerebro.adddata(ArrayData(dataname=stock_df, fromdate=fromdate, todate=todate), name=symbol)
+    else:
+        if todate is not None:
+            todate = datetime.combine(todate.date(), datetime.max.time())  # 包含结束日当天的全部分钟
+        # 不预加载、lines 只保留必要的长度，内存与分钟数无关
+        cerebro = bt.Cerebro(preload=False, runonce=False, exactbars=1)
+        cerebro.addstrategy(MinuteTailBuy, printlog=printlog, **params)
+        cerebro.addanalyzer(Metrics, _name="metrics", daily=True)
+        cerebro.adddata(MinuteData(store=store, symbol=symbol, factors=factors, adjust=adjust,
+                                   fromdate=fromdate, todate=todate), name=symbol)
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    return cerebro.run()[0].analyzers.metrics.get_analysis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分钟线数据和尾盘回测")
+    parser.add_argument("command", choices=["fetch", "run", "info"])
+    parser.add_argument("--store", default="minute_store", help="minute bar store directory")
+    parser.add_argument("--symbols", default="600036", type=str, help="comma separated stock codes")
+    parser.add_argument("--start_date", default="20240101", help="start date")
+    parser.add_argument("--end_date", default="today", type=str, help="end date")
+    parser.add_argument("--mode", default="tail", choices=["tail", "daily"], help="decide N minutes before the close on minute bars, or resample to daily bars")
+    parser.add_argument("--tail_minutes", default=5, type=int, help="minutes before the close at which the tail mode decides")
+    parser.add_argument("--adjust", default="qfq", choices=["", "qfq", "hfq"], help="price adjustment applied at read time")
+    parser.add_argument("--fake", action="store_true", help="fetch from the offline random-walk source instead of akshare")
+    parser.add_argument("--printlog", action="store_true", help="print orders and trades")
+    args = parser.parse_args()
+
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    end_date = datetime.today() if args.end_date == "today" else datetime.strptime(args.end_date, date_format)
+    store = MinuteStore(args.store)
+    fetcher = None
+    if args.fake:
+        from cache import FakeFetcher
+
+        fetcher = FakeFetcher()
+    symbols = args.symbols.split(",")
+
+    if args.command == "fetch":
+        for symbol in symbols:
+            rows = fetch_minutes(store, symbol, start_date.strftime(date_format), end_date.strftime(date_format), fetcher=fetcher)
+            print(f"{symbol}: 写入 {rows} 根分钟线")
+    elif args.command == "info":
+        print(store.info().to_string(index=False))
+    else:
+        for symbol in symbols:
+            t0 = time.perf_counter()
+            factors = load_factors(symbol, args.adjust, end_date, fetcher)
+            params = {"tail_minutes": args.tail_minutes} if args.mode == "tail" else {}
+            record = run_minute(store, symbol, args.mode, start_date, end_date, adjust=args.adjust, factors=factors,
+                                printlog=args.printlog, **params)
+            print_report({"symbol": symbol, **record}, START_CASH, start_date, end_date)
+            print(f"耗时 {time.perf_counter() - t0:.2f} s")
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+# 每列一个 .npy 文件，按 symbol 顺序首尾相接
+COLUMN_DTYPES = {
+    "date": np.int64,  # 距 1970-01-01 的天数
+    "open": np.float32,
+    "high": np.float32,
+    "low": np.float32,
+    "close": np.float32,
+    "volume": np.int64,
+}
+
+
+def build_panel(path, frames, adjust="", start_date=None, end_date=None, price_dtype=np.float32):
+    """
+    把 {symbol: preprocess 返回的 DataFrame} 打包成连续数组并写入 path 目录
+
+    先写到临时目录再整体替换，读取方不会看到写了一半的数据。
+    """
+    symbols = [s for s, df in frames.items() if df is not None and not df.empty]
+    lengths = [len(frames[s]) for s in symbols]
+    offsets = np.zeros(len(symbols) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    total = int(offsets[-1])
+
+    tmp = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    dtypes = dict(COLUMN_DTYPES, **{c: price_dtype for c in PRICE_COLUMNS})
+    for column, dtype in dtypes.items():
+        out = np.lib.format.open_memmap(os.path.join(tmp, f"{column}.npy"), mode="w+", dtype=dtype, shape=(total,))
+        for symbol, lo, hi in zip(symbols, offsets[:-1], offsets[1:]):
+            df = frames[symbol]
+            if column == "date":
+                out[lo:hi] = df.index.values.astype("datetime64[D]").astype(np.int64)
+            else:
+                out[lo:hi] = df[column].to_numpy()
+        out.flush()
+        del out
+    meta = {
+        "symbols": symbols,
+        "offsets": offsets.tolist(),
+        "adjust": adjust,
+        "start_date": start_date,
+        "end_date": end_date,
+        "price_dtype": np.dtype(price_dtype).name,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    if os.path.exists(path):
+        old = path.rstrip("/") + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp, path)
+    return Panel(path)
+
+
+class Panel:
+    """
+    只读打开的行情面板，各列通过 mmap 映射，多个进程打开同一面板时共享操作系统的页缓存
+
+    arrays / frame 返回的都是映射数组上的视图，不复制数据。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.symbols = self.meta["symbols"]
+        self.offsets = np.asarray(self.meta["offsets"], dtype=np.int64)
+        self._index = {s: i for i, s in enumerate(self.symbols)}
+        self.columns = {
+            column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+            for column in COLUMN_DTYPES
+        }
+
+    def __contains__(self, symbol):
+        return symbol in self._index
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _slice(self, symbol):
+        i = self._index[symbol]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def arrays(self, symbol):
+        """返回单只股票各列的零拷贝视图，date 为 datetime64[D]"""
+        sl = self._slice(symbol)
+        views = {column: values[sl] for column, values in self.columns.items()}
+        views["date"] = views["date"].view("datetime64[D]")
+        return views
+
+    def engine_arrays(self, symbol, fromdate=None, todate=None):
+        """按 fast_engine.simulate_tailbuy 的参数名返回指定区间的数组"""
+        views = self.arrays(symbol)
+        dates = views["date"]
+        lo = 0 if fromdate is None else int(np.searchsorted(dates, np.datetime64(fromdate, "D"), side="left"))
+        hi = dates.size if todate is None else int(np.searchsorted(dates, np.datetime64(todate, "D"), side="right"))
+        return {
+            "open_": views["open"][lo:hi],
+            "high": views["high"][lo:hi],
+            "low": views["low"][lo:hi],
+            "close": views["close"][lo:hi],
+            "dates": dates[lo:hi],
+        }
+
+    def frame(self, symbol):
+        """
+        返回可直接传给 bt.feeds.PandasData 的 DataFrame
+
+        列数据直接引用映射数组；PandasData 在 preload 时会把数据读入自己的 lines，所以这里不需要额外复制。
+        """
+        views = self.arrays(symbol)
+        index = pd.DatetimeIndex(views["date"].astype("datetime64[ns]"), name="date")
+        return pd.DataFrame({column: views[column] for column in ["open", "high", "low", "close", "volume"]},
+                            index=index, copy=False)
+
+    def feed(self, symbol, **kwargs):
+        """构建 feeds.ArrayData，preload 时直接从映射数组整段写入 lines"""
+        from feeds import ArrayData
+        return ArrayData(dataname=self.arrays(symbol), **kwargs)
+
+    def memory_report(self, frames=None):
+        """
+        统计各列映射的字节数；frames 为构建面板用的 {symbol: DataFrame} 时，
+        同时用 DataFrame.memory_usage(deep=True) 实测这些 DataFrame 的占用（每个进程一份）用于对比
+        """
+        rows = int(self.offsets[-1])
+        columns = {column: int(values.nbytes) for column, values in self.columns.items()}
+        report = {
+            "symbols": len(self.symbols),
+            "rows": rows,
+            "columns": columns,
+            "panel_bytes": sum(columns.values()),
+        }
+        if frames is not None:
+            report["pandas_bytes"] = int(sum(frames[s].memory_usage(deep=True).sum() for s in self.symbols if s in frames))
+        return report
+
+
+class PanelFrames:
+    """
+    按股票代码返回面板上的 DataFrame 视图（Panel.frame），供 sweep / walkforward 的工作进程代替 {symbol: DataFrame}
+
+    价格列直接引用映射数组，只有日期索引在每个进程中复制；最近用过的 maxsize 只股票的 DataFrame 保留复用。
+    """
+
+    def __init__(self, path, maxsize=8):
+        self.panel = Panel(path)
+        self.maxsize = maxsize
+        self._frames = OrderedDict()
+
+    def __getitem__(self, symbol):
+        if symbol in self._frames:
+            self._frames.move_to_end(symbol)
+        else:
+            self._frames[symbol] = self.panel.frame(symbol)
+            if len(self._frames) > self.maxsize:
+                self._frames.popitem(last=False)
+        return self._frames[symbol]
+
+    def __contains__(self, symbol):
+        return symbol in self.panel
+
+    def __iter__(self):
+        return iter(self.panel.symbols)
+
+    def __len__(self):
+        return len(self.panel)
+
+
+@contextmanager
+def shared_frames(frames, workers):
+    """
+    返回交给工作进程的行情数据：frames 为 Panel 时返回其路径；为 {symbol: DataFrame} 且 workers > 1 时
+    写入临时面板（价格为 float64，与 DataFrame 逐位相同）并返回路径，退出时删除；否则原样返回
+
+    工作进程按路径打开面板（PanelFrames），各进程 mmap 同一份文件，不再各自反序列化一份 DataFrame。
+    """
+    if isinstance(frames, Panel):
+        yield frames.path
+    elif workers <= 1:
+        yield frames
+    else:
+        root = tempfile.mkdtemp(prefix="panel-")
+        try:
+            yield build_panel(os.path.join(root, "panel"), frames, price_dtype=np.float64).path
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def open_frames(source):
+    """工作进程的初始化：source 为面板路径时打开 PanelFrames，否则为 {symbol: DataFrame} 原样返回"""
+    return PanelFrames(source) if isinstance(source, str) else source
+
+
+def _load_frames(symbols, adjust, start_date, end_date):
+    from fetcher import bulk_fetch
+
+    frames, report = bulk_fetch(symbols, adjust, start_date, end_date)
+    print(report)
+    return frames
+
+
+def _print_report(panel, frames=None):
+    report = panel.memory_report(frames)
+    print(f"面板 {panel.path}: {report['symbols']} 只股票, {report['rows']} 行, "
+          f"{panel.meta['adjust'] or 'raw'} {panel.meta['start_date']} ~ {panel.meta['end_date']}, 构建于 {panel.meta['built_at']}")
+    for column, nbytes in report["columns"].items():
+        print(f"  {column:<6} {nbytes / 2**20:8.2f} MiB")
+    text = f"面板合计 {report['panel_bytes'] / 2**20:.2f} MiB（所有进程共享）"
+    if "pandas_bytes" in report:
+        text += f", preprocess 的 DataFrame 实测 {report['pandas_bytes'] / 2**20:.2f} MiB（每个进程一份）"
+    print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="构建/刷新/查看内存映射行情面板")
+    parser.add_argument("command", choices=["build", "refresh", "info"])
+    parser.add_argument("--path", default="data_panel", help="panel directory")
+    parser.add_argument("--symbols", default=None, type=str, help="comma separated stock codes, default the first --limit SSE stocks")
+    parser.add_argument("--limit", default=1000, type=int, help="number of SSE stocks when --symbols is omitted")
+    parser.add_argument("--adjust", default="qfq", choices=["", "qfq", "hfq"])
+    parser.add_argument("--start_date", default="20140101", help="start date")
+    parser.add_argument("--end_date", default="today", type=str, help="end date")
+    args = parser.parse_args()
+
+    end_date = datetime.today().strftime("%Y%m%d") if args.end_date == "today" else args.end_date
+    if args.command == "info":
+        _print_report(Panel(args.path))
+    else:
+        if args.command == "refresh":
+            # 按原面板的标的和区间重新构建，日线从本地缓存增量补齐
+            meta = Panel(args.path).meta
+            symbols, adjust, start_date = meta["symbols"], meta["adjust"], meta["start_date"]
+        else:
+            if args.symbols:
+                symbols = args.symbols.split(",")
+            else:
+                import akshare as ak
+                symbols = list(ak.stock_info_sh_name_code()["证券代码"][:args.limit])
+            adjust, start_date = args.adjust, args.start_date
+        frames = _load_frames(symbols, adjust, start_date, end_date)
+        panel = build_panel(args.path, frames, adjust=adjust, start_date=start_date, end_date=end_date)
+        _print_report(panel, frames)
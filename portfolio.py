@@ -0,0 +1,337 @@
+import argparse
+from collections import deque
+from datetime import datetime, timedelta
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from feeds import ArrayData
+from analyzer import Metrics
+from metrics import print_report
+
+START_CASH = 1000000
+
+
+class PortfolioStrategy(bt.Strategy):
+    """
+    多只股票共用一个账户的组合回测基类
+
+    start 时从 preload 好的 lines 中读出各股票的日期和价格，对齐到所有股票日期的并集上，
+    一次性算出“空仓股票的开仓信号”矩阵；next 中只处理当天有信号的股票和已经持仓/有挂单的股票，
+    其余股票没有任何逐根 K 线的 Python 开销。当天停牌（没有 K 线）的股票不产生信号，也不做持仓管理。
+
+    仓位规则：max_positions 限制同时持仓（含待成交的开仓单）的股票数；percent 不为空时每笔按总资金的
+    percent 折算成整手数下单，否则每笔 size 股；max_weight 限制单只股票市值占总资金的上限。
+    同一天信号多于可用仓位时按股票加入的顺序（例如预筛排名）优先。
+    """
+    params = (
+        ("printlog", False),
+        ("size", 100),
+        ("percent", None),
+        ("max_positions", None),
+        ("max_weight", None),
+        ("journal", None),  # journal.Journal，设置后订单、成交和平仓事件写入交易日志
+    )
+
+    def __init__(self):
+        self._active = set()  # 持仓或有挂单的股票序号
+        self.trades = {d._name: {"trades": 0, "won": 0, "pnl": 0.0} for d in self.datas}
+
+    def start(self):
+        if not all(len(d.lines.datetime.array) == d.buflen() for d in self.datas):
+            raise ValueError("组合回测需要 preload 模式的数据")
+        self._index = {d: j for j, d in enumerate(self.datas)}  # 下单和通知时按数据源查序号，代替 O(N) 的 datas.index
+        dates = [np.frombuffer(d.lines.datetime.array, dtype=np.float64) for d in self.datas]
+        calendar = np.unique(np.concatenate(dates)) if dates else np.empty(0)
+        self._row = {v: i for i, v in enumerate(calendar.tolist())}
+        self._signal = np.zeros((calendar.size, len(self.datas)), dtype=bool)
+        for j, d in enumerate(self.datas):
+            lines = {name: np.frombuffer(getattr(d.lines, name).array, dtype=np.float64) for name in ("open", "high", "low", "close")}
+            self._signal[np.searchsorted(calendar, dates[j]), j] = self.open_signal(**lines)
+
+    def open_signal(self, open, high, low, close):
+        """返回空仓时触发开仓的布尔数组，由子类实现"""
+        raise NotImplementedError
+
+    def prenext(self):
+        # 上市日期不同的股票在全部开始交易之前也要正常运行
+        self.next()
+
+    def next(self):
+        t = self._row[self.datetime[0]]
+        for j in tuple(self._active):
+            d = self.datas[j]
+            if d.datetime[0] == self.datetime[0]:
+                self.manage(j, d)
+        candidates = np.flatnonzero(self._signal[t])
+        for j in candidates.tolist():
+            if j in self._active:
+                continue
+            if self.p.max_positions is not None and len(self._active) >= self.p.max_positions:
+                break
+            self.enter(j, self.datas[j])
+
+    def enter(self, j, d):
+        """空仓股票出现开仓信号时调用，由子类实现"""
+        raise NotImplementedError
+
+    def manage(self, j, d):
+        """持仓或有挂单的股票在有 K 线的日子调用，由子类实现"""
+        raise NotImplementedError
+
+    def order_size(self, d, price):
+        """按仓位规则计算下单股数，0 表示不下单"""
+        size = self.p.size
+        if self.p.percent is not None:
+            size = int(self.broker.getvalue() * self.p.percent / (price * 100)) * 100
+        if self.p.max_weight is not None:
+            held = self.getposition(d).size * price
+            room = self.broker.getvalue() * self.p.max_weight - held
+            size = min(size, int(room / (price * 100)) * 100)
+        return max(size, 0)
+
+    def buy(self, data=None, **kwargs):
+        self._active.add(self._index[data])
+        return super().buy(data=data, **kwargs)
+
+    def sell(self, data=None, **kwargs):
+        self._active.add(self._index[data])
+        return super().sell(data=data, **kwargs)
+
+    def _journal(self, order):
+        if self.p.journal and order.status not in [order.Submitted, order.Accepted]:
+            self.p.journal.order(order)
+
+    def _release(self, d, pending=False):
+        # 没有持仓也没有挂单的股票不再逐日检查
+        if not pending and not self.getposition(d).size:
+            self._active.discard(self._index[d])
+
+    def notify_trade(self, trade):
+        if not trade.isclosed:
+            return
+        if self.p.journal:
+            self.p.journal.trade(trade)
+        stats = self.trades[trade.data._name]
+        stats["trades"] += 1
+        stats["won"] += trade.pnlcomm >= 0.0
+        stats["pnl"] += trade.pnlcomm
+        self.log(f"{trade.data._name} 盈利 {trade.pnlcomm:.2f}, 现金 {self.broker.cash:.2f}")
+
+    def log(self, txt, dt=None):
+        """日志记录函数"""
+        if self.params.printlog:
+            dt = dt or self.datetime.date(0)
+            print(f"{dt.isoformat()} {txt}")
+
+    def symbol_table(self):
+        """每只股票一行的已平仓交易统计和期末持仓"""
+        rows = []
+        for d in self.datas:
+            stats = self.trades[d._name]
+            position = self.getposition(d)
+            rows.append({
+                "symbol": d._name,
+                **stats,
+                "win_rate": stats["won"] / stats["trades"] * 100 if stats["trades"] else None,
+                "position": position.size,
+                "position_value": position.size * d.close[0] if len(d) else 0.0,
+            })
+        return pd.DataFrame(rows)
+
+
+class PortfolioTailBuy(PortfolioStrategy):
+    """strategy.TailBuy 的组合版本，单只股票且不设仓位限制时结果与 TailBuy 相同"""
+
+    def open_signal(self, open, high, low, close):
+        return low <= open * 0.97
+
+    def enter(self, j, d):
+        # 与 TailBuy 一样开仓时不检查现金，资金不足时由 broker 拒绝
+        size = self.order_size(d, d.close[0])
+        if size:
+            self.buy(data=d, size=size)
+
+    def manage(self, j, d):
+        position = self.getposition(d)
+        if not position:
+            return  # 开仓单尚未成交（例如停牌）
+        # 现金检查按实际要下单的股数计算；仓位已到上限（size 为 0）时继续检查止盈止损
+        size = self.order_size(d, d.close[0])
+        buy_condition = size and d.low[0] <= position.price * 0.95 and self.broker.cash >= d.close[0] * size
+        if buy_condition:
+            self.buy(data=d, size=size)
+            return
+        stop_profit_condition = d.high[0] >= position.price * 1.05
+        stop_loss_condition = d.close[0] < position.price * 0.8
+        if stop_profit_condition or stop_loss_condition:
+            self.sell(data=d, size=position.size)
+
+    def notify_order(self, order):
+        self._journal(order)
+        if order.status in [order.Submitted, order.Accepted]:
+            return
+        if order.status in [order.Completed]:
+            side = "买单" if order.isbuy() else "卖单"
+            self.log(f"{order.data._name} {side}执行 @ {order.executed.price:.2f}, 持股数量 {self.getposition(order.data).size}")
+        self._release(order.data)
+
+
+class PortfolioLimitBuy(PortfolioStrategy):
+    """
+    buy_with_limit.LimitBuy 的组合版本，每只股票各自记录挂单和网格价格
+
+    网格减仓卖出对应那一笔买入的股数（按 percent 下单时每笔股数不同）；
+    网格记录为空时跳过网格加仓判断（LimitBuy 在这种情况下会抛出 IndexError）。
+    """
+    params = (
+        ("open_ratio", 0.03),
+        ("grid_ratio", 0.05),
+        ("stop_profit_ratio", 0.05),
+        ("valid_days", 1),
+    )
+
+    def __init__(self):
+        super().__init__()
+        self.state = [{"order": None, "last_buy_price": deque(maxlen=10), "last_position_price": deque(maxlen=10),
+                       "last_buy_size": deque(maxlen=10)}
+                      for _ in self.datas]
+
+    def open_signal(self, open, high, low, close):
+        return low <= open * (1 - self.p.open_ratio)
+
+    def _valid(self, d):
+        return d.datetime.datetime(0) + timedelta(days=self.p.valid_days)
+
+    def enter(self, j, d):
+        open_price = d.open[0] * (1 - self.p.open_ratio)
+        size = self.order_size(d, open_price)
+        if size:
+            self.state[j]["order"] = self.buy(data=d, exectype=bt.Order.Limit, price=open_price, size=size, valid=self._valid(d))
+
+    def manage(self, j, d):
+        state = self.state[j]
+        position = self.getposition(d)
+        if state["order"] or position.size <= 0:
+            return
+        last_buy = state["last_buy_price"]
+        target_profit_price = position.price * (1 + self.p.stop_profit_ratio)
+        if d.high[0] >= target_profit_price:
+            state["order"] = self.sell(data=d, exectype=bt.Order.Limit, price=target_profit_price, size=position.size, valid=self._valid(d))
+            return
+        if last_buy and d.high[0] >= last_buy[-1] * (1 + self.p.grid_ratio):
+            sell_price = last_buy[-1] * (1 + self.p.grid_ratio)
+            state["order"] = self.sell(data=d, exectype=bt.Order.Limit, price=sell_price, size=min(state["last_buy_size"][-1], position.size), valid=self._valid(d))
+            return
+        if last_buy and d.low[0] <= last_buy[-1] * (1 - self.p.grid_ratio):
+            target_add_price = last_buy[-1] * (1 - self.p.grid_ratio)
+            size = self.order_size(d, target_add_price)
+            if size and self.broker.cash >= target_add_price * size:
+                state["order"] = self.buy(data=d, exectype=bt.Order.Limit, price=target_add_price, size=size, valid=self._valid(d))
+
+    def notify_order(self, order):
+        self._journal(order)
+        if order.status in [order.Submitted, order.Accepted]:
+            return
+        d = order.data
+        state = self.state[self._index[d]]
+        position = self.getposition(d)
+        if order.status in [order.Completed]:
+            if order.isbuy():
+                state["last_buy_price"].append(order.executed.price)
+                state["last_position_price"].append(position.price)
+                state["last_buy_size"].append(order.executed.size)
+            else:
+                if state["last_buy_size"] and order.executed.size == -state["last_buy_size"][-1]:
+                    # 清除相应的网格记录
+                    if state["last_buy_price"]:
+                        state["last_buy_price"].pop()
+                    if state["last_position_price"]:
+                        state["last_position_price"].pop()
+                    state["last_buy_size"].pop()
+                else:
+                    state["last_buy_price"].clear()
+                    state["last_position_price"].clear()
+                    state["last_buy_size"].clear()
+                position.price = state["last_position_price"][-1] if state["last_position_price"] else 0
+            self.log(f"{d._name} {'买单' if order.isbuy() else '卖单'}执行 @ {order.executed.price:.2f}, 持股数量 {position.size}")
+        state["order"] = None
+        self._release(d)
+
+
+STRATEGIES = {
+    "tailbuy": (PortfolioTailBuy, "qfq"),
+    "limitbuy": (PortfolioLimitBuy, "hfq"),
+}
+
+
+def run_portfolio(frames, name="tailbuy", fromdate=None, todate=None, cash=START_CASH, commission=0.002, **params):
+    """
+    把 {symbol: DataFrame} 全部放进一个 Cerebro 共用资金回测，返回 (组合指标记录, 每只股票的交易统计表)
+    """
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(STRATEGIES[name][0], **params)
+    cerebro.addanalyzer(Metrics, _name="metrics")
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    for symbol, df in frames.items():
+        index = df.index
+        # 区间内没有 K 线的股票不加入，避免空数据源
+        if not ((fromdate is None or index[-1] >= fromdate) and (todate is None or index[0] <= todate)):
+            continue
+        cerebro.adddata(ArrayData(dataname=df, fromdate=fromdate, todate=todate), name=symbol)
+    strat = cerebro.run()[0]
+    return strat.analyzers.metrics.get_analysis(), strat.symbol_table()
+
+
+def index_symbols(index_code):
+    """中证指数成分股，例如 000510（中证 A500）、000300（沪深 300）"""
+    import akshare as ak
+    return list(ak.index_stock_cons_csindex(symbol=index_code)["成分券代码"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多只股票共用资金的组合回测")
+    parser.add_argument("--strategy", default="tailbuy", choices=sorted(STRATEGIES))
+    parser.add_argument("--symbols", default=None, type=str, help="comma separated stock codes")
+    parser.add_argument("--index", default="000510", type=str, help="CSI index whose constituents are used when --symbols is omitted")
+    parser.add_argument("--start_date", default="20140101", help="start date of back test")
+    parser.add_argument("--end_date", default="20240101", type=str, help="choose end date of back test")
+    parser.add_argument("--cash", default=START_CASH, type=float, help="shared starting cash")
+    parser.add_argument("--prescreen_top", default=0, type=int, help="only trade the top N symbols of the vectorized pre-screen, 0 to disable")
+    parser.add_argument("--max_positions", default=None, type=int, help="max number of symbols held at the same time")
+    parser.add_argument("--percent", default=None, type=float, help="size each order as this fraction of portfolio value instead of --size shares")
+    parser.add_argument("--size", default=100, type=int, help="shares per order")
+    parser.add_argument("--max_weight", default=None, type=float, help="max position value per symbol as a fraction of portfolio value")
+    parser.add_argument("--fetch_workers", default=8, type=int, help="number of download threads")
+    parser.add_argument("--rate", default=5.0, type=float, help="max download requests per second")
+    parser.add_argument("--printlog", action="store_true", help="print order and trade logs")
+    parser.add_argument("--output", default="portfolio_symbols.csv", help="per-symbol trade statistics")
+    args = parser.parse_args()
+
+    from fetcher import bulk_fetch
+
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    end_date = datetime.today() if args.end_date == "today" else datetime.strptime(args.end_date, date_format)
+    symbols = args.symbols.split(",") if args.symbols else index_symbols(args.index)
+    adjust = STRATEGIES[args.strategy][1]
+    frames, report = bulk_fetch(symbols, adjust, start_date.strftime(date_format), end_date.strftime(date_format),
+                                workers=args.fetch_workers, rate=args.rate)
+    print(report)
+    if args.prescreen_top:
+        from prescreen import prescreen
+        # 按预筛排名排列，同一天信号多于可用仓位时排名靠前的优先
+        table = prescreen(frames, top=args.prescreen_top).table
+        selected = table[table["selected"]].sort_values("hit_rate", ascending=False, kind="stable").index
+        frames = {symbol: frames[symbol] for symbol in selected}
+    if not frames:
+        exit()
+
+    record, table = run_portfolio(frames, args.strategy, start_date, end_date, cash=args.cash, printlog=args.printlog,
+                                  size=args.size, percent=args.percent, max_positions=args.max_positions, max_weight=args.max_weight)
+    print(f"组合: {len(frames)} 只股票, 共用资金")
+    print_report(record, args.cash, start_date, end_date)
+    table.sort_values("pnl", ascending=False).to_csv(args.output, index=False)
+    print(f"各股票交易统计已写入 {args.output}")
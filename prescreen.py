@@ -0,0 +1,121 @@
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+def history_length(df):
+    """K 线数量"""
+    return len(df)
+
+
+def trigger_rate(df, drop=0.03):
+    """TailBuy 开仓条件（最低价 <= 开盘价 * 0.97）触发的频率"""
+    open_, low = df["open"].to_numpy(np.float64), df["low"].to_numpy(np.float64)
+    return float(np.mean(low <= open_ * (1 - drop))) if len(df) else 0.0
+
+
+def turnover(df, window=250):
+    """最近 window 根 K 线的日均成交额（成交量以手计，1 手 = 100 股）"""
+    tail = df.iloc[-window:]
+    return float(np.mean(tail["volume"].to_numpy(np.float64) * 100 * tail["close"].to_numpy(np.float64))) if len(tail) else 0.0
+
+
+def round_trip_hit_rate(df, drop=0.03, target=0.05, stop=0.2, horizon=20):
+    """
+    粗略的单笔往返胜率：触发开仓后以次日开盘价买入，horizon 根 K 线内先达到 +target 记为成功
+
+    不考虑加仓和资金约束，只用于排序。
+    """
+    open_ = df["open"].to_numpy(np.float64)
+    high = df["high"].to_numpy(np.float64)
+    low = df["low"].to_numpy(np.float64)
+    close = df["close"].to_numpy(np.float64)
+    n = len(df)
+    if n <= horizon + 1:
+        return 0.0
+    entries = np.flatnonzero(low[:n - horizon - 1] <= open_[:n - horizon - 1] * (1 - drop)) + 1
+    if not entries.size:
+        return 0.0
+    price = open_[entries][:, None]
+    # 每笔从买入当天起 horizon 根 K 线的窗口
+    window = np.lib.stride_tricks.sliding_window_view(np.arange(n), horizon)[entries]
+    win = high[window] >= price * (1 + target)
+    lose = close[window] < price * (1 - stop)
+    first_win = np.where(win.any(axis=1), win.argmax(axis=1), horizon)
+    first_lose = np.where(lose.any(axis=1), lose.argmax(axis=1), horizon)
+    return float(np.mean(first_win < first_lose))
+
+
+@dataclass
+class Screen:
+    """
+    一项预筛指标：func(df) 返回一个数值，低于 min_value 或高于 max_value 的股票被淘汰
+    """
+    name: str
+    func: callable
+    min_value: float = None
+    max_value: float = None
+
+    def accepts(self, value):
+        if self.min_value is not None and value < self.min_value:
+            return False
+        if self.max_value is not None and value > self.max_value:
+            return False
+        return True
+
+
+# tail_buy_filter 默认使用的预筛流程，history 沿用原来 360 * 3 根 K 线的长度要求
+DEFAULT_SCREENS = [
+    Screen("history", history_length, min_value=360 * 3 + 1),
+    Screen("trigger_rate", trigger_rate, min_value=0.01),
+    Screen("turnover", turnover, min_value=1e7),
+    Screen("hit_rate", round_trip_hit_rate),
+]
+
+
+@dataclass
+class PrescreenReport:
+    table: pd.DataFrame  # 每只股票一行：各项指标、是否通过、是否入选
+    elapsed: float
+
+    @property
+    def selected(self):
+        return list(self.table.index[self.table["selected"]])
+
+    def summary(self, backtest_seconds=None):
+        """backtest_seconds 为单只股票完整回测的平均耗时，用于估算节省的时间"""
+        total = len(self.table)
+        kept = int(self.table["selected"].sum())
+        text = f"预筛 {total} 只股票, 淘汰 {total - kept} 只, 保留 {kept} 只, 预筛耗时 {self.elapsed:.2f}s"
+        if backtest_seconds is not None:
+            saved = (total - kept) * backtest_seconds - self.elapsed
+            text += f", 按完整回测平均 {backtest_seconds:.2f}s/只估计节省 {saved:.1f}s"
+        return text
+
+
+def prescreen(frames, screens=DEFAULT_SCREENS, rank_by="hit_rate", top=None):
+    """
+    对 {symbol: DataFrame} 逐项计算预筛指标，淘汰不满足阈值的股票，再按 rank_by 降序保留前 top 只
+    """
+    t0 = time.perf_counter()
+    rows = {}
+    for symbol, df in frames.items():
+        row = {}
+        passed = True
+        for screen in screens:
+            # 前面的指标已经淘汰时不再计算后面的指标
+            if not passed:
+                row[screen.name] = np.nan
+                continue
+            row[screen.name] = value = screen.func(df)
+            passed = screen.accepts(value)
+        row["passed"] = passed
+        rows[symbol] = row
+    table = pd.DataFrame.from_dict(rows, orient="index", columns=[s.name for s in screens] + ["passed"])
+    table["selected"] = table["passed"].astype(bool)
+    if top is not None and rank_by in table:
+        ranked = table[table["passed"]].sort_values(rank_by, ascending=False, kind="stable")
+        table["selected"] = table.index.isin(ranked.index[:top])
+    return PrescreenReport(table=table, elapsed=time.perf_counter() - t0)
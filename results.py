@@ -0,0 +1,169 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    params TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    data_hash TEXT NOT NULL,
+    created REAL NOT NULL,
+    record TEXT
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (strategy, start_date, end_date);
+"""
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _date(value):
+    """日期统一保存为 YYYYMMDD 字符串"""
+    return value.strftime("%Y%m%d") if hasattr(value, "strftime") else str(value)
+
+
+def data_hash(df):
+    """行情数据的内容哈希：日期索引和 open/high/low/close/volume 的字节，数据有任何变化（包括复权价调整）哈希都会变"""
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(df.index.values.astype("datetime64[ns]").view(np.int64)).tobytes())
+    for name in ("open", "high", "low", "close", "volume"):
+        if name in df:
+            h.update(name.encode())
+            h.update(np.ascontiguousarray(df[name].to_numpy(np.float64)).tobytes())
+    return h.hexdigest()[:32]
+
+
+def strategy_name(strategy):
+    """策略类转换为 模块.类名，字符串原样返回"""
+    if isinstance(strategy, str):
+        return strategy
+    return f"{strategy.__module__}.{strategy.__qualname__}"
+
+
+def result_key(symbol, strategy, params, start_date, end_date, data_hash):
+    """由股票、策略、参数、回测区间和数据哈希得到的内容寻址键，任何一项不同都会得到不同的键"""
+    payload = json.dumps([symbol, strategy_name(strategy), params or {}, _date(start_date), _date(end_date), data_hash],
+                         sort_keys=True, default=_json_default)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    按内容寻址键保存回测结果记录的 SQLite 数据库
+
+    每条结果写入后立即提交，扫描中途中断时已完成的结果不会丢失；再次运行时用 get_many 查出已有的键，
+    只回测缺失的部分。record 为 None 表示数据不足等无需回测的情况，同样会被记住。
+    排名查询直接在库上执行，不需要重新回测。
+    """
+
+    def __init__(self, path="scan_results.sqlite"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, keys):
+        """返回 {key: record} ，只包含库中已有的键"""
+        keys = list(keys)
+        found = {}
+        # SQLite 单条语句的参数个数有限制，分批查询
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, record FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            found.update((key, json.loads(record) if record is not None else None) for key, record in rows)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def put(self, key, symbol, strategy, params, start_date, end_date, data_hash, record):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, symbol, strategy_name(strategy), json.dumps(params or {}, sort_keys=True, default=_json_default),
+             _date(start_date), _date(end_date), data_hash, time.time(),
+             json.dumps(record, default=_json_default) if record is not None else None),
+        )
+        self.conn.commit()
+
+    def frame(self, strategy=None, start_date=None, end_date=None, params=None, latest=True):
+        """
+        按条件取出结果，每条结果一行（记录中的指标展开为列）
+
+        latest 为 True 时每只股票只保留最近写入的一条，数据更新后旧哈希的结果不参与排名。
+        """
+        sql, args = "SELECT symbol, strategy, params, start_date, end_date, data_hash, created, record FROM results WHERE record IS NOT NULL", []
+        for column, value in (("strategy", strategy), ("start_date", start_date), ("end_date", end_date)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                args.append(strategy_name(value) if column == "strategy" else _date(value))
+        if params is not None:
+            sql += " AND params = ?"
+            args.append(json.dumps(params, sort_keys=True, default=_json_default))
+        rows = self.conn.execute(sql + " ORDER BY created", args).fetchall()
+        df = pd.DataFrame(
+            [{"symbol": symbol, "strategy": strategy, "params": params, "start_date": start, "end_date": end,
+              "data_hash": digest, "created": created, **{k: v for k, v in json.loads(record).items() if k != "symbol"}}
+             for symbol, strategy, params, start, end, digest, created, record in rows],
+            columns=None if rows else ["symbol", "strategy", "params", "start_date", "end_date", "data_hash", "created"])
+        if latest and not df.empty:
+            df = df.drop_duplicates(["symbol", "strategy", "params", "start_date", "end_date"], keep="last")
+        return df.reset_index(drop=True)
+
+    def top(self, n=10, by="rnorm100", ascending=False, **filters):
+        """按某个指标排名的前 n 条结果"""
+        df = self.frame(**filters)
+        if df.empty or by not in df:
+            return df
+        return df.dropna(subset=[by]).sort_values(by, ascending=ascending, kind="stable").head(n).reset_index(drop=True)
+
+    def runs(self):
+        """库中各组（策略、参数、回测区间）的结果条数"""
+        return pd.read_sql_query(
+            "SELECT strategy, params, start_date, end_date, COUNT(*) AS results, COUNT(record) AS backtested, "
+            "MAX(created) AS updated FROM results GROUP BY strategy, params, start_date, end_date ORDER BY updated",
+            self.conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询批量扫描结果库中的排名，不重新回测")
+    parser.add_argument("--db", default="scan_results.sqlite", help="result store path")
+    parser.add_argument("--strategy", default=None, help="strategy name stored with the results, e.g. strategy.TailBuy")
+    parser.add_argument("--start_date", default=None, help="only results of this back test start date, e.g. 20140101")
+    parser.add_argument("--end_date", default=None, help="only results of this back test end date")
+    parser.add_argument("--sort", default="rnorm100", help="metric to rank by, e.g. rnorm100, sharpe, calmar, win_rate")
+    parser.add_argument("--ascending", action="store_true", help="rank from the lowest value, e.g. for max_drawdown")
+    parser.add_argument("--top", default=10, type=int, help="number of rows to show")
+    parser.add_argument("--runs", action="store_true", help="list the stored runs instead of ranking")
+    args = parser.parse_args()
+
+    with ResultStore(args.db) as store:
+        if args.runs:
+            print(store.runs().to_string(index=False))
+        else:
+            table = store.top(args.top, by=args.sort, ascending=args.ascending, strategy=args.strategy,
+                              start_date=args.start_date, end_date=args.end_date)
+            columns = [c for c in ["symbol", "strategy", "start_date", "end_date", args.sort, "rnorm100", "sharpe", "max_drawdown", "win_rate", "total_trades"] if c in table]
+            print(table[list(dict.fromkeys(columns))].to_string(index=False) if not table.empty else "没有符合条件的结果")
@@ -0,0 +1,430 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from cli import DATE_FORMAT, START_CASH, STRATEGIES, backtest, load
+
+HISTORY_START = "20050101"
+
+
+# 工作进程内常驻的日线：(symbol, adjust) -> (主进程的读取时间, DataFrame)，主进程只在工作进程没有这份数据时才发送
+_RESIDENT = OrderedDict()
+_CAPACITY = 2000
+
+
+def _warm(capacity=None):
+    """工作进程启动时导入回测需要的重量级模块和全部策略，第一个任务不再付导入开销"""
+    global _CAPACITY
+    import backtrader  # noqa: F401
+    import fast_engine  # noqa: F401
+
+    if capacity is not None:
+        _CAPACITY = capacity
+    for target, _, fast in STRATEGIES.values():
+        load(target)
+        if fast:
+            load(fast)
+
+
+def _run_job(job, stock_df=None):
+    """
+    在工作进程中执行一个回测任务，返回 (结果记录, 开始时间, 运行耗时)
+
+    stock_df 为 None 时使用本进程常驻的数据；没有常驻或已被主进程重新读取（读取时间不同）时返回 None，
+    由主进程带上数据重新提交。
+    """
+    started = time.time()
+    key = (job["symbol"], job["adjust"])
+    entry = _RESIDENT.get(key)
+    if entry is None or entry[0] != job["loaded"]:
+        if stock_df is None:
+            return None
+        entry = _RESIDENT[key] = (job["loaded"], stock_df)
+        while len(_RESIDENT) > _CAPACITY:
+            _RESIDENT.popitem(last=False)
+    _RESIDENT.move_to_end(key)
+    t0 = time.perf_counter()
+    record = backtest(job["strategy"], entry[1], job["fromdate"], job["todate"], engine=job["engine"],
+                      cash=job["cash"], commission=job["commission"], symbol=job["symbol"], **job["params"])
+    return record, started, time.perf_counter() - t0
+
+
+class FrameCache:
+    """
+    常驻内存的日线：按 (symbol, adjust) 缓存 history_start 至今的全部数据，回测区间在运行时截取
+
+    最多保留 capacity 只股票（最近最少使用的先淘汰），超过 ttl 秒的数据在下次使用时重新读取，以便拿到新的 K 线。
+    同一只股票并发请求时只读取一次。
+    """
+
+    def __init__(self, capacity=2000, ttl=3600.0, history_start=HISTORY_START, fetcher=None):
+        self.capacity = capacity
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.history_start = history_start
+        self._frames = OrderedDict()  # (symbol, adjust) -> (读取时间, DataFrame)
+        self._lock = threading.Lock()
+        self._loading = {}  # (symbol, adjust) -> 正在读取的线程持有的锁
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol, adjust):
+        """返回 (读取时间, DataFrame)，没有数据时 DataFrame 为 None；读取时间用来判断工作进程中的常驻数据是否过期"""
+        from utils import preprocess
+
+        key = (symbol, adjust)
+        while True:
+            with self._lock:
+                entry = self._frames.get(key)
+                if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                    self._frames.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Lock()
+                    loading.acquire()
+                    break
+            # 其他线程正在读取，等它完成后再查一次
+            with loading:
+                pass
+        try:
+            stock_df = preprocess(symbol=symbol, adjust=adjust, start_date=self.history_start,
+                                  end_date=datetime.today().strftime(DATE_FORMAT), fetcher=self.fetcher)
+            entry = (time.monotonic(), stock_df)
+            with self._lock:
+                self.misses += 1
+                if stock_df is not None:
+                    self._frames[key] = entry
+                    while len(self._frames) > self.capacity:
+                        self._frames.popitem(last=False)
+            return entry
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.release()
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class Stats:
+    """排队深度和最近 window 个任务的分阶段耗时（毫秒）"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=window)  # (total, data, queue, run)
+
+    def submit(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, ok, total=None, data=None, queue=None, run=None):
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.completed += 1
+                self.latencies.append((total, data, queue, run))
+            else:
+                self.failed += 1
+
+    def snapshot(self, workers):
+        with self._lock:
+            latencies = np.array(self.latencies, dtype=np.float64).reshape(-1, 4)
+            record = {
+                "uptime": time.time() - self.started,
+                "workers": workers,
+                "in_flight": self.in_flight,
+                # 超出工作进程数的部分在进程池的队列中等待
+                "queue_depth": max(0, self.in_flight - workers),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+        for i, name in enumerate(["total_ms", "data_ms", "queue_ms", "run_ms"]):
+            column = latencies[:, i]
+            record[name] = {
+                "mean": float(column.mean()) if column.size else None,
+                **{f"p{q}": float(np.percentile(column, q)) if column.size else None for q in (50, 90, 99)},
+                "max": float(column.max()) if column.size else None,
+            }
+        return record
+
+
+def _param(name, value, default):
+    """把请求中的策略参数转换为默认值的类型（int / float / bool），无法转换时抛出 ValueError"""
+    kind = type(default)
+    if kind is bool:
+        if not isinstance(value, bool):
+            raise ValueError(f"参数 {name} 必须是 true / false，收到 {value!r}")
+        return value
+    if kind in (int, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f"参数 {name} 必须是数字，收到 {value!r}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"参数 {name} 必须是数字，收到 {value!r}") from None
+        if kind is int:
+            if not number.is_integer():
+                raise ValueError(f"参数 {name} 必须是整数，收到 {value!r}")
+            return int(number)
+        return number
+    return value
+
+
+def _date(payload, field, default):
+    """解析 YYYYMMDD 日期字段，end_date 还可以是 today"""
+    value = payload.get(field, default)
+    if value == "today":
+        return datetime.today()
+    if not isinstance(value, str):
+        raise ValueError(f"{field} 必须是 YYYYMMDD 字符串，收到 {value!r}")
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise ValueError(f"{field} 必须是 YYYYMMDD 字符串，收到 {value!r}") from None
+
+
+def _number(payload, field, default):
+    value = payload.get(field, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{field} 必须是数字，收到 {value!r}")
+    return float(value)
+
+
+class BacktestService:
+    """解析任务、取常驻数据并提交到进程池；HTTP 处理线程调用 submit 并等待结果"""
+
+    def __init__(self, workers=1, frames=None):
+        self.workers = workers
+        self.frames = FrameCache() if frames is None else frames
+        self.stats = Stats()
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_warm, initargs=(self.frames.capacity,))
+
+    def parse(self, payload):
+        """把请求 JSON 转换为任务，参数名、取值或类型不合法时都抛出 ValueError"""
+        if not isinstance(payload, dict):
+            raise ValueError("请求必须是 JSON 对象")
+        name = payload.get("strategy", "tailbuy")
+        if not isinstance(name, str) or name not in STRATEGIES:
+            raise ValueError(f"未知策略 {name}，可选 {sorted(STRATEGIES)}")
+        if "symbol" not in payload:
+            raise ValueError("缺少 symbol")
+        target, default_adjust, fast = STRATEGIES[name]
+        # 有快速引擎的策略默认用它，结果与 Cerebro 逐位相同
+        engine = payload.get("engine", "fast" if fast else "bt")
+        if engine not in ("bt", "fast") or (engine == "fast" and fast is None):
+            raise ValueError(f"{name} 不支持 engine={engine}")
+        params = payload.get("params") or {}
+        if not isinstance(params, dict):
+            raise ValueError("params 必须是对象")
+        # printlog / journal 只对命令行有意义，快速引擎也不接受
+        defaults = {k: v for k, v in load(target).params._getitems() if k not in ("printlog", "journal")}
+        unknown = sorted(set(params) - set(defaults))
+        if unknown:
+            raise ValueError(f"{name} 没有参数 {unknown}，可选 {sorted(defaults)}")
+        params = {k: _param(k, v, defaults[k]) for k, v in params.items()}
+        adjust = payload.get("adjust", default_adjust)
+        if adjust not in ("", "qfq", "hfq"):
+            raise ValueError(f"adjust 必须是 ''、qfq 或 hfq，收到 {adjust!r}")
+        return {
+            "strategy": name,
+            "symbol": str(payload["symbol"]),
+            "adjust": adjust,
+            "fromdate": _date(payload, "start_date", "20140101"),
+            "todate": _date(payload, "end_date", "today"),
+            "engine": engine,
+            "cash": _number(payload, "cash", START_CASH),
+            "commission": _number(payload, "commission", 0.002),
+            "params": params,
+        }
+
+    def submit(self, job):
+        """运行任务并返回响应记录，数据不存在时抛出 LookupError"""
+        t0 = time.perf_counter()
+        self.stats.submit()
+        ok, timings = False, {}
+        try:
+            loaded, stock_df = self.frames.get(job["symbol"], job["adjust"])
+            if stock_df is None:
+                raise LookupError(f"没有 {job['symbol']} 的数据")
+            job["loaded"] = loaded
+            t1 = time.perf_counter()
+            submitted = time.time()
+            result = self.pool.submit(_run_job, job).result()
+            if result is None:
+                # 接到任务的工作进程还没有这只股票（或已过期），这一次把数据一起发送过去
+                submitted = time.time()
+                result = self.pool.submit(_run_job, job, stock_df).result()
+            record, started, run = result
+            total = time.perf_counter() - t0
+            timings = {"total": total * 1000, "data": (t1 - t0) * 1000,
+                       "queue": max(0.0, started - submitted) * 1000, "run": run * 1000}
+            ok = True
+        finally:
+            self.stats.finish(ok, **timings)
+        return {"symbol": job["symbol"], "strategy": job["strategy"], "engine": job["engine"],
+                "metrics": record, "latency_ms": timings}
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    POST /backtest  {"strategy", "symbol", "start_date", "end_date", "params", "engine", "adjust", "cash", "commission"}
+    GET  /stats     排队深度、完成数和分阶段耗时的分位数
+    GET  /health
+    """
+
+    service = None
+    quiet = True
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            record = self.service.stats.snapshot(self.service.workers)
+            record["cached_symbols"] = len(self.service.frames)
+            record["cache_hits"], record["cache_misses"] = self.service.frames.hits, self.service.frames.misses
+            self._reply(200, record)
+        elif self.path == "/health":
+            self._reply(200, {"ok": True})
+        else:
+            self._reply(404, {"error": f"未知路径 {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/backtest":
+            self._reply(404, {"error": f"未知路径 {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            job = self.service.parse(payload)
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        try:
+            self._reply(200, self.service.submit(job))
+        except LookupError as e:
+            self._reply(404, {"error": str(e)})
+        except Exception as e:
+            self._reply(500, {"error": repr(e)})
+
+    def address_string(self):
+        # Unix socket 没有客户端地址
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name, self.server_port = "localhost", 0
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def request(method, path, payload=None, address="127.0.0.1:8765", timeout=60):
+    """向服务发送请求并返回 (状态码, JSON)；address 为 host:port 或 Unix socket 路径"""
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    else:
+        conn = UnixHTTPConnection(address, timeout=timeout)
+    try:
+        body = json.dumps(payload).encode() if payload is not None else None
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def serve(address="127.0.0.1:8765", workers=1, preload=(), adjust=None, capacity=2000, ttl=3600.0, fetcher=None,
+          verbose=False):
+    """启动服务并阻塞；preload 中的股票在开始接受请求前读入内存"""
+    service = BacktestService(workers=workers, frames=FrameCache(capacity=capacity, ttl=ttl, fetcher=fetcher))
+    for symbol in preload:
+        for adj in ([adjust] if adjust is not None else sorted({a for _, a, _ in STRATEGIES.values()})):
+            service.frames.get(symbol, adj)
+    # 提交空任务让每个工作进程完成导入
+    for future in [service.pool.submit(_warm) for _ in range(workers)]:
+        future.result()
+    handler = type("BoundHandler", (Handler,), {"service": service, "quiet": not verbose})
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), handler)
+    else:
+        server = UnixHTTPServer(address, handler)
+    print(f"回测服务已启动: {address}, 工作进程 {workers}, 已缓存 {len(service.frames)} 组日线")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if ":" not in address and os.path.exists(address):
+            os.remove(address)
+
+
+def main(argv=None):
+    """命令行入口，cli.py 的 serve 子命令也调用它"""
+    parser = argparse.ArgumentParser(description="常驻内存的回测服务")
+    parser.add_argument("--address", default="127.0.0.1:8765", help="host:port for HTTP, or a path for a Unix socket")
+    parser.add_argument("--workers", default=0, type=int, help="number of worker processes, 0 for all cores")
+    parser.add_argument("--preload", default="", type=str, help="comma separated stock codes loaded before serving")
+    parser.add_argument("--adjust", default=None, choices=["", "qfq", "hfq"], help="adjustment to preload, defaults to every one the registered strategies use")
+    parser.add_argument("--capacity", default=2000, type=int, help="max symbols kept in memory")
+    parser.add_argument("--ttl", default=3600.0, type=float, help="seconds before a cached symbol is re-read to pick up new bars")
+    parser.add_argument("--fake", action="store_true", help="use the offline random-walk source instead of akshare")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+    fetcher = None
+    if args.fake:
+        from cache import FakeFetcher
+
+        fetcher = FakeFetcher()
+    serve(args.address, workers=args.workers or os.cpu_count(), preload=[s for s in args.preload.split(",") if s],
+          adjust=args.adjust, capacity=args.capacity, ttl=args.ttl, fetcher=fetcher, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ class TailBuy(bt.Strategy):
     """
     params = (
         ('printlog', False),
+        ('journal', None),  # journal.Journal，设置后订单、成交和平仓事件写入交易日志
     )
 
     def __init__(self):
@@ -14,17 +15,21 @@ class TailBuy(bt.Strategy):
         """
 
     def next(self):
+        self.decide(self.data.open[0], self.data.high[0], self.data.low[0], self.data.close[0])
+
+    def decide(self, open_, high, low, close):
+        """按当天的开盘价、最高价、最低价和当前价格决定是否下单，minute.MinuteTailBuy 在收盘前 N 分钟调用"""
         # 开仓条件和买入条件
-        open_condition = not self.position and self.data.low[0] <= self.data.open[0]*0.97
-        buy_condition = self.data.low[0] <= self.position.price * 0.95 and self.broker.cash >= self.data.close[0] * 100
+        open_condition = not self.position and low <= open_*0.97
+        buy_condition = low <= self.position.price * 0.95 and self.broker.cash >= close * 100
         if open_condition or buy_condition:
             # 尾盘买入：在当天收盘价买入一手
             self.buy(size=100)
         else:
             if self.position:
                 # 检查是否达到预期涨幅或止损点
-                stop_profit_condition = self.data.high[0] >= self.position.price * 1.05
-                stop_loss_condition = self.data.close[0] < self.position.price * 0.8
+                stop_profit_condition = high >= self.position.price * 1.05
+                stop_loss_condition = close < self.position.price * 0.8
                 if stop_profit_condition or stop_loss_condition:
                     self.sell(size=self.position.size)
 
@@ -33,6 +38,8 @@ class TailBuy(bt.Strategy):
             # 订单提交/接受状态，无需处理
             return
 
+        if self.params.journal:
+            self.params.journal.order(order)
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
@@ -48,6 +55,8 @@ class TailBuy(bt.Strategy):
     def notify_trade(self, trade):
         if not trade.isclosed:
             return
+        if self.params.journal:
+            self.params.journal.trade(trade)
         self.log(f'盈利 {trade.pnl:.2f}, 现金 {self.broker.cash:.2f}')
 
     # def notify_cashvalue(self, cash, value):
@@ -55,6 +64,8 @@ class TailBuy(bt.Strategy):
 
     def log(self, txt, dt=None):
         ''' 日志记录函数 '''
+        if self.params.journal:
+            self.params.journal.log(self.datas[0], txt)
         if self.params.printlog:
             dt = dt or self.datas[0].datetime.date(0)
             print(f'{dt.isoformat()} {txt}')
\ No newline at end of file
@@ -0,0 +1,212 @@
+import argparse
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import backtrader as bt
+import pandas as pd
+
+from utils import preprocess
+from feeds import ArrayData
+from buy_with_limit import LimitBuy
+from analyzer import Metrics
+from fast_engine import run_limitbuy
+from panel import Panel, open_frames, shared_frames
+
+START_CASH = 100000
+# 未指定 --param 时的默认搜索空间
+DEFAULT_SPACE = {
+    "open_ratio": [0.02, 0.03, 0.04, 0.05],
+    "grid_ratio": [0.03, 0.05, 0.08],
+    "stop_profit_ratio": [0.03, 0.05, 0.08, 0.1],
+    "valid_days": [1, 2, 3],
+}
+
+_frames = {}  # 工作进程内的行情数据（{symbol: DataFrame} 或 panel.PanelFrames），由 _init_worker 在进程启动时设置一次
+
+
+class DrawdownStop(bt.Analyzer):
+    """
+    回撤超过阈值时提前结束回测，用于在大网格中剪掉明显不合格的参数组合
+    """
+    params = (("max_drawdown", None),)  # 百分比，None 表示不剪枝
+
+    def start(self):
+        self.peak = float("-inf")
+        self.pruned = False
+
+    def next(self):
+        if self.p.max_drawdown is None:
+            return
+        value = self.strategy.broker.getvalue()
+        self.peak = max(self.peak, value)
+        if 100.0 * (self.peak - value) / self.peak > self.p.max_drawdown:
+            self.pruned = True
+            self.strategy.env.runstop()
+
+    def get_analysis(self):
+        return {"pruned": self.pruned}
+
+
+def parse_param(text):
+    """
+    解析 name=v1,v2,... 或 name=lo:hi[:step] 形式的参数空间
+
+    逗号分隔为候选值列表；lo:hi:step 在网格搜索中展开为等差序列，lo:hi 在随机搜索中表示均匀分布区间。
+    """
+    name, _, values = text.partition("=")
+
+    def num(v):
+        return int(v) if v.lstrip("-").isdigit() else float(v)
+
+    if ":" in values:
+        bounds = [num(v) for v in values.split(":")]
+        if len(bounds) == 3:
+            lo, hi, step = bounds
+            count = int(round((hi - lo) / step)) + 1
+            return name, [round(lo + i * step, 10) for i in range(count)]
+        return name, tuple(bounds)
+    return name, [num(v) for v in values.split(",")]
+
+
+def grid_search(space):
+    """网格搜索：枚举所有参数组合"""
+    names = list(space)
+    for name in names:
+        if isinstance(space[name], tuple):
+            raise ValueError(f"{name}: 区间 lo:hi 只能用于随机搜索，网格搜索请指定步长 lo:hi:step")
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(space, n, seed=None):
+    """随机搜索：列表随机取值，(lo, hi) 区间均匀采样（整数区间取整数）"""
+    rng = random.Random(seed)
+    for _ in range(n):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                lo, hi = values
+                params[name] = rng.randint(lo, hi) if isinstance(lo, int) and isinstance(hi, int) else rng.uniform(lo, hi)
+            else:
+                params[name] = rng.choice(values)
+        yield params
+
+
+def _init_worker(source):
+    # 多进程时传入面板路径，各进程 mmap 同一份文件；之后的任务只传递参数
+    global _frames
+    _frames = open_frames(source)
+
+
+def run_combo(task):
+    """在工作进程中回测一组参数，返回一行结果"""
+    symbol, params, fromdate, todate, max_drawdown, engine = task
+    row = {"symbol": symbol, **params}
+    if engine == "fast":
+        # 状态机与 Cerebro 的成交、资金曲线和剪枝结果逐位相同
+        try:
+            result = run_limitbuy(_frames[symbol], fromdate, todate, cash=START_CASH, max_drawdown=max_drawdown, **params)
+        except Exception as e:
+            row["error"] = repr(e)
+            return row
+        row.update(result.metrics)
+        row.setdefault("pruned", False)
+        return row
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(LimitBuy, **params)
+    cerebro.addanalyzer(Metrics, _name="metrics")
+    cerebro.addanalyzer(DrawdownStop, _name="guard", max_drawdown=max_drawdown)
+    cerebro.broker.setcash(START_CASH)
+    cerebro.broker.setcommission(commission=0.002)
+    cerebro.adddata(ArrayData(dataname=_frames[symbol], fromdate=fromdate, todate=todate))
+    try:
+        strat = cerebro.run()[0]
+    except Exception as e:
+        row["error"] = repr(e)
+        return row
+
+    row.update(strat.analyzers.metrics.get_analysis())
+    row["pruned"] = strat.analyzers.guard.get_analysis()["pruned"]
+    return row
+
+
+def sweep(frames, combos, fromdate=None, todate=None, workers=1, max_drawdown=None, sort_by="rnorm100", engine="bt"):
+    """
+    对每只股票的每组参数回测，返回按 sort_by 降序排列的结果表，被剪枝或出错的组合排在最后
+
+    frames 为 {symbol: preprocess 返回的 DataFrame} 或 panel.Panel；多进程时数据写入（或直接使用）内存映射面板，
+    工作进程按路径打开，所有进程共享同一份页缓存。
+    """
+    combos = list(combos)
+    symbols = frames.symbols if isinstance(frames, Panel) else list(frames)
+    tasks = [(symbol, params, fromdate, todate, max_drawdown, engine) for symbol in symbols for params in combos]
+    with shared_frames(frames, workers) as source:
+        if workers <= 1:
+            _init_worker(source)
+            rows = list(map(run_combo, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source,)) as pool:
+                rows = list(pool.map(run_combo, tasks, chunksize=max(1, len(tasks) // (workers * 8))))
+
+    table = pd.DataFrame(rows)
+    for column in ("pruned", "error"):
+        if column not in table:
+            table[column] = False if column == "pruned" else None
+    table["pruned"] = table["pruned"].fillna(False).astype(bool)
+    failed = table["pruned"] | table["error"].notna()
+    table = pd.concat([
+        table[~failed].sort_values(sort_by, ascending=False, na_position="last"),
+        table[failed],
+    ])
+    table.insert(0, "rank", range(1, len(table) + 1))
+    return table.reset_index(drop=True)
+
+
+def main(argv=None):
+    """命令行入口，argv 为 None 时读取 sys.argv，cli.py 的 sweep 子命令也调用它"""
+    parser = argparse.ArgumentParser(description="LimitBuy 参数扫描")
+    parser.add_argument("--symbols", default="600036", type=str, help="comma separated stock codes")
+    parser.add_argument("--start_date", default="20140101", help="start date of back test")
+    parser.add_argument("--end_date", default="today", type=str, help="choose end date of back test")
+    parser.add_argument("--param", action="append", default=[], help="search space, e.g. open_ratio=0.02,0.03 or grid_ratio=0.03:0.08:0.01")
+    parser.add_argument("--random", default=0, type=int, help="number of random samples, 0 for full grid search")
+    parser.add_argument("--seed", default=None, type=int, help="random seed")
+    parser.add_argument("--max_drawdown", default=None, type=float, help="prune combinations once drawdown exceeds this percentage")
+    parser.add_argument("--workers", default=0, type=int, help="number of worker processes, 0 for all cores")
+    parser.add_argument("--sort", default="rnorm100", help="column used for ranking")
+    parser.add_argument("--engine", default="bt", choices=["bt", "fast"], help="backtrader or the LimitBuy state-machine kernel (identical results)")
+    parser.add_argument("--panel", default=None, help="read bars from this panel.py directory (built with --adjust hfq) instead of the cache")
+    parser.add_argument("--output", default="sweep_results.csv", help="ranked results table")
+    args = parser.parse_args(argv)
+
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    end_date = datetime.today() if args.end_date == "today" else datetime.strptime(args.end_date, date_format)
+    space = dict(parse_param(p) for p in args.param) if args.param else DEFAULT_SPACE
+    combos = random_search(space, args.random, args.seed) if args.random else grid_search(space)
+
+    if args.panel:
+        frames = Panel(args.panel)
+        if frames.meta["adjust"] != "hfq":
+            parser.error(f"--panel {args.panel} 的复权方式为 {frames.meta['adjust'] or 'raw'}，LimitBuy 需要 hfq")
+    else:
+        frames = {}
+        for symbol in args.symbols.split(","):
+            stock_df = preprocess(symbol=symbol, adjust="hfq", start_date=start_date.strftime(date_format), end_date=end_date.strftime(date_format))
+            if stock_df is not None:
+                frames[symbol] = stock_df
+        if not frames:
+            return
+
+    table = sweep(frames, combos, start_date, end_date, workers=args.workers or os.cpu_count(),
+                  max_drawdown=args.max_drawdown, sort_by=args.sort, engine=args.engine)
+    table.to_csv(args.output, index=False)
+    print(f"共 {len(table)} 组回测, 剪枝 {int(table['pruned'].sum())} 组, 结果已写入 {args.output}")
+    print(table.head(10).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
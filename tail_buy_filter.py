@@ -1,84 +1,183 @@
 import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
 
-import akshare as ak
 import backtrader as bt
 
 from utils import preprocess
+from feeds import ArrayData
+from fetcher import bulk_fetch
+from prescreen import prescreen
 from strategy import TailBuy
+from fast_engine import run_tailbuy
+from analyzer import Metrics
+from metrics import print_report
+from results import ResultStore, data_hash, result_key
+from journal import close_journals, log_sink, open_journal, read_journal
+from instrument import Recorder, current, instrument_strategy, phase, profile_slowest, read_records, run_cerebro, summarize
 
+START_CASH = 100000
 
-if __name__ == '__main__':
+
+def backtest_symbol(symbol, start_date, end_date, printlog=False, engine='bt', recorder=None, journal=None):
+    """
+    对单只股票回测 TailBuy，返回精简的结果记录（可跨进程传递），数据不足时返回 None，读取数据失败时返回含 error 的记录
+
+    engine='fast' 时使用 fast_engine 的数组模拟器，结果与 Cerebro 一致，用于大范围初筛。
+    recorder 为 instrument.Recorder 时记录该股票各阶段的耗时。
+    journal 为交易日志目录时订单、成交和策略文本日志写入其中（每个进程一个文件），printlog 改为由日志的后台线程成批打印文本日志。
+    """
+    if recorder:
+        return recorder.run('backtest', symbol, backtest_symbol, symbol, start_date, end_date, printlog=printlog, engine=engine, journal=journal)
+    stock_df = preprocess(symbol=symbol, adjust="qfq", start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
+    if stock_df is None:
+        return {'symbol': symbol, 'error': '获取股票数据失败'}
+    if stock_df.date.size <= 360 * 3:
+        return None
+    if engine == 'fast':
+        with phase('fast_engine'):
+            result = run_tailbuy(stock_df, fromdate=start_date, todate=end_date, cash=START_CASH)
+        return {'symbol': symbol, **result.metrics}
+
+    if journal:
+        journal = open_journal(journal, sinks=[log_sink] if printlog else [])
+        printlog = False
+    cerebro = bt.Cerebro()  # 初始化回测系统
+    cerebro.addstrategy(instrument_strategy(TailBuy) if current() else TailBuy, printlog=printlog, journal=journal)  # 将交易策略加载到回测系统中
+    cerebro.addanalyzer(Metrics, _name='metrics')  # 添加分析器
+
+    cerebro.broker.setcash(START_CASH)  # 设置初始资本为 100000
+    cerebro.broker.setcommission(commission=0.002)  # 设置交易手续费为 0.2%
+
+    data = ArrayData(dataname=stock_df, fromdate=start_date, todate=end_date)  # 加载数据
+    cerebro.adddata(data, name=symbol)  # 将数据传入回测系统
+
+    results = run_cerebro(cerebro)  # 运行回测系统
+    if journal:
+        journal.flush()
+    return {'symbol': symbol, **results[0].analyzers.metrics.get_analysis()}
+
+
+def _backtest_or_error(symbol, **kwargs):
+    # 单只股票出错时返回含 error 的记录，不中断整个扫描
+    try:
+        return backtest_symbol(symbol, **kwargs)
+    except Exception as e:
+        return {'symbol': symbol, 'error': repr(e)}
+
+
+def scan(symbols, start_date, end_date, workers=1, printlog=False, engine='bt', recorder=None, journal=None):
+    """
+    逐只回测并按输入顺序产出结果记录，workers > 1 时使用进程池并行；出错的股票产出含 error 的记录
+    """
+    run = partial(_backtest_or_error, start_date=start_date, end_date=end_date, printlog=printlog, engine=engine, recorder=recorder, journal=journal)
+    if workers <= 1:
+        yield from map(run, symbols)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map 按提交顺序返回结果，保证排序与串行运行一致
+        yield from pool.map(run, symbols, chunksize=max(1, len(symbols) // (workers * 8)))
+
+
+def main(argv=None):
+    """命令行入口，argv 为 None 时读取 sys.argv，cli.py 的 scan 子命令也调用它"""
     parser = argparse.ArgumentParser()
     parser.add_argument('--symbol', default="600036", type=str, help='stock code')
     parser.add_argument('--start_date', default="20140101", help='start date of back test')
     parser.add_argument('--end_date', default='20240101', type=str, help='choose end date of back test')
-    args = parser.parse_args()
-    
+    parser.add_argument('--workers', default=1, type=int, help='number of worker processes, 0 for all cores')
+    parser.add_argument('--fetch_workers', default=8, type=int, help='number of download threads')
+    parser.add_argument('--rate', default=5.0, type=float, help='max download requests per second')
+    parser.add_argument('--prescreen_top', default=0, type=int, help='run the vectorized pre-screen and only backtest the top N candidates, 0 to disable')
+    parser.add_argument('--engine', default='bt', choices=['bt', 'fast'], help='backtrader or the vectorized fast engine')
+    parser.add_argument('--profile', default=None, type=str, help='write per-symbol, per-phase timings to this JSON lines file')
+    parser.add_argument('--profile_top', default=0, type=int, help='re-run the N slowest symbols under a profiler after the scan')
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'pyinstrument'], help='profiler used by --profile_top')
+    parser.add_argument('--trace_memory', action='store_true', help='record per-phase peak Python allocations with tracemalloc (slow)')
+    parser.add_argument('--store', default='scan_results.sqlite', type=str, help='SQLite result store used to skip finished symbols and resume interrupted scans, empty to disable')
+    parser.add_argument('--force', action='store_true', help='re-run every symbol even if the store already has its result')
+    parser.add_argument('--journal', default='', type=str, help='write the binary trade journal of this run to a new run-* subdirectory of this directory, e.g. trade_journal')
+    parser.add_argument('--printlog', action='store_true', help='print the strategy log (batched by the journal writer thread when --journal is set)')
+    args = parser.parse_args(argv)
+
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    if args.end_date == "today":
+        end_date = datetime.today()
+    else:
+        end_date = datetime.strptime(args.end_date, date_format)
+    workers = args.workers or os.cpu_count()
+    recorder = Recorder(args.profile, trace_memory=args.trace_memory)
+    recorder.truncate()
+
+    import akshare as ak
+
     stocks = ak.stock_info_sh_name_code()
-    ranks = dict()
-    for symbol in stocks['证券代码'][:1000]:
-        cerebro = bt.Cerebro()  # 初始化回测系统
-        cerebro.addstrategy(TailBuy, printlog=True)  # 将交易策略加载到回测系统中
-        # 添加分析器
-        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
-        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
-        cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='tradeanalyzer')
-        cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
-
-        start_cash = 100000
-        cerebro.broker.setcash(start_cash)  # 设置初始资本为 100000
-        cerebro.broker.setcommission(commission=0.002)  # 设置交易手续费为 0.2%
-
-        date_format = "%Y%m%d"
-        start_date = datetime.strptime(args.start_date, date_format)
-        if args.end_date == "today": 
-            end_date = datetime.today()
-        else:
-            end_date = datetime.strptime(args.end_date, date_format)
-        stock_df = preprocess(symbol=symbol, adjust="qfq", start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
-        if stock_df is None or stock_df.date.size <= 360 * 3:
+    symbols = list(stocks['证券代码'][:1000])
+    # 先并发把日线下载到本地缓存，回测时直接读缓存；下载失败的股票在报告中列出，而不是悄悄跳过
+    frames, report = bulk_fetch(symbols, "qfq", start_date.strftime(date_format), end_date.strftime(date_format),
+                                workers=args.fetch_workers, rate=args.rate, recorder=recorder)
+    print(report)
+    symbols = [symbol for symbol in symbols if symbol in frames]
+    screen_report = None
+    if args.prescreen_top:
+        # 在构建 Cerebro 之前用向量化指标淘汰明显不会交易或排不上名的股票
+        screen_report = prescreen(frames, top=args.prescreen_top)
+        selected = set(screen_report.selected)
+        symbols = [symbol for symbol in symbols if symbol in selected]
+    # 结果按 股票 + 策略 + 参数 + 回测区间 + 数据哈希 存库，参数和数据都没变的股票直接复用，中断后重跑只补齐剩下的
+    store = ResultStore(args.store) if args.store else None
+    params = {'engine': args.engine}
+    hashes = {symbol: data_hash(frames[symbol]) for symbol in symbols}
+    keys = {symbol: result_key(symbol, TailBuy, params, start_date, end_date, hashes[symbol]) for symbol in symbols}
+    del frames
+    stored = store.get_many(keys.values()) if store and not args.force else {}
+    todo = [symbol for symbol in symbols if keys[symbol] not in stored]
+    if stored:
+        print(f"结果库中已有 {len(symbols) - len(todo)} 只股票的结果，本次回测 {len(todo)} 只")
+    ranks = {record['symbol']: record['rnorm100'] for record in stored.values() if record is not None}
+    t0 = time.perf_counter()
+    # 每次运行写入单独的子目录，统计的成交数只包含本次运行；--printlog 时由日志的后台线程成批打印
+    journal = os.path.join(args.journal, f"run-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}") if args.journal else None
+    # scan 按输入顺序产出结果，与 todo 一一对应
+    for symbol, record in zip(todo, scan(todo, start_date, end_date, workers=workers, printlog=args.printlog, engine=args.engine, recorder=recorder, journal=journal)):
+        if record is not None and 'error' in record:
+            # 读取数据失败或回测出错不是最终结果，不写入结果库，下次运行重试
+            print(f"[{symbol}] 回测失败: {record['error']}")
+            continue
+        if store:
+            store.put(keys[symbol], symbol, TailBuy, params, start_date, end_date, hashes[symbol], record)
+        if record is None:
             continue
-        data = bt.feeds.PandasData(dataname=stock_df, fromdate=start_date, todate=end_date)  # 加载数据
-        cerebro.adddata(data)  # 将数据传入回测系统
-
-        results = cerebro.run()  # 运行回测系统
-        strategy_stats = results[0]
-
-        # 获取分析结果
-        port_value = cerebro.broker.getvalue()  # 获取回测结束后的总资金
-        cash = cerebro.broker.getcash()
-        pnl = port_value - start_cash  # 盈亏统计
-        sharpe = strategy_stats.analyzers.sharpe.get_analysis()
-        drawdown = strategy_stats.analyzers.drawdown.get_analysis()
-        trade_stats = strategy_stats.analyzers.tradeanalyzer.get_analysis()
-        returns = strategy_stats.analyzers.returns.get_analysis()
-
-        print(f"回测期间: {start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')}")
-        print(f"初始资金: {start_cash}")
-        print(f"总资金: {port_value:.2f}, 含现金 {cash:.2f}")
-        print(f"净收益: {pnl:.2f}")
-        print(f"夏普比率: {sharpe['sharperatio']:.4f}" if sharpe['sharperatio'] is not None else "夏普比率: 无法计算 (None)")
-        print(f"最大回撤: {drawdown.max.drawdown:.2f}%")
-        print(f"总交易数: {trade_stats.total.total}")
-        # 获取赢利交易总数，若不存在则为0
-        won_total = trade_stats.get('won', {}).get('total', 0)
-        # 获取总交易数，若不存在则为0
-        total_total = trade_stats.get('total', {}).get('total', 0)
-        if total_total > 0:
-            win_rate = (won_total / total_total) * 100
-            print(f"胜率: {win_rate:.2f}%")
-        else:
-            print("胜率: 无法计算 (None)")
-        print(f"年化收益率: {returns['rnorm100']:.2f}%")
-        
-        ranks[symbol] = returns['rnorm100']
+        print_report(record, START_CASH, start_date, end_date)
+        ranks[record['symbol']] = record['rnorm100']
         # plt.rcParams["axes.unicode_minus"] = False
         # cerebro.plot(style='candlestick')
         # plt.show()
-    
+
+    close_journals()
+    if journal and os.path.isdir(journal):
+        fills = read_journal(journal, kind='fill')
+        print(f"交易日志已写入 {journal}，共 {len(fills)} 笔成交，用 python journal.py {journal} 查询")
+
+    if screen_report is not None:
+        print(screen_report.summary(backtest_seconds=(time.perf_counter() - t0) / max(1, len(todo))))
     print("该策略的合适标的为如下十只股票:")
     sorted_items = sorted(ranks.items(), key=lambda item: item[1], reverse=True)
     # 打印前10项
     for i, (key, value) in enumerate(sorted_items[:10], start=1):
-        print(f"{i}. {key}: {value:.2f}")
\ No newline at end of file
+        print(f"{i}. {key}: {value:.2f}")
+
+    if recorder:
+        records = read_records(args.profile)
+        print(summarize(records))
+        if args.profile_top:
+            backtests = [r for r in records if r['stage'] == 'backtest']
+            profile_slowest(backtests, args.profile_top, partial(backtest_symbol, start_date=start_date, end_date=end_date, engine=args.engine), tool=args.profiler)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,10 @@ from datetime import datetime
 import backtrader as bt
 
 from utils import preprocess
+from feeds import ArrayData
 from strategy import TailBuy
+from analyzer import Metrics
+from metrics import print_report
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -15,11 +18,7 @@ if __name__ == '__main__':
     
     cerebro = bt.Cerebro()  # 初始化回测系统
     cerebro.addstrategy(TailBuy, printlog=True)  # 将交易策略加载到回测系统中
-    # 添加分析器
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='tradeanalyzer')
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+    cerebro.addanalyzer(Metrics, _name='metrics')  # 添加分析器
 
     start_cash = 100000
     cerebro.broker.setcash(start_cash)  # 设置初始资本为 100000
@@ -34,35 +33,8 @@ if __name__ == '__main__':
     stock_df = preprocess(symbol=args.symbol, adjust="qfq", start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d"))
     if stock_df is None:
         exit()
-    data = bt.feeds.PandasData(dataname=stock_df, fromdate=start_date, todate=end_date)  # 加载数据
+    data = ArrayData(dataname=stock_df, fromdate=start_date, todate=end_date)  # 加载数据
     cerebro.adddata(data)  # 将数据传入回测系统
 
     results = cerebro.run()  # 运行回测系统
-    strategy_stats = results[0]
-
-    # 获取分析结果
-    port_value = cerebro.broker.getvalue()  # 获取回测结束后的总资金
-    cash = cerebro.broker.getcash()
-    pnl = port_value - start_cash  # 盈亏统计
-    sharpe = strategy_stats.analyzers.sharpe.get_analysis()
-    drawdown = strategy_stats.analyzers.drawdown.get_analysis()
-    trade_stats = strategy_stats.analyzers.tradeanalyzer.get_analysis()
-    returns = strategy_stats.analyzers.returns.get_analysis()
-
-    print(f"回测期间: {start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')}")
-    print(f"初始资金: {start_cash}")
-    print(f"总资金: {port_value:.2f}, 含现金 {cash:.2f}")
-    print(f"净收益: {pnl:.2f}")
-    print(f"夏普比率: {sharpe['sharperatio']:.4f}" if sharpe['sharperatio'] is not None else "夏普比率: 无法计算 (None)")
-    print(f"最大回撤: {drawdown.max.drawdown:.2f}%")
-    print(f"总交易数: {trade_stats.total.total}")
-    # 获取赢利交易总数，若不存在则为0
-    won_total = trade_stats.get('won', {}).get('total', 0)
-    # 获取总交易数，若不存在则为0
-    total_total = trade_stats.get('total', {}).get('total', 0)
-    if total_total > 0:
-        win_rate = (won_total / total_total) * 100
-        print(f"胜率: {win_rate:.2f}%")
-    else:
-        print("胜率: 无法计算 (None)")
-    print(f"年化收益率: {returns['rnorm100']:.2f}%")        
\ No newline at end of file
+    print_report(results[0].analyzers.metrics.get_analysis(), start_cash, start_date, end_date)
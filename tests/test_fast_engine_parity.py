@@ -0,0 +1,37 @@
+"""快速引擎与 Cerebro 的逐位一致性：固定种子的随机日线，TailBuy 和 LimitBuy（含 / 不含回撤剪枝）"""
+import pytest
+
+import fast_engine
+from bench import synthetic_frame
+from sweep import DEFAULT_SPACE, random_search
+
+SEEDS = [0, 1]
+BARS = 1000
+COMBOS = 3
+MAX_DRAWDOWN = 1.0  # 百分比，取得足够小，部分参数组合会被剪枝
+
+
+@pytest.fixture(scope="module", params=SEEDS)
+def frame(request):
+    return request.param, synthetic_frame(BARS, seed=request.param)
+
+
+@pytest.mark.parametrize("cash", [100000.0, 20000.0])
+def test_tailbuy(frame, cash):
+    _, stock_df = frame
+    same, fast, reference = fast_engine.verify(stock_df, cash=cash)
+    assert same, (fast, reference)
+    assert reference["total_trades"] > 0
+
+
+@pytest.mark.parametrize("max_drawdown", [None, MAX_DRAWDOWN])
+def test_limitbuy(frame, max_drawdown):
+    seed, stock_df = frame
+    pruned = []
+    for params in random_search(DEFAULT_SPACE, COMBOS, seed=seed):
+        same, fast, reference = fast_engine.verify_limitbuy(stock_df, max_drawdown=max_drawdown, **params)
+        assert same, (params, fast, reference)
+        pruned.append(reference["metrics"].get("pruned"))
+    if max_drawdown is not None:
+        # 至少一组在中途停止，剪枝的路径确实被比较过
+        assert any(pruned)
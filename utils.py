@@ -1,24 +1,111 @@
-import akshare as ak
+import os
+
 import pandas as pd
 
-def preprocess(symbol:str, adjust:str, start_date:str, end_date:str):
-    # 利用 AKShare 获取股票的后复权数据，这里只获取前 7 列
+from cache import BarCache, COLUMNS, factor_series
+from instrument import phase
+
+_cache = None
+
+
+def get_cache():
+    """
+    返回默认的本地日线缓存
+
+    缓存目录由环境变量 QT_CACHE_DIR 指定（默认 data_cache），设置 QT_CACHE=off 可关闭缓存。
+    """
+    global _cache
+    if os.environ.get("QT_CACHE", "on").lower() in ("off", "0", "false"):
+        return None
+    if _cache is None:
+        _cache = BarCache(root=os.environ.get("QT_CACHE_DIR", "data_cache"))
+    return _cache
+
+
+def normalize(raw_df):
+    """把 akshare 返回的日线整理成 Backtrader 需要的格式"""
+    if raw_df is None or raw_df.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    # 只保留前 7 列
+    stock_df = raw_df.iloc[:, :7].copy()
+    # 删除 `股票代码` 列
+    del stock_df['股票代码']
+    # 处理字段命名，以符合 Backtrader 的要求
+    stock_df.columns = COLUMNS
+    # 把 date 作为日期索引，以符合 Backtrader 的要求
+    stock_df.index = pd.to_datetime(stock_df['date'])
+    return stock_df
+
+
+def fetch_hist(symbol:str, adjust:str, start_date:str, end_date:str, fetcher=None):
+    """直接从数据源下载日线，fetcher 默认为 ak.stock_zh_a_hist"""
+    if fetcher is None:
+        import akshare as ak  # akshare 导入需要数秒，只在真正下载时导入
+
+        fetcher = ak.stock_zh_a_hist
+    with phase("fetch"):
+        raw_df = fetcher(symbol=symbol, period="daily", adjust=adjust, start_date=start_date, end_date=end_date)
+    with phase("normalize"):
+        return normalize(raw_df)
+
+
+def _sina_symbol(symbol):
+    """新浪接口的代码带交易所前缀"""
+    if symbol.startswith(("6", "9")):
+        return f"sh{symbol}"
+    if symbol.startswith(("4", "8")):
+        return f"bj{symbol}"
+    return f"sz{symbol}"
+
+
+def fetch_factors(symbol:str, fetcher=None):
+    """下载后复权因子表，fetcher 默认为新浪的 ak.stock_zh_a_daily(adjust="hfq-factor")，否则调用 fetcher.factors"""
+    with phase("fetch"):
+        if fetcher is None:
+            import akshare as ak
+
+            raw_df = ak.stock_zh_a_daily(symbol=_sina_symbol(symbol), adjust="hfq-factor")
+        else:
+            raw_df = fetcher.factors(symbol)
+    return factor_series(raw_df)
+
+
+def factor_fetcher(fetcher=None):
+    """
+    返回 BarCache.load 的 fetch_factors 参数：数据源能提供因子表时缓存只存不复权日线，否则按复权方式分别缓存
+
+    设置环境变量 QT_DERIVE_ADJUST=off 可恢复分别缓存 qfq / hfq 的旧方式。
+    """
+    if os.environ.get("QT_DERIVE_ADJUST", "on").lower() in ("off", "0", "false"):
+        return None
+    if fetcher is not None and not hasattr(fetcher, "factors"):
+        return None
+    return lambda s: fetch_factors(s, fetcher=fetcher)
+
+
+def preprocess(symbol:str, adjust:str, start_date:str, end_date:str, cache=None, fetcher=None):
+    """
+    获取股票日线，优先读取本地缓存，只下载缺失的日期区间
+
+    cache 为 None 时使用默认缓存，为 False 时直接下载；fetcher 可替换数据源（例如 cache.FakeFetcher）。
+    使用缓存时 qfq / hfq 由不复权日线和后复权因子表计算（见 factor_fetcher），同一只股票的历史只下载一次。
+    """
     try:
-        stock_df = ak.stock_zh_a_hist(symbol=symbol, period="daily", adjust=adjust, start_date=start_date, end_date=end_date).iloc[:, :7]
-        # 删除 `股票代码` 列
-        del stock_df['股票代码']
-        # 处理字段命名，以符合 Backtrader 的要求
-        stock_df.columns = [
-            'date',
-            'open',
-            'close',
-            'high',
-            'low',
-            'volume',
-        ]
-        # 把 date 作为日期索引，以符合 Backtrader 的要求
-        stock_df.index = pd.to_datetime(stock_df['date'])
+        if cache is None:
+            cache = get_cache()
+        if cache:
+            # 缓存的读写与合并计入 cache 阶段，其中实际下载的部分计入 fetch / normalize
+            with phase("cache"):
+                stock_df = cache.load(
+                    symbol, adjust, start_date, end_date,
+                    fetch=lambda s, a, lo, hi: fetch_hist(s, a, lo, hi, fetcher=fetcher),
+                    fetch_factors=factor_fetcher(fetcher),
+                )
+        else:
+            stock_df = fetch_hist(symbol, adjust, start_date, end_date, fetcher=fetcher)
+        if stock_df.empty:
+            raise ValueError(f"{symbol} 在 {start_date} ~ {end_date} 没有数据")
         return stock_df
     except Exception as e:
         print(f"获取股票数据时出错: {e}")
-        return None
\ No newline at end of file
+        return None
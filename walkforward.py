@@ -0,0 +1,205 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from utils import preprocess
+from feeds import ArrayData
+from analyzer import Metrics
+from metrics import compute_metrics
+from panel import Panel, open_frames, shared_frames
+from strategy import TailBuy
+from buy_with_limit import LimitBuy
+from sweep import DEFAULT_SPACE, grid_search, parse_param, random_search
+
+START_CASH = 100000
+STRATEGIES = {
+    "tailbuy": (TailBuy, "qfq", {}),  # TailBuy 没有可调参数，只做滚动的样本外评估
+    "limitbuy": (LimitBuy, "hfq", DEFAULT_SPACE),
+}
+
+_frames = {}  # 工作进程内的行情数据（{symbol: DataFrame} 或 panel.PanelFrames），由 _init_worker 在进程启动时设置一次
+
+
+def make_windows(dates, train, test, step=None, anchored=False):
+    """
+    按 K 线数量把日期序列切分成滚动窗口，返回 [(样本内开始, 样本内结束, 样本外开始, 样本外结束)]，均为闭区间
+
+    每次向后移动 step（默认等于 test）根 K 线；anchored 为 True 时样本内窗口的起点固定在第一根 K 线。
+    最后不足 test 根的样本外窗口会被丢弃。step 小于 test 时样本外窗口互相重叠，拼接的资金曲线会重复计算收益和回撤，
+    因此抛出 ValueError。
+    """
+    step = step or test
+    if step < test:
+        raise ValueError(f"step ({step}) 不能小于 test ({test})，否则样本外窗口互相重叠")
+    windows = []
+    lo = 0
+    while lo + train + test <= len(dates):
+        start = 0 if anchored else lo
+        windows.append((dates[start], dates[lo + train - 1], dates[lo + train], dates[lo + train + test - 1]))
+        lo += step
+    return windows
+
+
+def _init_worker(source):
+    # 多进程时传入面板路径，各进程 mmap 同一份文件；之后的任务只传递参数和日期
+    global _frames
+    _frames = open_frames(source)
+
+
+def run_window(task):
+    """在工作进程中对一个窗口回测一组参数，返回 (指标记录, 资金曲线, 日期)"""
+    name, symbol, params, fromdate, todate = task
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(STRATEGIES[name][0], **params)
+    cerebro.addanalyzer(Metrics, _name="metrics")
+    cerebro.broker.setcash(START_CASH)
+    cerebro.broker.setcommission(commission=0.002)
+    cerebro.adddata(ArrayData(dataname=_frames[symbol], fromdate=fromdate, todate=todate))
+    try:
+        analyzer = cerebro.run()[0].analyzers.metrics
+    except Exception as e:
+        return {"error": repr(e)}, None, None
+    return analyzer.get_analysis(), analyzer.equity, analyzer.dates
+
+
+def stitch(curves):
+    """
+    把各样本外窗口的资金曲线首尾相接：每段都从 START_CASH 开始，按上一段的期末资金等比例缩放
+    """
+    equity, dates = [], []
+    scale = 1.0
+    for values, days in curves:
+        if values is None or not values.size:
+            continue
+        equity.append(values * scale)
+        dates.append(days)
+        scale *= values[-1] / START_CASH
+    if not equity:
+        return np.empty(0), np.empty(0, dtype="datetime64[D]")
+    return np.concatenate(equity), np.concatenate(dates)
+
+
+def walk_forward(frames, name, combos, train, test, step=None, anchored=False, workers=1, sort_by="rnorm100"):
+    """
+    对每只股票做滚动的样本内寻优、样本外评估，返回 (每个窗口一行的结果表, 每只股票一行的拼接汇总)
+
+    所有窗口的样本内回测一次性并行执行，再并行执行各窗口最优参数的样本外回测；
+    frames 为 {symbol: preprocess 返回的 DataFrame} 或 panel.Panel，每只股票的数据只加载一次；多进程时写入（或直接使用）
+    内存映射面板，工作进程按路径打开、共享同一份页缓存，窗口通过 fromdate / todate 截取。
+    """
+    combos = list(combos) or [{}]
+    symbols = frames.symbols if isinstance(frames, Panel) else list(frames)
+    frame = frames.frame if isinstance(frames, Panel) else frames.__getitem__
+    windows = {symbol: make_windows(list(frame(symbol).index.to_pydatetime()), train, test, step, anchored)
+               for symbol in symbols}
+    with shared_frames(frames, workers) as source:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source,)) if workers > 1 else None
+        if pool is None:
+            _init_worker(source)
+
+        def run(tasks):
+            if pool is None:
+                return list(map(run_window, tasks))
+            return list(pool.map(run_window, tasks, chunksize=max(1, len(tasks) // (workers * 8))))
+
+        try:
+            keys = [(symbol, i, params) for symbol in symbols for i in range(len(windows[symbol])) for params in combos]
+            results = run([(name, symbol, params, *windows[symbol][i][:2]) for symbol, i, params in keys])
+            best = {}
+            for (symbol, i, params), (record, _, _) in zip(keys, results):
+                if "error" in record or record.get(sort_by) is None:
+                    continue
+                if (symbol, i) not in best or record[sort_by] > best[(symbol, i)][1][sort_by]:
+                    best[(symbol, i)] = (params, record)
+            chosen = sorted(best)
+            outs = run([(name, symbol, best[(symbol, i)][0], *windows[symbol][i][2:]) for symbol, i in chosen])
+        finally:
+            if pool:
+                pool.shutdown()
+
+    rows, curves = [], {}
+    for (symbol, i), (record, equity, dates) in zip(chosen, outs):
+        params, in_sample = best[(symbol, i)]
+        train_start, train_end, test_start, test_end = windows[symbol][i]
+        row = {"symbol": symbol, "window": i, "train_start": train_start.date(), "train_end": train_end.date(),
+               "test_start": test_start.date(), "test_end": test_end.date(), **params,
+               f"is_{sort_by}": in_sample[sort_by]}
+        row.update({f"oos_{k}": v for k, v in record.items()})
+        rows.append(row)
+        curves.setdefault(symbol, []).append((equity, dates))
+
+    summary = []
+    for symbol, parts in curves.items():
+        equity, dates = stitch(parts)
+        oos = [r for r in rows if r["symbol"] == symbol]
+        total = sum(r.get("oos_total_trades", 0) for r in oos)
+        won = sum(r.get("oos_won_trades", 0) for r in oos)
+        exposed = sum(r.get("oos_exposure", 0.0) * e.size / 100 for r, (e, _) in zip(oos, parts) if e is not None)
+        summary.append({
+            "symbol": symbol,
+            "windows": len(oos),
+            "start": dates[0] if dates.size else None,
+            "end": dates[-1] if dates.size else None,
+            **compute_metrics(equity, START_CASH, dates=dates),
+            "total_trades": total,
+            "won_trades": won,
+            "win_rate": won / total * 100 if total else None,
+            "exposure": exposed / equity.size * 100 if equity.size else 0.0,
+        })
+    return pd.DataFrame(rows), pd.DataFrame(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="滚动窗口（walk-forward）回测：样本内寻优、样本外评估并拼接样本外资金曲线")
+    parser.add_argument("--strategy", default="limitbuy", choices=sorted(STRATEGIES))
+    parser.add_argument("--symbols", default="600036", type=str, help="comma separated stock codes")
+    parser.add_argument("--start_date", default="20140101", help="start date of back test")
+    parser.add_argument("--end_date", default="today", type=str, help="choose end date of back test")
+    parser.add_argument("--train", default=750, type=int, help="in-sample window length in bars")
+    parser.add_argument("--test", default=250, type=int, help="out-of-sample window length in bars")
+    parser.add_argument("--step", default=None, type=int, help="bars between windows, default --test, must not be smaller than --test")
+    parser.add_argument("--anchored", action="store_true", help="keep the in-sample start fixed (expanding window)")
+    parser.add_argument("--param", action="append", default=[], help="search space, e.g. open_ratio=0.02,0.03 or grid_ratio=0.03:0.08:0.01")
+    parser.add_argument("--random", default=0, type=int, help="number of random samples, 0 for full grid search")
+    parser.add_argument("--seed", default=None, type=int, help="random seed")
+    parser.add_argument("--workers", default=0, type=int, help="number of worker processes, 0 for all cores")
+    parser.add_argument("--sort", default="rnorm100", help="in-sample metric to maximize")
+    parser.add_argument("--panel", default=None, help="read bars from this panel.py directory instead of the cache; windows cover the whole panel")
+    parser.add_argument("--output", default="walkforward_results.csv", help="per-window results table")
+    parser.add_argument("--summary", default="walkforward_summary.csv", help="stitched out-of-sample summary table")
+    args = parser.parse_args()
+    if args.step is not None and args.step < args.test:
+        parser.error("--step must not be smaller than --test, otherwise the out-of-sample windows overlap")
+
+    date_format = "%Y%m%d"
+    start_date = datetime.strptime(args.start_date, date_format)
+    end_date = datetime.today() if args.end_date == "today" else datetime.strptime(args.end_date, date_format)
+    strategy_cls, adjust, default_space = STRATEGIES[args.strategy]
+    space = dict(parse_param(p) for p in args.param) if args.param else default_space
+    combos = random_search(space, args.random, args.seed) if args.random else grid_search(space)
+
+    if args.panel:
+        frames = Panel(args.panel)
+        if frames.meta["adjust"] != adjust:
+            parser.error(f"--panel {args.panel} 的复权方式为 {frames.meta['adjust'] or 'raw'}，{args.strategy} 需要 {adjust}")
+    else:
+        frames = {}
+        for symbol in args.symbols.split(","):
+            stock_df = preprocess(symbol=symbol, adjust=adjust, start_date=start_date.strftime(date_format), end_date=end_date.strftime(date_format))
+            if stock_df is not None:
+                frames[symbol] = stock_df
+        if not frames:
+            exit()
+
+    table, summary = walk_forward(frames, args.strategy, combos, args.train, args.test, step=args.step,
+                                  anchored=args.anchored, workers=args.workers or os.cpu_count(), sort_by=args.sort)
+    table.to_csv(args.output, index=False)
+    summary.to_csv(args.summary, index=False)
+    print(f"共 {len(table)} 个样本外窗口, 结果已写入 {args.output}, 拼接汇总已写入 {args.summary}")
+    if not summary.empty:
+        print(summary.to_string(index=False))